@@ -13,7 +13,7 @@ from tqdm import tqdm
 from mmaudio.data.data_setup import setup_eval_dataset
 from mmaudio.eval_utils import ModelConfig, all_model_cfg, generate
 from mmaudio.model.flow_matching import FlowMatching
-from mmaudio.model.networks import MMAudio, get_my_mmaudio
+from mmaudio.model.networks import MMAudio, load_my_mmaudio
 from mmaudio.model.utils.features_utils import FeaturesUtils
 
 torch.backends.cuda.matmul.allow_tf32 = True
@@ -45,8 +45,7 @@ def main(cfg: DictConfig):
 
     # load a pretrained model
     seq_cfg.duration = cfg.duration_s
-    net: MMAudio = get_my_mmaudio(cfg.model).to(device).eval()
-    net.load_weights(torch.load(model.model_path, map_location=device, weights_only=True))
+    net: MMAudio = load_my_mmaudio(cfg.model, model.model_path).to(device).eval()
     log.info(f'Loaded weights from {model.model_path}')
     net.update_seq_lengths(seq_cfg.latent_seq_len, seq_cfg.clip_seq_len, seq_cfg.sync_seq_len)
     log.info(f'Latent seq len: {seq_cfg.latent_seq_len}')
@@ -0,0 +1,442 @@
+"""
+Micro-benchmarks of the inference pipeline, e.g.,
+
+    python benchmark.py decode --video long.mp4 --duration 8 --offsets 0 60 120
+    python benchmark.py composite --video clip.mp4 --duration 8
+    python benchmark.py decode_audio --variant large_44k_v2 --durations 8 30 60 --chunk_sec 8
+    python benchmark.py sampler --variant large_44k_v2 --nfe 8 12 16 25 50
+    python benchmark.py step_cache --variant large_44k_v2 --thresholds 0.05 0.1 0.2
+    python benchmark.py guidance --variant large_44k_v2 --intervals 0 1 0 0.6 0.1 0.7
+    python benchmark.py quantized --variants small_16k large_44k_v2 --threads 8
+    python benchmark.py startup --variant large_44k_v2 --repeats 3
+"""
+import copy
+import dataclasses
+import logging
+import multiprocessing
+import resource
+import tempfile
+import time
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+
+import torch
+
+from mmaudio.data.av_utils import reencode_with_audio, remux_with_audio
+from mmaudio.eval_utils import (ModelConfig, all_model_cfg, generate, load_video,
+                                setup_eval_logging)
+from mmaudio.model.buckets import make_bucket
+from mmaudio.model.flow_matching import SCHEDULES, SOLVERS, FlowMatching, get_num_steps
+from mmaudio.model.guidance import CFG_SCHEDULES, GuidanceSchedule
+from mmaudio.model.networks import get_my_mmaudio, load_my_mmaudio
+from mmaudio.model.quantization import quantize_int8
+from mmaudio.model.step_cache import StepCache
+from mmaudio.model.utils.features_utils import FeaturesUtils
+from mmaudio.utils.weight_utils import get_safetensors_path
+
+torch.backends.cuda.matmul.allow_tf32 = True
+torch.backends.cudnn.allow_tf32 = True
+
+log = logging.getLogger()
+
+
+def benchmark_decode(args: Namespace):
+    # with seeking, the decode time should not depend on where the window starts
+    for offset in args.offsets:
+        times = []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            video_info = load_video(args.video,
+                                    args.duration,
+                                    scale_in_decoder=args.scale_in_decoder,
+                                    start_sec=offset)
+            times.append(time.perf_counter() - start)
+        log.info(f'Offset {offset:8.2f}s: {min(times) * 1000:8.1f} ms (best of {args.repeats}); '
+                 f'{len(video_info.clip_frames)} clip frames, '
+                 f'{len(video_info.sync_frames)} sync frames')
+
+
+def benchmark_composite(args: Namespace):
+    video_info = load_video(args.video, args.duration, start_sec=args.start_sec)
+    sampling_rate = 44100
+    audio = torch.randn(1, int(video_info.duration_sec * sampling_rate)).clamp(-1, 1) * 0.1
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_path = Path(tmp_dir) / 'output.mp4'
+        for name, composite in [('remux', remux_with_audio), ('reencode', reencode_with_audio)]:
+            times = []
+            for _ in range(args.repeats):
+                start = time.perf_counter()
+                ok = composite(video_info, output_path, audio, sampling_rate)
+                times.append(time.perf_counter() - start)
+            if ok is False:
+                log.info(f'{name:>8}: not possible for this window')
+            else:
+                log.info(f'{name:>8}: {min(times) * 1000:8.1f} ms (best of {args.repeats})')
+
+
+def _measure(fn, device: torch.device) -> tuple[torch.Tensor, float, float]:
+    # returns the output, the time in seconds, and the peak memory in MB (CUDA only)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+    start = time.perf_counter()
+    output = fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+        peak_memory = torch.cuda.max_memory_allocated() / 2**20
+    else:
+        peak_memory = float('nan')
+    return output, time.perf_counter() - start, peak_memory
+
+
+@torch.inference_mode()
+def benchmark_decode_audio(args: Namespace):
+    model: ModelConfig = all_model_cfg[args.variant]
+    model.download_if_needed()
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    dtype = torch.float32 if args.full_precision else torch.bfloat16
+    if device.type != 'cuda':
+        log.warning('Peak memory is only measured on CUDA')
+
+    feature_utils = FeaturesUtils(tod_vae_ckpt=model.vae_path,
+                                  enable_conditions=False,
+                                  mode=model.mode,
+                                  bigvgan_vocoder_ckpt=model.bigvgan_16k_path,
+                                  need_vae_encoder=False)
+    feature_utils = feature_utils.to(device, dtype).eval()
+
+    chunk_cfg = dataclasses.replace(model.seq_cfg, duration=args.chunk_sec)
+    decode_chunk_size = chunk_cfg.latent_seq_len
+    vocode_chunk_size = chunk_cfg.latent_seq_len * chunk_cfg.latent_downsample_rate
+
+    def decode_and_vocode(chunked: bool) -> torch.Tensor:
+        feature_utils.decode_chunk_size = decode_chunk_size if chunked else None
+        feature_utils.vocode_chunk_size = vocode_chunk_size if chunked else None
+        return feature_utils.vocode(feature_utils.decode(latents)).float()
+
+    for duration in args.durations:
+        seq_cfg = dataclasses.replace(model.seq_cfg, duration=duration)
+        rng = torch.Generator(device=device).manual_seed(0)
+        latents = torch.randn(1,
+                              seq_cfg.latent_seq_len,
+                              feature_utils.tod.vae.embed_dim,
+                              device=device,
+                              dtype=dtype,
+                              generator=rng)
+
+        results = {}
+        for chunked in (False, True):
+            try:
+                results[chunked] = _measure(lambda: decode_and_vocode(chunked), device)
+            except torch.OutOfMemoryError:
+                log.info(f'{duration:5.1f}s {"chunked" if chunked else "one-shot"}: out of memory')
+                torch.cuda.empty_cache()
+                continue
+            _, elapsed, peak_memory = results[chunked]
+            log.info(f'{duration:5.1f}s {"chunked" if chunked else "one-shot":>8}: '
+                     f'{elapsed * 1000:8.1f} ms, peak memory {peak_memory:8.1f} MB')
+
+        if len(results) == 2:
+            one_shot, chunked = results[False][0], results[True][0]
+            max_diff = (one_shot - chunked).abs().max().item()
+            snr = 10 * torch.log10(one_shot.pow(2).mean() / (one_shot - chunked).pow(2).mean())
+            log.info(f'{duration:5.1f}s max abs difference {max_diff:.2e}, SNR {snr.item():.1f} dB')
+
+
+def _get_sampler(args: Namespace):
+    # returns a function that samples the latents of args.prompts from fixed noise, and the device
+    model: ModelConfig = all_model_cfg[args.variant]
+    model.download_if_needed()
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    dtype = torch.float32 if args.full_precision else torch.bfloat16
+
+    net = load_my_mmaudio(model.model_name, model.model_path).to(device, dtype).eval()
+    feature_utils = FeaturesUtils(tod_vae_ckpt=model.vae_path,
+                                  synchformer_ckpt=model.synchformer_ckpt,
+                                  enable_conditions=True,
+                                  mode=model.mode,
+                                  bigvgan_vocoder_ckpt=model.bigvgan_16k_path,
+                                  need_vae_encoder=False)
+    feature_utils = feature_utils.to(device, dtype).eval()
+    bucket = make_bucket(net, model.seq_cfg, args.duration)
+
+    rng = torch.Generator(device=device).manual_seed(args.seed)
+    x0 = torch.randn(len(args.prompts),
+                     bucket.latent_seq_len,
+                     net.latent_dim,
+                     device=device,
+                     dtype=dtype,
+                     generator=rng)
+
+    def sample(fm: FlowMatching, **kwargs) -> torch.Tensor:
+        return generate(None,
+                        None,
+                        args.prompts,
+                        feature_utils=feature_utils,
+                        net=net,
+                        fm=fm,
+                        rng=None,
+                        cfg_strength=args.cfg_strength,
+                        x0=x0,
+                        bucket=bucket,
+                        batched_cfg=True,
+                        decode=False,
+                        **kwargs).float()
+
+    return sample, device
+
+
+def _relative_error(latents: torch.Tensor, reference: torch.Tensor) -> float:
+    return ((latents - reference).norm() / reference.norm()).item()
+
+
+@torch.inference_mode()
+def benchmark_sampler(args: Namespace):
+    # quality is measured as the distance of the sampled latents to reference latents from the
+    # same noise, solved with many euler steps
+    sample, device = _get_sampler(args)
+    reference = sample(FlowMatching(inference_mode='euler', num_steps=args.reference_steps))
+    log.info(f'Reference: euler with {args.reference_steps} steps')
+
+    for nfe in args.nfe:
+        for solver in SOLVERS:
+            num_steps = get_num_steps(solver, nfe)
+            if num_steps is None:
+                continue
+            for schedule in args.schedules:
+                fm = FlowMatching(inference_mode=solver, num_steps=num_steps, schedule=schedule)
+                latents, elapsed, _ = _measure(lambda: sample(fm), device)
+                error = _relative_error(latents, reference)
+                # the network is evaluated twice per function evaluation with CFG
+                log.info(f'NFE {nfe:3d} ({2 * nfe:3d} with CFG) {solver:>13} {schedule:>8}: '
+                         f'relative error {error:.4f}, {elapsed * 1000:8.1f} ms')
+
+
+@torch.inference_mode()
+def benchmark_step_cache(args: Namespace):
+    # compared to sampling with the same solver and steps without the cache
+    sample, device = _get_sampler(args)
+    fm = FlowMatching(inference_mode=args.sampler, num_steps=args.num_steps)
+    reference, reference_time, _ = _measure(lambda: sample(fm), device)
+    log.info(f'{args.sampler} with {args.num_steps} steps: {reference_time * 1000:8.1f} ms')
+
+    for threshold in args.thresholds:
+        step_cache = StepCache(threshold)
+        latents, elapsed, _ = _measure(lambda: sample(fm, step_cache=step_cache), device)
+        log.info(f'Threshold {threshold:5.3f}: skipped {step_cache.skipped_fraction:6.1%} '
+                 f'of the fused blocks, relative error {_relative_error(latents, reference):.4f}, '
+                 f'{elapsed * 1000:8.1f} ms ({reference_time / elapsed:.2f}x)')
+
+
+@torch.inference_mode()
+def benchmark_guidance(args: Namespace):
+    # compared to guidance on every step with the same solver and steps
+    sample, device = _get_sampler(args)
+    fm = FlowMatching(inference_mode=args.sampler, num_steps=args.num_steps)
+    timesteps = fm.get_evaluation_times(0, 1)
+    reference, reference_time, _ = _measure(lambda: sample(fm), device)
+
+    intervals = list(zip(args.intervals[::2], args.intervals[1::2]))
+    for interval in intervals:
+        for schedule in args.cfg_schedules:
+            guidance = GuidanceSchedule(args.cfg_strength, interval, schedule)
+            latents, elapsed, _ = _measure(
+                lambda: sample(fm, cfg_interval=interval, cfg_schedule=schedule), device)
+            log.info(f'Interval [{interval[0]:.2f}, {interval[1]:.2f}] {schedule:>8}: '
+                     f'{guidance.count_network_evals(timesteps):3d} network evaluations, '
+                     f'relative error {_relative_error(latents, reference):.4f}, '
+                     f'{elapsed * 1000:8.1f} ms ({reference_time / elapsed:.2f}x)')
+
+
+@torch.inference_mode()
+def benchmark_quantized(args: Namespace):
+    # CPU throughput and accuracy of predict_flow in int8 vs. float32, on random inputs
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    for variant in args.variants:
+        model: ModelConfig = all_model_cfg[variant]
+        model.download_if_needed()
+        net = load_my_mmaudio(model.model_name, model.model_path).eval()
+        quantized = quantize_int8(copy.deepcopy(net))
+
+        # both CFG branches in one batch
+        bs = args.batch_size * 2
+        rng = torch.Generator().manual_seed(0)
+        clip_f = net.get_empty_clip_sequence(bs) + torch.randn(
+            bs, net.clip_seq_len, net.empty_clip_feat.shape[-1], generator=rng)
+        sync_f = net.get_empty_sync_sequence(bs) + torch.randn(
+            bs, net.sync_seq_len, net.empty_sync_feat.shape[-1], generator=rng)
+        text_f = net.get_empty_string_sequence(bs) + torch.randn(
+            bs, *net.empty_string_feat.shape, generator=rng)
+        latent = torch.randn(bs, net.latent_seq_len, net.latent_dim, generator=rng)
+        t = torch.full((bs, ), 0.5)
+
+        results = {}
+        for name, network in (('float32', net), ('int8', quantized)):
+            conditions = network.preprocess_conditions(clip_f, sync_f, text_f)
+            network.predict_flow(latent, t, conditions)  # warm-up
+            times = []
+            for _ in range(args.repeats):
+                flow, elapsed, _ = _measure(lambda: network.predict_flow(latent, t, conditions),
+                                            torch.device('cpu'))
+                times.append(elapsed)
+            results[name] = (flow, min(times))
+            log.info(f'{variant} {name:>7}: {min(times) * 1000:8.1f} ms per evaluation '
+                     f'of {bs} x {net.latent_seq_len} latents (best of {args.repeats})')
+
+        (reference, reference_time), (flow, elapsed) = results['float32'], results['int8']
+        log.info(f'{variant} int8: {reference_time / elapsed:.2f}x, '
+                 f'relative error of the flow {_relative_error(flow, reference):.4f}')
+
+
+def _load_network(loader: str, variant: str, device: str,
+                  dtype: torch.dtype) -> tuple[float, float]:
+    # runs in a fresh process; returns the load time in seconds and the increase of the peak RSS
+    # in MB (ru_maxrss is in KB on Linux)
+    model: ModelConfig = all_model_cfg[variant]
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if loader == 'legacy':
+        # random initialization, then a full copy of the checkpoint in memory
+        net = get_my_mmaudio(model.model_name)
+        net.load_weights(torch.load(model.model_path, map_location='cpu', weights_only=True))
+    else:
+        net = load_my_mmaudio(model.model_name, model.model_path)
+    net = net.to(device, dtype).eval()
+    if device == 'cuda':
+        torch.cuda.synchronize()
+    elapsed = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return elapsed, (rss_after - rss_before) / 1024
+
+
+def benchmark_startup(args: Namespace):
+    # cold start of the network, each load in a new process so that the peak RSS is its own
+    model: ModelConfig = all_model_cfg[args.variant]
+    model.download_if_needed()
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    dtype = torch.float32 if args.full_precision else torch.bfloat16
+    if get_safetensors_path(model.model_path).exists():
+        log.info(f'Loading from {get_safetensors_path(model.model_path)}')
+    else:
+        log.info(f'{model.model_path} has not been converted (see convert_weights.py); '
+                 'memory-mapping the torch checkpoint')
+
+    context = multiprocessing.get_context('spawn')
+    for loader in ('legacy', 'mmap'):
+        results = []
+        for _ in range(args.repeats):
+            with context.Pool(1) as pool:
+                results.append(pool.apply(_load_network, (loader, args.variant, device, dtype)))
+        times, peak_rss = zip(*results)
+        log.info(f'{loader:>6}: {min(times) * 1000:8.1f} ms, peak RSS +{max(peak_rss):8.1f} MB '
+                 f'(best/worst of {args.repeats}, {dtype} on {device})')
+
+
+def _add_sampling_arguments(parser: ArgumentParser):
+    parser.add_argument('--variant', type=str, default='large_44k_v2')
+    parser.add_argument('--prompts',
+                        type=str,
+                        nargs='+',
+                        default=['rain on a tin roof', 'a dog barking', 'ocean waves'])
+    parser.add_argument('--duration', type=float, default=8.0)
+    parser.add_argument('--cfg_strength', type=float, default=4.5)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--full_precision', action='store_true')
+
+
+def main():
+    setup_eval_logging()
+
+    parser = ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    decode_parser = subparsers.add_parser('decode', help='Video decoding time per window offset')
+    decode_parser.add_argument('--video', type=Path, required=True)
+    decode_parser.add_argument('--duration', type=float, default=8.0)
+    decode_parser.add_argument('--offsets', type=float, nargs='+', default=[0.0])
+    decode_parser.add_argument('--repeats', type=int, default=3)
+    decode_parser.add_argument('--scale_in_decoder', action='store_true')
+    decode_parser.set_defaults(func=benchmark_decode)
+
+    composite_parser = subparsers.add_parser('composite',
+                                              help='Remuxing vs. re-encoding the output video')
+    composite_parser.add_argument('--video', type=Path, required=True)
+    composite_parser.add_argument('--duration', type=float, default=8.0)
+    composite_parser.add_argument('--start_sec', type=float, default=0.0)
+    composite_parser.add_argument('--repeats', type=int, default=3)
+    composite_parser.set_defaults(func=benchmark_composite)
+
+    decode_audio_parser = subparsers.add_parser(
+        'decode_audio', help='Peak memory of one-shot vs. chunked VAE decoding and vocoding')
+    decode_audio_parser.add_argument('--variant', type=str, default='large_44k_v2')
+    decode_audio_parser.add_argument('--durations', type=float, nargs='+', default=[8, 30, 60])
+    decode_audio_parser.add_argument('--chunk_sec', type=float, default=8.0)
+    decode_audio_parser.add_argument('--full_precision', action='store_true')
+    decode_audio_parser.set_defaults(func=benchmark_decode_audio)
+
+    sampler_parser = subparsers.add_parser(
+        'sampler', help='Quality vs. number of function evaluations of the ODE solvers')
+    _add_sampling_arguments(sampler_parser)
+    sampler_parser.add_argument('--nfe', type=int, nargs='+', default=[8, 12, 16, 25, 50])
+    sampler_parser.add_argument('--schedules',
+                                type=str,
+                                nargs='+',
+                                choices=SCHEDULES,
+                                default=list(SCHEDULES))
+    sampler_parser.add_argument('--reference_steps', type=int, default=200)
+    sampler_parser.set_defaults(func=benchmark_sampler)
+
+    step_cache_parser = subparsers.add_parser(
+        'step_cache', help='Skipped fused blocks, quality and speed of the step cache')
+    _add_sampling_arguments(step_cache_parser)
+    step_cache_parser.add_argument('--sampler', type=str, default='euler', choices=list(SOLVERS))
+    step_cache_parser.add_argument('--num_steps', type=int, default=25)
+    step_cache_parser.add_argument('--thresholds',
+                                   type=float,
+                                   nargs='+',
+                                   default=[0.02, 0.05, 0.1, 0.2, 0.4])
+    step_cache_parser.set_defaults(func=benchmark_step_cache)
+
+    guidance_parser = subparsers.add_parser(
+        'guidance', help='Network evaluations, quality and speed of guidance intervals')
+    _add_sampling_arguments(guidance_parser)
+    guidance_parser.add_argument('--sampler', type=str, default='euler', choices=list(SOLVERS))
+    guidance_parser.add_argument('--num_steps', type=int, default=25)
+    guidance_parser.add_argument('--intervals',
+                                 type=float,
+                                 nargs='+',
+                                 default=[0, 1, 0, 0.6, 0.1, 0.7, 0.2, 0.8],
+                                 help='Pairs of interval starts and ends')
+    guidance_parser.add_argument('--cfg_schedules',
+                                 type=str,
+                                 nargs='+',
+                                 choices=CFG_SCHEDULES,
+                                 default=list(CFG_SCHEDULES))
+    guidance_parser.set_defaults(func=benchmark_guidance)
+
+    quantized_parser = subparsers.add_parser(
+        'quantized', help='CPU throughput and accuracy of the int8 network')
+    quantized_parser.add_argument('--variants',
+                                  type=str,
+                                  nargs='+',
+                                  default=['small_16k', 'large_44k_v2'])
+    quantized_parser.add_argument('--batch_size', type=int, default=1)
+    quantized_parser.add_argument('--repeats', type=int, default=3)
+    quantized_parser.add_argument('--threads', type=int, default=None)
+    quantized_parser.set_defaults(func=benchmark_quantized)
+
+    startup_parser = subparsers.add_parser(
+        'startup', help='Cold-start time and peak RSS of loading the network')
+    startup_parser.add_argument('--variant', type=str, default='large_44k_v2')
+    startup_parser.add_argument('--repeats', type=int, default=3)
+    startup_parser.add_argument('--full_precision', action='store_true')
+    startup_parser.set_defaults(func=benchmark_startup)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""
+Converts the checkpoints of the given variants to safetensors, next to the original files.
+The loaders pick up the converted files automatically and memory-map them, e.g.,
+
+    python convert_weights.py --variants large_44k_v2
+"""
+import logging
+from argparse import ArgumentParser
+
+from mmaudio.eval_utils import ModelConfig, all_model_cfg, setup_eval_logging
+from mmaudio.utils.weight_utils import convert_to_safetensors, get_safetensors_path
+
+log = logging.getLogger()
+
+
+def main():
+    setup_eval_logging()
+
+    parser = ArgumentParser()
+    parser.add_argument('--variants', type=str, nargs='+', default=['large_44k_v2'])
+    parser.add_argument('--overwrite', action='store_true')
+    args = parser.parse_args()
+
+    for variant in args.variants:
+        if variant not in all_model_cfg:
+            raise ValueError(f'Unknown model variant: {variant}')
+        model: ModelConfig = all_model_cfg[variant]
+        model.download_if_needed()
+
+        checkpoints = [(model.model_path, None), (model.vae_path, None),
+                       (model.synchformer_ckpt, None)]
+        if model.bigvgan_16k_path is not None:
+            # the vocoder checkpoint also holds the training state besides the generator
+            checkpoints.append((model.bigvgan_16k_path, 'generator'))
+
+        for path, key in checkpoints:
+            if get_safetensors_path(path).exists() and not args.overwrite:
+                log.info(f'{get_safetensors_path(path)} already exists')
+                continue
+            convert_to_safetensors(path, key=key)
+
+
+if __name__ == '__main__':
+    main()
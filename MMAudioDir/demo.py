@@ -1,14 +1,20 @@
 import logging
 from argparse import ArgumentParser
+from fractions import Fraction
 from pathlib import Path
+from typing import Optional
 
+import av
 import torch
 import torchaudio
 
-from mmaudio.eval_utils import (ModelConfig, all_model_cfg, generate, load_video, make_video,
+from mmaudio.data.av_utils import VideoInfo
+from mmaudio.eval_utils import (ModelConfig, all_model_cfg, generate, generate_long,
+                                get_video_window_features_fn, load_video, make_video,
                                 setup_eval_logging)
-from mmaudio.model.flow_matching import FlowMatching
-from mmaudio.model.networks import MMAudio, get_my_mmaudio
+from mmaudio.model.flow_matching import SCHEDULES, SOLVERS, FlowMatching
+from mmaudio.model.networks import MMAudio, load_my_mmaudio
+from mmaudio.model.quantization import quantize_int8
 from mmaudio.model.utils.features_utils import FeaturesUtils
 
 torch.backends.cuda.matmul.allow_tf32 = True
@@ -32,6 +38,8 @@ def main():
     parser.add_argument('--duration', type=float, default=8.0)
     parser.add_argument('--cfg_strength', type=float, default=4.5)
     parser.add_argument('--num_steps', type=int, default=25)
+    parser.add_argument('--sampler', type=str, default='euler', choices=list(SOLVERS))
+    parser.add_argument('--schedule', type=str, default='uniform', choices=SCHEDULES)
 
     parser.add_argument('--mask_away_clip', action='store_true')
 
@@ -39,6 +47,14 @@ def main():
     parser.add_argument('--seed', type=int, help='Random seed', default=42)
     parser.add_argument('--skip_video_composite', action='store_true')
     parser.add_argument('--full_precision', action='store_true')
+    parser.add_argument('--quantize',
+                        action='store_true',
+                        help='Run the network in int8 on the CPU')
+    parser.add_argument('--window_sec',
+                        type=float,
+                        default=None,
+                        help='Generate durations longer than this in overlapping windows')
+    parser.add_argument('--overlap_sec', type=float, default=2.0)
 
     args = parser.parse_args()
 
@@ -53,35 +69,38 @@ def main():
     else:
         video_path = None
     prompt: str = args.prompt
-    negative_prompt: str = args.negative_prompt
     output_dir: str = args.output.expanduser()
     seed: int = args.seed
     num_steps: int = args.num_steps
     duration: float = args.duration
-    cfg_strength: float = args.cfg_strength
     skip_video_composite: bool = args.skip_video_composite
-    mask_away_clip: bool = args.mask_away_clip
 
     device = 'cpu'
-    if torch.cuda.is_available():
+    if args.quantize:
+        log.info('Running the int8 network on the CPU')
+    elif torch.cuda.is_available():
         device = 'cuda'
     elif torch.backends.mps.is_available():
         device = 'mps'
     else:
         log.warning('CUDA/MPS are not available, running on CPU')
-    dtype = torch.float32 if args.full_precision else torch.bfloat16
+    dtype = torch.float32 if args.full_precision or args.quantize else torch.bfloat16
 
     output_dir.mkdir(parents=True, exist_ok=True)
 
     # load a pretrained model
-    net: MMAudio = get_my_mmaudio(model.model_name).to(device, dtype).eval()
-    net.load_weights(torch.load(model.model_path, map_location=device, weights_only=True))
+    net: MMAudio = load_my_mmaudio(model.model_name, model.model_path).to(device, dtype).eval()
     log.info(f'Loaded weights from {model.model_path}')
+    if args.quantize:
+        net = quantize_int8(net)
 
     # misc setup
     rng = torch.Generator(device=device)
     rng.manual_seed(seed)
-    fm = FlowMatching(min_sigma=0, inference_mode='euler', num_steps=num_steps)
+    fm = FlowMatching(min_sigma=0,
+                      inference_mode=args.sampler,
+                      num_steps=num_steps,
+                      schedule=args.schedule)
 
     feature_utils = FeaturesUtils(tod_vae_ckpt=model.vae_path,
                                   synchformer_ckpt=model.synchformer_ckpt,
@@ -91,6 +110,86 @@ def main():
                                   need_vae_encoder=False)
     feature_utils = feature_utils.to(device, dtype).eval()
 
+    if args.window_sec is not None and duration > args.window_sec:
+        audio, video_info = generate_long_form(args, model, video_path, duration, feature_utils,
+                                               net, fm, rng)
+    else:
+        audio, video_info = generate_short(args, model, video_path, duration, feature_utils, net,
+                                           fm, rng)
+
+    if video_path is not None:
+        save_path = output_dir / f'{video_path.stem}.flac'
+    else:
+        safe_filename = prompt.replace(' ', '_').replace('/', '_').replace('.', '')
+        save_path = output_dir / f'{safe_filename}.flac'
+    torchaudio.save(save_path, audio, seq_cfg.sampling_rate)
+
+    log.info(f'Audio saved to {save_path}')
+    if video_path is not None and not skip_video_composite:
+        video_save_path = output_dir / f'{video_path.stem}.mp4'
+        make_video(video_info, video_save_path, audio, sampling_rate=seq_cfg.sampling_rate)
+        log.info(f'Video saved to {output_dir / video_save_path}')
+
+    log.info('Memory usage: %.2f GB', torch.cuda.max_memory_allocated() / (2**30))
+
+
+def generate_long_form(args, model: ModelConfig, video_path: Path, duration: float,
+                       feature_utils: FeaturesUtils, net: MMAudio, fm: FlowMatching,
+                       rng: torch.Generator) -> tuple[torch.Tensor, Optional[VideoInfo]]:
+    seq_cfg = model.seq_cfg
+    get_features = None
+    if video_path is not None:
+        log.info(f'Using video {video_path}')
+        with av.open(video_path) as container:
+            stream = container.streams.video[0]
+            fps = Fraction(stream.average_rate)
+            if stream.duration is not None:
+                video_duration = float(stream.duration * stream.time_base)
+            else:
+                video_duration = container.duration / av.time_base
+        if video_duration < duration:
+            log.info(f'The video is only {video_duration:.1f}s long')
+            duration = video_duration
+        get_features = get_video_window_features_fn(video_path,
+                                                    feature_utils,
+                                                    mask_away_clip=args.mask_away_clip)
+    else:
+        log.info('No video provided -- text-to-audio mode')
+
+    log.info(f'Prompt: {args.prompt}')
+    log.info(f'Negative prompt: {args.negative_prompt}')
+    audio = generate_long(get_features,
+                          args.prompt,
+                          negative_text=args.negative_prompt,
+                          duration=duration,
+                          seq_cfg=seq_cfg,
+                          feature_utils=feature_utils,
+                          net=net,
+                          fm=fm,
+                          rng=rng,
+                          cfg_strength=args.cfg_strength,
+                          window_sec=args.window_sec,
+                          overlap_sec=args.overlap_sec)
+
+    video_info = None
+    if video_path is not None:
+        # only used for compositing, which decodes the frames again from the source
+        video_info = VideoInfo(duration_sec=duration,
+                               fps=fps,
+                               clip_frames=None,
+                               sync_frames=None,
+                               source_path=video_path)
+    return audio.float().cpu(), video_info
+
+
+def generate_short(args, model: ModelConfig, video_path: Path, duration: float,
+                   feature_utils: FeaturesUtils, net: MMAudio, fm: FlowMatching,
+                   rng: torch.Generator) -> tuple[torch.Tensor, Optional[VideoInfo]]:
+    seq_cfg = model.seq_cfg
+    prompt = args.prompt
+    negative_prompt = args.negative_prompt
+    mask_away_clip = args.mask_away_clip
+    video_info = None
     if video_path is not None:
         log.info(f'Using video {video_path}')
         video_info = load_video(video_path, duration)
@@ -119,22 +218,8 @@ def main():
                       net=net,
                       fm=fm,
                       rng=rng,
-                      cfg_strength=cfg_strength)
-    audio = audios.float().cpu()[0]
-    if video_path is not None:
-        save_path = output_dir / f'{video_path.stem}.flac'
-    else:
-        safe_filename = prompt.replace(' ', '_').replace('/', '_').replace('.', '')
-        save_path = output_dir / f'{safe_filename}.flac'
-    torchaudio.save(save_path, audio, seq_cfg.sampling_rate)
-
-    log.info(f'Audio saved to {save_path}')
-    if video_path is not None and not skip_video_composite:
-        video_save_path = output_dir / f'{video_path.stem}.mp4'
-        make_video(video_info, video_save_path, audio, sampling_rate=seq_cfg.sampling_rate)
-        log.info(f'Video saved to {output_dir / video_save_path}')
-
-    log.info('Memory usage: %.2f GB', torch.cuda.max_memory_allocated() / (2**30))
+                      cfg_strength=args.cfg_strength)
+    return audios.float().cpu()[0], video_info
 
 
 if __name__ == '__main__':
@@ -9,8 +9,9 @@ import torchaudio
 
 from mmaudio.eval_utils import (ModelConfig, VideoInfo, all_model_cfg, generate, load_image,
                                 load_video, make_video, setup_eval_logging)
+from mmaudio.model.buckets import make_bucket
 from mmaudio.model.flow_matching import FlowMatching
-from mmaudio.model.networks import MMAudio, get_my_mmaudio
+from mmaudio.model.networks import MMAudio, load_my_mmaudio
 from mmaudio.model.sequence_config import SequenceConfig
 from mmaudio.model.utils.features_utils import FeaturesUtils
 
@@ -38,8 +39,7 @@ setup_eval_logging()
 def get_model() -> tuple[MMAudio, FeaturesUtils, SequenceConfig]:
     seq_cfg = model.seq_cfg
 
-    net: MMAudio = get_my_mmaudio(model.model_name).to(device, dtype).eval()
-    net.load_weights(torch.load(model.model_path, map_location=device, weights_only=True))
+    net: MMAudio = load_my_mmaudio(model.model_name, model.model_path).to(device, dtype).eval()
     log.info(f'Loaded weights from {model.model_path}')
 
     feature_utils = FeaturesUtils(tod_vae_ckpt=model.vae_path,
@@ -73,8 +73,8 @@ def video_to_audio(video: gr.Video, prompt: str, negative_prompt: str, seed: int
     duration = video_info.duration_sec
     clip_frames = clip_frames.unsqueeze(0)
     sync_frames = sync_frames.unsqueeze(0)
-    seq_cfg.duration = duration
-    net.update_seq_lengths(seq_cfg.latent_seq_len, seq_cfg.clip_seq_len, seq_cfg.sync_seq_len)
+    # keep the sequence lengths outside of the shared network
+    bucket = make_bucket(net, seq_cfg, duration)
 
     audios = generate(clip_frames,
                       sync_frames, [prompt],
@@ -83,7 +83,8 @@ def video_to_audio(video: gr.Video, prompt: str, negative_prompt: str, seed: int
                       net=net,
                       fm=fm,
                       rng=rng,
-                      cfg_strength=cfg_strength)
+                      cfg_strength=cfg_strength,
+                      bucket=bucket)
     audio = audios.float().cpu()[0]
 
     current_time_string = datetime.now().strftime('%Y%m%d_%H%M%S')
@@ -109,8 +110,8 @@ def image_to_audio(image: gr.Image, prompt: str, negative_prompt: str, seed: int
     sync_frames = image_info.sync_frames
     clip_frames = clip_frames.unsqueeze(0)
     sync_frames = sync_frames.unsqueeze(0)
-    seq_cfg.duration = duration
-    net.update_seq_lengths(seq_cfg.latent_seq_len, seq_cfg.clip_seq_len, seq_cfg.sync_seq_len)
+    # keep the sequence lengths outside of the shared network
+    bucket = make_bucket(net, seq_cfg, duration)
 
     audios = generate(clip_frames,
                       sync_frames, [prompt],
@@ -120,7 +121,8 @@ def image_to_audio(image: gr.Image, prompt: str, negative_prompt: str, seed: int
                       fm=fm,
                       rng=rng,
                       cfg_strength=cfg_strength,
-                      image_input=True)
+                      image_input=True,
+                      bucket=bucket)
     audio = audios.float().cpu()[0]
 
     current_time_string = datetime.now().strftime('%Y%m%d_%H%M%S')
@@ -143,8 +145,8 @@ def text_to_audio(prompt: str, negative_prompt: str, seed: int, num_steps: int,
     fm = FlowMatching(min_sigma=0, inference_mode='euler', num_steps=num_steps)
 
     clip_frames = sync_frames = None
-    seq_cfg.duration = duration
-    net.update_seq_lengths(seq_cfg.latent_seq_len, seq_cfg.clip_seq_len, seq_cfg.sync_seq_len)
+    # keep the sequence lengths outside of the shared network
+    bucket = make_bucket(net, seq_cfg, duration)
 
     audios = generate(clip_frames,
                       sync_frames, [prompt],
@@ -153,7 +155,8 @@ def text_to_audio(prompt: str, negative_prompt: str, seed: int, num_steps: int,
                       net=net,
                       fm=fm,
                       rng=rng,
-                      cfg_strength=cfg_strength)
+                      cfg_strength=cfg_strength,
+                      bucket=bucket)
     audio = audios.float().cpu()[0]
 
     current_time_string = datetime.now().strftime('%Y%m%d_%H%M%S')
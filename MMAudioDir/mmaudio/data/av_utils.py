@@ -1,7 +1,8 @@
+import math
 from dataclasses import dataclass
 from fractions import Fraction
 from pathlib import Path
-from typing import Optional
+from typing import Iterator, Optional, Union
 
 import av
 import numpy as np
@@ -11,30 +12,51 @@ from av import AudioFrame
 
 @dataclass
 class VideoInfo:
+    """
+    The frames for compositing are not kept in memory: they are decoded again from
+    [start_sec, start_sec + duration_sec] of source_path when iterated over,
+    or repeat still_frame for image inputs.
+    """
     duration_sec: float
     fps: Fraction
     clip_frames: torch.Tensor
     sync_frames: torch.Tensor
-    all_frames: Optional[list[np.ndarray]]
+    source_path: Optional[Path] = None
+    start_sec: float = 0.0
+    still_frame: Optional[np.ndarray] = None
+
+    def _get_size(self) -> tuple[int, int]:
+        if self.still_frame is not None:
+            return self.still_frame.shape[0], self.still_frame.shape[1]
+        with av.open(self.source_path) as container:
+            stream = container.streams.video[0]
+            return stream.height, stream.width
 
     @property
     def height(self):
-        return self.all_frames[0].shape[0]
+        return self._get_size()[0]
 
     @property
     def width(self):
-        return self.all_frames[0].shape[1]
+        return self._get_size()[1]
+
+    def iter_frames(self) -> Iterator[av.VideoFrame]:
+        if self.still_frame is not None:
+            frame = av.VideoFrame.from_ndarray(self.still_frame)
+            for _ in range(int(self.duration_sec * self.fps)):
+                yield frame
+        else:
+            yield from iter_frames(self.source_path, self.start_sec,
+                                   self.start_sec + self.duration_sec)
 
     @classmethod
     def from_image_info(cls, image_info: 'ImageInfo', duration_sec: float,
                         fps: Fraction) -> 'VideoInfo':
-        num_frames = int(duration_sec * fps)
-        all_frames = [image_info.original_frame] * num_frames
         return cls(duration_sec=duration_sec,
                    fps=fps,
                    clip_frames=image_info.clip_frames,
                    sync_frames=image_info.sync_frames,
-                   all_frames=all_frames)
+                   still_frame=image_info.original_frame)
 
 
 @dataclass
@@ -52,31 +74,45 @@ class ImageInfo:
         return self.original_frame.shape[1]
 
 
-def read_frames(video_path: Path, list_of_fps: list[float], start_sec: float, end_sec: float,
-                need_all_frames: bool) -> tuple[list[np.ndarray], list[np.ndarray], Fraction]:
+def seek_to(container: 'av.container.InputContainer', stream: 'av.VideoStream',
+            start_sec: float) -> None:
+    # jump to the last keyframe at or before start_sec so that the frames before it are
+    # neither demuxed nor decoded; the caller still skips the frames up to start_sec
+    if start_sec <= 0:
+        return
+    try:
+        container.seek(int(start_sec / stream.time_base), stream=stream, backward=True)
+    except av.FFmpegError:
+        # not seekable; the frames before start_sec are decoded and skipped instead
+        pass
+
+
+def read_frames(video_path: Path, list_of_fps: list[float], start_sec: float,
+                end_sec: float) -> tuple[list[np.ndarray], Fraction]:
+    """
+    Decodes the frames in [start_sec, end_sec] and samples them at each of list_of_fps.
+    Seeks to the keyframe before start_sec and stops demuxing after end_sec.
+    """
     output_frames = [[] for _ in list_of_fps]
-    next_frame_time_for_each_fps = [0.0 for _ in list_of_fps]
+    next_frame_time_for_each_fps = [start_sec for _ in list_of_fps]
     time_delta_for_each_fps = [1 / fps for fps in list_of_fps]
-    all_frames = []
 
-    # container = av.open(video_path)
     with av.open(video_path) as container:
         stream = container.streams.video[0]
         fps = stream.guessed_rate
         stream.thread_type = 'AUTO'
+        seek_to(container, stream, start_sec)
+        finished = False
         for packet in container.demux(stream):
             for frame in packet.decode():
                 frame_time = frame.time
                 if frame_time < start_sec:
                     continue
                 if frame_time > end_sec:
+                    finished = True
                     break
 
                 frame_np = None
-                if need_all_frames:
-                    frame_np = frame.to_ndarray(format='rgb24')
-                    all_frames.append(frame_np)
-
                 for i, _ in enumerate(list_of_fps):
                     this_time = frame_time
                     while this_time >= next_frame_time_for_each_fps[i]:
@@ -85,9 +121,110 @@ def read_frames(video_path: Path, list_of_fps: list[float], start_sec: float, en
 
                         output_frames[i].append(frame_np)
                         next_frame_time_for_each_fps[i] += time_delta_for_each_fps[i]
+            if finished:
+                break
 
     output_frames = [np.stack(frames) for frames in output_frames]
-    return output_frames, all_frames, fps
+    return output_frames, fps
+
+
+def _get_scaling(width: int, height: int,
+                 size: Union[int, tuple[int, int]]) -> tuple[int, int, int, int, int, int]:
+    # returns the scaled width/height and the crop (top, left, height, width) of the output
+    if isinstance(size, int):
+        # resize the short side and center crop, as torchvision's Resize(size) + CenterCrop(size)
+        if width <= height:
+            scaled_w, scaled_h = size, int(size * height / width)
+        else:
+            scaled_w, scaled_h = int(size * width / height), size
+        top = int(round((scaled_h - size) / 2.0))
+        left = int(round((scaled_w - size) / 2.0))
+        return scaled_w, scaled_h, top, left, size, size
+    out_h, out_w = size
+    return out_w, out_h, 0, 0, out_h, out_w
+
+
+def read_frames_scaled(video_path: Path, list_of_fps: list[float],
+                       list_of_sizes: list[Union[int, tuple[int, int]]], start_sec: float,
+                       end_sec: float) -> tuple[list[np.ndarray], Fraction]:
+    """
+    Same as read_frames, but each output is resized by libav's scaler while decoding and written
+    into a preallocated uint8 array of shape (ceil((end_sec - start_sec) * fps), H, W, 3),
+    so that memory and time scale with the output sizes instead of the source resolution.
+    An int size resizes the short side to it and center crops a square;
+    a (height, width) size resizes to exactly that.
+    The outputs of videos that are too short are truncated views of the arrays.
+    """
+    out_sizes = [(size, size) if isinstance(size, int) else size for size in list_of_sizes]
+    capacities = [math.ceil((end_sec - start_sec) * fps) for fps in list_of_fps]
+    output_frames = [
+        np.empty((capacity, h, w, 3), dtype=np.uint8)
+        for capacity, (h, w) in zip(capacities, out_sizes)
+    ]
+    num_frames = [0 for _ in list_of_fps]
+    next_frame_time_for_each_fps = [start_sec for _ in list_of_fps]
+    time_delta_for_each_fps = [1 / fps for fps in list_of_fps]
+    scalings = None
+
+    with av.open(video_path) as container:
+        stream = container.streams.video[0]
+        fps = stream.guessed_rate
+        stream.thread_type = 'AUTO'
+        seek_to(container, stream, start_sec)
+        finished = False
+        for packet in container.demux(stream):
+            for frame in packet.decode():
+                frame_time = frame.time
+                if frame_time < start_sec:
+                    continue
+                if frame_time > end_sec:
+                    finished = True
+                    break
+
+                if scalings is None:
+                    scalings = [
+                        _get_scaling(frame.width, frame.height, size) for size in list_of_sizes
+                    ]
+
+                for i, (scaled_w, scaled_h, top, left, h, w) in enumerate(scalings):
+                    scaled = None
+                    while (frame_time >= next_frame_time_for_each_fps[i]
+                           and num_frames[i] < capacities[i]):
+                        if scaled is None:
+                            scaled = frame.reformat(scaled_w,
+                                                    scaled_h,
+                                                    format='rgb24',
+                                                    interpolation='BICUBIC').to_ndarray()
+                            scaled = scaled[top:top + h, left:left + w]
+                        output_frames[i][num_frames[i]] = scaled
+                        num_frames[i] += 1
+                        next_frame_time_for_each_fps[i] += time_delta_for_each_fps[i]
+
+                if all(n == capacity for n, capacity in zip(num_frames, capacities)):
+                    finished = True
+                    break
+            if finished:
+                break
+
+    output_frames = [frames[:n] for frames, n in zip(output_frames, num_frames)]
+    return output_frames, fps
+
+
+def iter_frames(video_path: Path, start_sec: float, end_sec: float) -> Iterator[av.VideoFrame]:
+    """
+    Yields the decoded frames in [start_sec, end_sec] one at a time
+    """
+    with av.open(video_path) as container:
+        stream = container.streams.video[0]
+        stream.thread_type = 'AUTO'
+        seek_to(container, stream, start_sec)
+        for packet in container.demux(stream):
+            for frame in packet.decode():
+                if frame.time < start_sec:
+                    continue
+                if frame.time > end_sec:
+                    return
+                yield frame
 
 
 def reencode_with_audio(video_info: VideoInfo, output_path: Path, audio: torch.Tensor,
@@ -101,10 +238,12 @@ def reencode_with_audio(video_info: VideoInfo, output_path: Path, audio: torch.T
 
     output_audio_stream = container.add_stream('aac', sampling_rate)
 
-    # encode video
-    for image in video_info.all_frames:
-        image = av.VideoFrame.from_ndarray(image)
-        packet = output_video_stream.encode(image)
+    # encode video; the frames are streamed from the decoder and converted to yuv420p by the
+    # encoder, so only a few frames are in memory at any time
+    for frame in video_info.iter_frames():
+        # let the encoder assign the timestamps at the output frame rate
+        frame.pts = None
+        packet = output_video_stream.encode(frame)
         container.mux(packet)
 
     for packet in output_video_stream.encode():
@@ -124,39 +263,78 @@ def reencode_with_audio(video_info: VideoInfo, output_path: Path, audio: torch.T
     container.close()
 
 
-def remux_with_audio(video_path: Path, audio: torch.Tensor, output_path: Path, sampling_rate: int):
+def remux_with_audio(video_info: VideoInfo, output_path: Path, audio: torch.Tensor,
+                     sampling_rate: int) -> bool:
     """
-    NOTE: I don't think we can get the exact video duration right without re-encoding
-    so we are not using this but keeping it here for reference
+    Copies the compressed video packets of the window and only encodes the audio.
+    The window can only be cut without re-encoding if it starts at a keyframe; the partial GOP
+    before the next keyframe is not re-encoded, since the encoder's parameter sets would not
+    match those of the copied packets. Returns False without leaving an output file in that case,
+    or if the output container cannot hold the video codec; composite with reencode_with_audio
+    instead.
+    At the end of the window, the frames up to end_sec are kept together with the frames they
+    refer to, so that the video can run a frame or two past the audio with B-frames.
     """
-    video = av.open(video_path)
-    output = av.open(output_path, 'w')
-    input_video_stream = video.streams.video[0]
-    output_video_stream = output.add_stream(template=input_video_stream)
-    output_audio_stream = output.add_stream('aac', sampling_rate)
-
-    duration_sec = audio.shape[-1] / sampling_rate
-
-    for packet in video.demux(input_video_stream):
-        # We need to skip the "flushing" packets that `demux` generates.
-        if packet.dts is None:
-            continue
-        # We need to assign the packet to the new stream.
-        packet.stream = output_video_stream
-        output.mux(packet)
-
-    # convert float tensor audio to numpy array
-    audio_np = audio.numpy().astype(np.float32)
-    audio_frame = av.AudioFrame.from_ndarray(audio_np, format='flt', layout='mono')
-    audio_frame.sample_rate = sampling_rate
-
-    for packet in output_audio_stream.encode(audio_frame):
-        output.mux(packet)
-
-    for packet in output_audio_stream.encode():
-        output.mux(packet)
-
-    video.close()
-    output.close()
-
-    output.close()
+    if video_info.source_path is None:
+        return False
+
+    start_sec = video_info.start_sec
+    end_sec = start_sec + video_info.duration_sec
+    # timestamps within half a frame of a cut count as on it
+    tolerance = 0.5 / float(video_info.fps)
+
+    with av.open(video_info.source_path) as video:
+        input_video_stream = video.streams.video[0]
+        seek_to(video, input_video_stream, start_sec)
+
+        packets = []
+        for packet in video.demux(input_video_stream):
+            # skip the "flushing" packets that `demux` generates
+            if packet.dts is None or packet.pts is None:
+                continue
+            packet_time = float(packet.pts * packet.time_base)
+            if not packets and (not packet.is_keyframe or abs(packet_time - start_sec) > tolerance):
+                return False
+            # pts >= dts, so no later packet (in decoding order) is shown inside the window
+            if float(packet.dts * packet.time_base) >= end_sec - tolerance:
+                break
+            if packet_time < start_sec - tolerance:
+                # a leading B-frame of an open GOP, which refers to the previous GOP
+                continue
+            packets.append(packet)
+
+        # drop the trailing packets that are only shown after the window; the earlier ones
+        # are references of the frames inside it
+        while packets and float(packets[-1].pts * packets[-1].time_base) >= end_sec - tolerance:
+            packets.pop()
+        if not packets:
+            return False
+
+        # the output starts at 0
+        offset = packets[0].pts if start_sec > 0 else 0
+        try:
+            with av.open(output_path, 'w') as output:
+                output_video_stream = output.add_stream_from_template(input_video_stream)
+                output_audio_stream = output.add_stream('aac', sampling_rate)
+
+                for packet in packets:
+                    packet.pts -= offset
+                    packet.dts -= offset
+                    # assign the packet to the new stream
+                    packet.stream = output_video_stream
+                    output.mux(packet)
+
+                # convert float tensor audio to numpy array
+                audio_np = audio.numpy().astype(np.float32)
+                audio_frame = AudioFrame.from_ndarray(audio_np, format='flt', layout='mono')
+                audio_frame.sample_rate = sampling_rate
+
+                for packet in output_audio_stream.encode(audio_frame):
+                    output.mux(packet)
+
+                for packet in output_audio_stream.encode():
+                    output.mux(packet)
+        except (av.FFmpegError, ValueError):
+            Path(output_path).unlink(missing_ok=True)
+            return False
+    return True
@@ -0,0 +1,96 @@
+import dataclasses
+import hashlib
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Optional, Union
+
+import torch
+
+log = logging.getLogger()
+
+
+def hash_file(path: Union[str, Path], chunk_size: int = 1 << 20) -> str:
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+@dataclasses.dataclass
+class VideoFeatures:
+    clip_features: Optional[torch.Tensor]  # (1, T_clip, D_clip)
+    sync_features: Optional[torch.Tensor]  # (1, T_sync, D_sync)
+    # the video can be shorter than the requested duration
+    duration_sec: float
+
+
+class VideoFeatureStore:
+    """
+    A content-addressed, on-disk store of CLIP and Synchformer features.
+    Entries are keyed on (SHA-256 of the video bytes, duration, start offset, model version)
+    and are read back memory-mapped, so repeated requests for the same clip skip both
+    decoding and visual encoding.
+    model_version should change whenever the encoders, their weights or their dtype change.
+    """
+
+    def __init__(self, root: Union[str, Path], model_version: str):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.model_version = model_version
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, video_hash: str, duration: float, start_sec: float) -> Path:
+        key = f'{video_hash}\0{duration:.3f}\0{start_sec:.3f}\0{self.model_version}'
+        name = hashlib.sha256(key.encode()).hexdigest()
+        return self.root / name[:2] / f'{name}.pt'
+
+    def get(self,
+            video_hash: str,
+            duration: float,
+            start_sec: float = 0.0,
+            *,
+            need_clip: bool = True) -> Optional[VideoFeatures]:
+        path = self._path(video_hash, duration, start_sec)
+        entry = None
+        if path.exists():
+            try:
+                entry = torch.load(path, mmap=True, weights_only=True)
+            except Exception as e:
+                log.warning(f'Failed to read cached video features from {path}: {e}')
+
+        if entry is None or (need_clip and entry.get('clip_features') is None):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return VideoFeatures(clip_features=entry.get('clip_features'),
+                             sync_features=entry['sync_features'],
+                             duration_sec=float(entry['duration_sec']))
+
+    def put(self, video_hash: str, duration: float, start_sec: float,
+            features: VideoFeatures) -> None:
+        path = self._path(video_hash, duration, start_sec)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        entry = {
+            'sync_features': features.sync_features.detach().cpu().clone(),
+            'duration_sec': features.duration_sec,
+        }
+        if features.clip_features is not None:
+            entry['clip_features'] = features.clip_features.detach().cpu().clone()
+
+        # write to a temporary file first so that readers never see a partial entry
+        tmp_path = path.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+        torch.save(entry, tmp_path)
+        os.replace(tmp_path, path)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
@@ -1,7 +1,8 @@
 import dataclasses
 import logging
+from fractions import Fraction
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Optional
 
 import numpy as np
 import torch
@@ -9,10 +10,14 @@ from colorlog import ColoredFormatter
 from PIL import Image
 from torchvision.transforms import v2
 
-from mmaudio.data.av_utils import ImageInfo, VideoInfo, read_frames, reencode_with_audio
+from mmaudio.data.av_utils import (ImageInfo, VideoInfo, read_frames, read_frames_scaled,
+                                   reencode_with_audio, remux_with_audio)
+from mmaudio.model.buckets import DurationBucket, make_bucket, pad_sequence
 from mmaudio.model.flow_matching import FlowMatching
+from mmaudio.model.guidance import GuidanceSchedule
 from mmaudio.model.networks import MMAudio
 from mmaudio.model.sequence_config import CONFIG_16K, CONFIG_44K, SequenceConfig
+from mmaudio.model.step_cache import StepCache
 from mmaudio.model.utils.features_utils import FeaturesUtils
 from mmaudio.utils.download_utils import download_model_if_needed
 
@@ -30,10 +35,11 @@ class ModelConfig:
 
     @property
     def seq_cfg(self) -> SequenceConfig:
+        # return a copy so that callers can change the duration without affecting other users
         if self.mode == '16k':
-            return CONFIG_16K
+            return dataclasses.replace(CONFIG_16K)
         elif self.mode == '44k':
-            return CONFIG_44K
+            return dataclasses.replace(CONFIG_44K)
 
     def download_if_needed(self):
         download_model_if_needed(self.model_path)
@@ -86,33 +92,79 @@ def generate(
     feature_utils: FeaturesUtils,
     net: MMAudio,
     fm: FlowMatching,
-    rng: torch.Generator,
+    rng: Optional[torch.Generator],
     cfg_strength: float,
     clip_batch_size_multiplier: int = 40,
     sync_batch_size_multiplier: int = 40,
     image_input: bool = False,
+    progress_callback: Optional[Callable[[int, int], None]] = None,
+    x0: Optional[torch.Tensor] = None,
+    bucket: Optional[DurationBucket] = None,
+    durations: Optional[list[float]] = None,
+    clip_features: Optional[torch.Tensor] = None,
+    sync_features: Optional[torch.Tensor] = None,
+    batched_cfg: bool = False,
+    num_samples_per_prompt: int = 1,
+    known_latents: Optional[torch.Tensor] = None,
+    decode: bool = True,
+    step_cache: Optional[StepCache] = None,
+    cfg_interval: tuple[float, float] = (0.0, 1.0),
+    cfg_schedule: str = 'constant',
 ) -> torch.Tensor:
+    """
+    x0: optional initial noise of shape (B, latent_seq_len, latent_dim); drawn from rng if None.
+        Pass it to give each sample of a batch its own seed.
+    bucket: sample with the sequence lengths of this duration bucket instead of those stored in
+        the network, which is then left untouched
+    durations: with a bucket, the actual duration of each sample; shorter samples are masked and
+        the returned audio has to be cropped by the caller
+    clip_features/sync_features: precomputed visual features, used instead of clip_video/sync_video
+    batched_cfg: evaluate the conditional and unconditional branches in a single forward pass
+        of twice the batch size
+    num_samples_per_prompt: sample this many variations of every prompt from conditions that are
+        preprocessed once; x0 then has B * num_samples_per_prompt samples and so does the output,
+        with the variations of one prompt adjacent
+    known_latents: (B, N, latent_dim) normalized latents that the first N latents are constrained
+        to (inpainting); their flow is replaced with the straight path from x0 to them
+    decode: return the sampled normalized latents (B, latent_seq_len, latent_dim) instead of audio
+    step_cache: skip the fused blocks on steps where their input barely changed; its statistics
+        report how many were skipped
+    cfg_interval/cfg_schedule: apply guidance only for t in the interval, with a strength that
+        follows the schedule; see GuidanceSchedule
+    """
     device = feature_utils.device
     dtype = feature_utils.dtype
 
+    if bucket is None:
+        assert durations is None, 'durations require a bucket'
+        latent_seq_len, clip_seq_len, sync_seq_len = (net.latent_seq_len, net.clip_seq_len,
+                                                      net.sync_seq_len)
+    else:
+        latent_seq_len, clip_seq_len, sync_seq_len = (bucket.latent_seq_len, bucket.clip_seq_len,
+                                                      bucket.sync_seq_len)
+
     bs = len(text)
-    if clip_video is not None:
+    if clip_features is not None:
+        clip_features = clip_features.to(device, dtype)
+    elif clip_video is not None:
         clip_video = clip_video.to(device, dtype, non_blocking=True)
         clip_features = feature_utils.encode_video_with_clip(clip_video,
                                                              batch_size=bs *
                                                              clip_batch_size_multiplier)
         if image_input:
-            clip_features = clip_features.expand(-1, net.clip_seq_len, -1)
+            clip_features = clip_features.expand(-1, clip_seq_len, -1)
     else:
-        clip_features = net.get_empty_clip_sequence(bs)
+        clip_features = net.get_empty_clip_sequence(bs, clip_seq_len)
 
-    if sync_video is not None and not image_input:
+    if sync_features is not None:
+        sync_features = sync_features.to(device, dtype)
+    elif sync_video is not None and not image_input:
         sync_video = sync_video.to(device, dtype, non_blocking=True)
         sync_features = feature_utils.encode_video_with_sync(sync_video,
                                                              batch_size=bs *
                                                              sync_batch_size_multiplier)
     else:
-        sync_features = net.get_empty_sync_sequence(bs)
+        sync_features = net.get_empty_sync_sequence(bs, sync_seq_len)
 
     if text is not None:
         text_features = feature_utils.encode_text(text)
@@ -125,25 +177,224 @@ def generate(
     else:
         negative_text_features = net.get_empty_string_sequence(bs)
 
-    x0 = torch.randn(bs,
-                     net.latent_seq_len,
-                     net.latent_dim,
-                     device=device,
-                     dtype=dtype,
-                     generator=rng)
-    preprocessed_conditions = net.preprocess_conditions(clip_features, sync_features, text_features)
+    num_samples = bs * num_samples_per_prompt
+    if x0 is None:
+        x0 = torch.randn(num_samples,
+                         latent_seq_len,
+                         net.latent_dim,
+                         device=device,
+                         dtype=dtype,
+                         generator=rng)
+    else:
+        assert x0.shape == (num_samples, latent_seq_len, net.latent_dim), f'{x0.shape=}'
+        x0 = x0.to(device, dtype)
+
+    latent_lens = clip_lens = None
+    if durations is not None:
+        assert len(durations) == bs
+        latent_lens, clip_lens = bucket.get_valid_lengths(durations, device)
+
+    preprocessed_conditions = net.preprocess_conditions(clip_features,
+                                                        sync_features,
+                                                        text_features,
+                                                        bucket=bucket,
+                                                        latent_lens=latent_lens,
+                                                        clip_lens=clip_lens)
     empty_conditions = net.get_empty_conditions(
-        bs, negative_text_features=negative_text_features if negative_text is not None else None)
-
-    cfg_ode_wrapper = lambda t, x: net.ode_wrapper(t, x, preprocessed_conditions, empty_conditions,
-                                                   cfg_strength)
-    x1 = fm.to_data(cfg_ode_wrapper, x0)
+        bs,
+        negative_text_features=negative_text_features if negative_text is not None else None,
+        bucket=bucket,
+        latent_lens=latent_lens,
+        clip_lens=clip_lens)
+    preprocessed_conditions = net.expand_conditions(preprocessed_conditions,
+                                                    num_samples_per_prompt)
+    empty_conditions = net.expand_conditions(empty_conditions, num_samples_per_prompt)
+
+    # with a fixed-step solver, the timestep conditioning is computed for all steps up front
+    timesteps = None
+    if fm.inference_mode != 'adaptive':
+        timesteps = fm.get_evaluation_times(0, 1)
+
+    def prepare(conditions):
+        if timesteps is not None:
+            conditions = net.precompute_steps(conditions, timesteps)
+        if step_cache is not None:
+            conditions = step_cache.attach(conditions)
+        return conditions
+
+    guidance = GuidanceSchedule(cfg_strength, interval=tuple(cfg_interval), schedule=cfg_schedule)
+    batched_cfg = batched_cfg and cfg_strength >= 1.0
+    if batched_cfg:
+        cfg_conditions = prepare(net.concat_conditions(preprocessed_conditions, empty_conditions))
+    # the unguided steps only evaluate the conditional branch
+    if not batched_cfg or not guidance.always_on:
+        preprocessed_conditions = prepare(preprocessed_conditions)
+    if not batched_cfg and cfg_strength >= 1.0:
+        empty_conditions = prepare(empty_conditions)
+
+    def cfg_ode_wrapper(t: torch.Tensor, x: torch.Tensor) -> torch.Tensor:
+        strength = guidance.get_strength(t)
+        if strength is None:
+            # a strength below 1 evaluates the conditional branch only
+            return net.ode_wrapper(t, x, preprocessed_conditions, empty_conditions, 0.0)
+        if batched_cfg:
+            return net.batched_cfg_ode_wrapper(t, x, cfg_conditions, strength)
+        return net.ode_wrapper(t, x, preprocessed_conditions, empty_conditions, strength)
+
+    if known_latents is not None:
+        num_known = known_latents.shape[1]
+        known_flow = known_latents.to(device, dtype) - x0[:, :num_known]
+        unconstrained_ode_wrapper = cfg_ode_wrapper
+
+        def cfg_ode_wrapper(t: torch.Tensor, x: torch.Tensor) -> torch.Tensor:
+            # with min_sigma=0, this keeps the known part on the path x0 -> known_latents
+            flow = unconstrained_ode_wrapper(t, x)
+            flow[:, :num_known] = known_flow
+            return flow
+
+    x1 = fm.to_data(cfg_ode_wrapper, x0, callback=progress_callback)
+    if not decode:
+        return x1
     x1 = net.unnormalize(x1)
     spec = feature_utils.decode(x1)
     audio = feature_utils.vocode(spec)
     return audio
 
 
+# returns the CLIP and Synchformer features (1, N, D) of [start_sec, start_sec + duration_sec]
+# of a video, or None for either
+WindowFeaturesFn = Callable[[float, float], tuple[Optional[torch.Tensor], Optional[torch.Tensor]]]
+
+
+def get_video_window_features_fn(video_path: Path,
+                                 feature_utils: FeaturesUtils,
+                                 *,
+                                 mask_away_clip: bool = False,
+                                 scale_in_decoder: bool = True) -> WindowFeaturesFn:
+    """
+    Decodes and encodes one window of the video at a time, so that the memory does not depend on
+    the length of the video
+    """
+
+    def get_features(start_sec: float,
+                     duration_sec: float) -> tuple[Optional[torch.Tensor], Optional[torch.Tensor]]:
+        video_info = load_video(video_path,
+                                duration_sec,
+                                scale_in_decoder=scale_in_decoder,
+                                start_sec=start_sec)
+        device, dtype = feature_utils.device, feature_utils.dtype
+        clip_features = None
+        if not mask_away_clip:
+            clip_features = feature_utils.encode_video_with_clip(
+                video_info.clip_frames.unsqueeze(0).to(device, dtype), batch_size=40)
+        sync_features = feature_utils.encode_video_with_sync(
+            video_info.sync_frames.unsqueeze(0).to(device, dtype), batch_size=40)
+        return clip_features, sync_features
+
+    return get_features
+
+
+@torch.inference_mode()
+def generate_long(
+    get_features: Optional[WindowFeaturesFn],
+    text: str,
+    *,
+    negative_text: Optional[str] = None,
+    duration: float,
+    seq_cfg: SequenceConfig,
+    feature_utils: FeaturesUtils,
+    net: MMAudio,
+    fm: FlowMatching,
+    rng: Optional[torch.Generator],
+    cfg_strength: float,
+    window_sec: float = 8.0,
+    overlap_sec: float = 2.0,
+    progress_callback: Optional[Callable[[int, int], None]] = None,
+    batched_cfg: bool = False,
+) -> torch.Tensor:
+    """
+    Generates audio of any duration from overlapping windows of window_sec seconds, which are
+    sampled in sequence. The first overlap_sec seconds of every window are constrained to the
+    latents at the end of the previous window (see known_latents in generate), so that the windows
+    continue each other; the stitched latents are then decoded and vocoded in chunks.
+    Time is linear in the duration and memory is bounded by the window size.
+
+    get_features: returns the visual features of a window, see get_video_window_features_fn;
+        None for text-to-audio
+    Returns the audio (1, L) cropped to the duration
+    """
+    device = feature_utils.device
+    dtype = feature_utils.dtype
+
+    bucket = make_bucket(net, seq_cfg, window_sec)
+    window_len = bucket.latent_seq_len
+    # number of audio samples per latent
+    latent_hop = seq_cfg.spectrogram_frame_rate * seq_cfg.latent_downsample_rate
+    overlap_len = int(round(overlap_sec * seq_cfg.sampling_rate / latent_hop))
+    assert 0 < overlap_len < window_len, f'{overlap_sec=} must be shorter than {window_sec=}'
+    step_len = window_len - overlap_len
+    total_len = dataclasses.replace(seq_cfg, duration=duration).latent_seq_len
+
+    window_starts = list(range(0, max(total_len - overlap_len, 1), step_len))
+    num_steps = fm.num_steps * len(window_starts)
+    log.info(f'Generating {duration:.1f}s in {len(window_starts)} window(s) of {window_sec}s')
+
+    latents = []
+    previous = None
+    for i, start in enumerate(window_starts):
+        valid_len = min(window_len, total_len - start)
+        start_sec = start * latent_hop / seq_cfg.sampling_rate
+        window_duration = min(valid_len * latent_hop / seq_cfg.sampling_rate, window_sec)
+
+        clip_features = sync_features = None
+        if get_features is not None:
+            clip_features, sync_features = get_features(start_sec, window_duration)
+        # the last window can be shorter; it is padded to the bucket and masked
+        if clip_features is not None:
+            clip_features = pad_sequence(clip_features.to(device, dtype), bucket.clip_seq_len,
+                                         net.empty_clip_feat)
+        if sync_features is not None:
+            sync_features = pad_sequence(sync_features.to(device, dtype), bucket.sync_seq_len,
+                                         net.empty_sync_feat)
+
+        x0 = torch.randn(1, window_len, net.latent_dim, device=device, dtype=dtype, generator=rng)
+        window_callback = None
+        if progress_callback is not None:
+            window_callback = lambda step, _, i=i: progress_callback(i * fm.num_steps + step,
+                                                                     num_steps)
+        x1 = generate(None,
+                      None, [text],
+                      negative_text=[negative_text] if negative_text is not None else None,
+                      feature_utils=feature_utils,
+                      net=net,
+                      fm=fm,
+                      rng=None,
+                      cfg_strength=cfg_strength,
+                      progress_callback=window_callback,
+                      x0=x0,
+                      bucket=bucket,
+                      durations=[window_duration] if valid_len < window_len else None,
+                      clip_features=clip_features,
+                      sync_features=sync_features,
+                      batched_cfg=batched_cfg,
+                      known_latents=previous,
+                      decode=False)
+
+        x1 = x1[:, :valid_len]
+        latents.append(x1 if i == 0 else x1[:, overlap_len:])
+        previous = x1[:, -overlap_len:]
+
+    x1 = net.unnormalize(torch.cat(latents, dim=1))
+    # decode in chunks of the window size unless the caller configured otherwise
+    spec = feature_utils.tod.decode(x1.transpose(1, 2),
+                                    feature_utils.decode_chunk_size or window_len,
+                                    feature_utils.decode_overlap)
+    audio = feature_utils.tod.vocode(
+        spec, feature_utils.vocode_chunk_size or window_len * seq_cfg.latent_downsample_rate,
+        feature_utils.vocode_overlap)
+    return audio[0, :, :int(duration * seq_cfg.sampling_rate)]
+
+
 LOGFORMAT = "[%(log_color)s%(levelname)-8s%(reset)s]: %(log_color)s%(message)s%(reset)s"
 
 
@@ -165,7 +416,38 @@ _SYNC_SIZE = 224
 _SYNC_FPS = 25.0
 
 
-def load_video(video_path: Path, duration_sec: float, load_all_frames: bool = True) -> VideoInfo:
+def load_video(video_path: Path,
+               duration_sec: float,
+               scale_in_decoder: bool = False,
+               start_sec: float = 0.0) -> VideoInfo:
+    """
+    Loads duration_sec seconds of the video starting at start_sec.
+    The full-resolution frames are not loaded; the returned VideoInfo decodes them again
+    from the file when compositing.
+    scale_in_decoder: resize (and crop) the frames with libav's scaler while decoding instead of
+        with torchvision afterwards. Much faster and lighter for high-resolution videos; the
+        features differ slightly because the resampling filters are not identical.
+    """
+    if scale_in_decoder:
+        output_frames, orig_fps = read_frames_scaled(
+            video_path,
+            list_of_fps=[_CLIP_FPS, _SYNC_FPS],
+            list_of_sizes=[(_CLIP_SIZE, _CLIP_SIZE), _SYNC_SIZE],
+            start_sec=start_sec,
+            end_sec=start_sec + duration_sec)
+
+        # the frames are already resized and cropped
+        clip_transform = v2.Compose([
+            v2.ToImage(),
+            v2.ToDtype(torch.float32, scale=True),
+        ])
+        sync_transform = v2.Compose([
+            v2.ToImage(),
+            v2.ToDtype(torch.float32, scale=True),
+            v2.Normalize(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5]),
+        ])
+        return _make_video_info(video_path, start_sec, output_frames, orig_fps, duration_sec,
+                                clip_transform, sync_transform)
 
     clip_transform = v2.Compose([
         v2.Resize((_CLIP_SIZE, _CLIP_SIZE), interpolation=v2.InterpolationMode.BICUBIC),
@@ -181,21 +463,20 @@ def load_video(video_path: Path, duration_sec: float, load_all_frames: bool = Tr
         v2.Normalize(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5]),
     ])
 
-    output_frames, all_frames, orig_fps = read_frames(video_path,
-                                                      list_of_fps=[_CLIP_FPS, _SYNC_FPS],
-                                                      start_sec=0,
-                                                      end_sec=duration_sec,
-                                                      need_all_frames=load_all_frames)
+    output_frames, orig_fps = read_frames(video_path,
+                                          list_of_fps=[_CLIP_FPS, _SYNC_FPS],
+                                          start_sec=start_sec,
+                                          end_sec=start_sec + duration_sec)
+    return _make_video_info(video_path, start_sec, output_frames, orig_fps, duration_sec,
+                            clip_transform, sync_transform)
 
-    clip_chunk, sync_chunk = output_frames
-    clip_chunk = torch.from_numpy(clip_chunk).permute(0, 3, 1, 2)
-    sync_chunk = torch.from_numpy(sync_chunk).permute(0, 3, 1, 2)
 
-    clip_frames = clip_transform(clip_chunk)
-    sync_frames = sync_transform(sync_chunk)
-
-    clip_length_sec = clip_frames.shape[0] / _CLIP_FPS
-    sync_length_sec = sync_frames.shape[0] / _SYNC_FPS
+def _make_video_info(video_path: Path, start_sec: float, output_frames: list[np.ndarray],
+                     orig_fps: Fraction, duration_sec: float, clip_transform: v2.Transform,
+                     sync_transform: v2.Transform) -> VideoInfo:
+    clip_chunk, sync_chunk = output_frames
+    clip_length_sec = clip_chunk.shape[0] / _CLIP_FPS
+    sync_length_sec = sync_chunk.shape[0] / _SYNC_FPS
 
     if clip_length_sec < duration_sec:
         log.warning(f'Clip video is too short: {clip_length_sec:.2f} < {duration_sec:.2f}')
@@ -207,15 +488,20 @@ def load_video(video_path: Path, duration_sec: float, load_all_frames: bool = Tr
         log.warning(f'Truncating to {sync_length_sec:.2f} sec')
         duration_sec = sync_length_sec
 
-    clip_frames = clip_frames[:int(_CLIP_FPS * duration_sec)]
-    sync_frames = sync_frames[:int(_SYNC_FPS * duration_sec)]
+    # truncate before the transforms so that no extra frames are converted
+    clip_chunk = torch.from_numpy(clip_chunk[:int(_CLIP_FPS * duration_sec)]).permute(0, 3, 1, 2)
+    sync_chunk = torch.from_numpy(sync_chunk[:int(_SYNC_FPS * duration_sec)]).permute(0, 3, 1, 2)
+
+    clip_frames = clip_transform(clip_chunk)
+    sync_frames = sync_transform(sync_chunk)
 
     video_info = VideoInfo(
         duration_sec=duration_sec,
         fps=orig_fps,
         clip_frames=clip_frames,
         sync_frames=sync_frames,
-        all_frames=all_frames if load_all_frames else None,
+        source_path=video_path,
+        start_sec=start_sec,
     )
     return video_info
 
@@ -251,5 +537,17 @@ def load_image(image_path: Path) -> VideoInfo:
     return video_info
 
 
-def make_video(video_info: VideoInfo, output_path: Path, audio: torch.Tensor, sampling_rate: int):
+def make_video(video_info: VideoInfo,
+               output_path: Path,
+               audio: torch.Tensor,
+               sampling_rate: int,
+               remux: bool = True):
+    """
+    remux: copy the video stream when it can be cut without re-encoding, which takes milliseconds
+        instead of seconds; falls back to re-encoding otherwise
+    """
+    if remux:
+        if remux_with_audio(video_info, output_path, audio, sampling_rate):
+            return
+        log.info('The video cannot be cut without re-encoding; re-encoding it')
     reencode_with_audio(video_info, output_path, audio, sampling_rate)
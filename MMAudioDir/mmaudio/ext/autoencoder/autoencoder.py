@@ -1,4 +1,4 @@
-from typing import Literal, Optional
+from typing import Callable, Literal, Optional
 
 import torch
 import torch.nn as nn
@@ -7,6 +7,42 @@ from mmaudio.ext.autoencoder.vae import VAE, get_my_vae
 from mmaudio.ext.bigvgan import BigVGAN
 from mmaudio.ext.bigvgan_v2.bigvgan import BigVGAN as BigVGANv2
 from mmaudio.model.utils.distributions import DiagonalGaussianDistribution
+from mmaudio.utils.weight_utils import check_materialized, init_empty_weights, load_state_dict
+
+
+def overlap_add(fn: Callable[[torch.Tensor], torch.Tensor], x: torch.Tensor, chunk_size: int,
+                overlap: int) -> torch.Tensor:
+    """
+    Applies fn to overlapping chunks of x (B, C, T) along T and crossfades the outputs linearly
+    over the overlaps, so that peak memory depends on chunk_size instead of T.
+    fn must map T input frames to T * k output frames for an integer k (e.g., the hop size).
+    A sequence that fits in one chunk is processed in one call.
+    """
+    assert 0 <= overlap < chunk_size, f'{overlap=} must be smaller than {chunk_size=}'
+    length = x.shape[-1]
+    if length <= chunk_size:
+        return fn(x)
+
+    step = chunk_size - overlap
+    output = None
+    for start in range(0, length - overlap, step):
+        end = min(start + chunk_size, length)
+        y = fn(x[..., start:end])
+        scale = y.shape[-1] // (end - start)
+        assert y.shape[-1] == scale * (end - start), 'fn must upsample by an integer factor'
+        if output is None:
+            output = y.new_zeros(*y.shape[:-1], length * scale)
+
+        fade = overlap * scale
+        if fade > 0:
+            # complementary ramps sum to one in every overlap
+            ramp = torch.linspace(0, 1, fade + 2, device=y.device, dtype=y.dtype)[1:-1]
+            if start > 0:
+                y[..., :fade] *= ramp
+            if end < length:
+                y[..., -fade:] *= ramp.flip(0)
+        output[..., start * scale:end * scale] += y
+    return output
 
 
 class AutoEncoderModule(nn.Module):
@@ -18,9 +54,11 @@ class AutoEncoderModule(nn.Module):
                  mode: Literal['16k', '44k'],
                  need_vae_encoder: bool = True):
         super().__init__()
-        self.vae: VAE = get_my_vae(mode).eval()
-        vae_state_dict = torch.load(vae_ckpt_path, weights_only=True, map_location='cpu')
-        self.vae.load_state_dict(vae_state_dict)
+        # the weights are bound to the memory-mapped checkpoint instead of being initialized
+        with init_empty_weights():
+            self.vae: VAE = get_my_vae(mode).eval()
+        self.vae.load_state_dict(load_state_dict(vae_ckpt_path), assign=True)
+        check_materialized(self.vae)
         self.vae.remove_weight_norm()
 
         if mode == '16k':
@@ -44,9 +82,26 @@ class AutoEncoderModule(nn.Module):
         return self.vae.encode(x)
 
     @torch.inference_mode()
-    def decode(self, z: torch.Tensor) -> torch.Tensor:
-        return self.vae.decode(z)
+    def decode(self,
+               z: torch.Tensor,
+               chunk_size: Optional[int] = None,
+               overlap: int = 0) -> torch.Tensor:
+        """
+        chunk_size/overlap: decode chunks of this many latent frames, see overlap_add
+        """
+        if chunk_size is None:
+            return self.vae.decode(z)
+        return overlap_add(self.vae.decode, z, chunk_size, overlap)
 
     @torch.inference_mode()
-    def vocode(self, spec: torch.Tensor) -> torch.Tensor:
-        return self.vocoder(spec)
+    def vocode(self,
+               spec: torch.Tensor,
+               chunk_size: Optional[int] = None,
+               overlap: int = 0) -> torch.Tensor:
+        """
+        chunk_size/overlap: vocode chunks of this many spectrogram frames, see overlap_add
+        """
+        if chunk_size is None:
+            return self.vocoder(spec)
+        return overlap_add(self.vocoder, spec, chunk_size, overlap)
+
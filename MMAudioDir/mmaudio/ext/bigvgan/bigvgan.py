@@ -5,6 +5,7 @@ import torch.nn as nn
 from omegaconf import OmegaConf
 
 from mmaudio.ext.bigvgan.models import BigVGANVocoder
+from mmaudio.utils.weight_utils import check_materialized, init_empty_weights, load_state_dict
 
 _bigvgan_vocoder_path = Path(__file__).parent / 'bigvgan_vocoder.yml'
 
@@ -14,9 +15,10 @@ class BigVGAN(nn.Module):
     def __init__(self, ckpt_path, config_path=_bigvgan_vocoder_path):
         super().__init__()
         vocoder_cfg = OmegaConf.load(config_path)
-        self.vocoder = BigVGANVocoder(vocoder_cfg).eval()
-        vocoder_ckpt = torch.load(ckpt_path, map_location='cpu', weights_only=True)['generator']
-        self.vocoder.load_state_dict(vocoder_ckpt)
+        with init_empty_weights():
+            self.vocoder = BigVGANVocoder(vocoder_cfg).eval()
+        self.vocoder.load_state_dict(load_state_dict(ckpt_path, key='generator'), assign=True)
+        check_materialized(self.vocoder)
 
         self.weight_norm_removed = False
         self.remove_weight_norm()
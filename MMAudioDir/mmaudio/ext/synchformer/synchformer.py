@@ -34,11 +34,11 @@ class Synchformer(nn.Module):
         vis = self.vfeat_extractor(vis)
         return vis
 
-    def load_state_dict(self, sd: Mapping[str, Any], strict: bool = True):
+    def load_state_dict(self, sd: Mapping[str, Any], strict: bool = True, assign: bool = False):
         # discard all entries except vfeat_extractor
         sd = {k: v for k, v in sd.items() if k.startswith('vfeat_extractor')}
 
-        return super().load_state_dict(sd, strict)
+        return super().load_state_dict(sd, strict, assign)
 
 
 if __name__ == "__main__":
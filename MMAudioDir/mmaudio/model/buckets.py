@@ -0,0 +1,95 @@
+import dataclasses
+import logging
+from typing import TYPE_CHECKING, Sequence
+
+import torch
+
+from mmaudio.model.sequence_config import SequenceConfig
+
+if TYPE_CHECKING:
+    from mmaudio.model.networks import MMAudio
+
+log = logging.getLogger()
+
+DEFAULT_BUCKET_DURATIONS = (2.0, 4.0, 8.0, 10.0, 16.0)
+
+
+@dataclasses.dataclass
+class DurationBucket:
+    """
+    Sequence lengths and rotary embeddings of one fixed duration.
+    They are held outside of the network so that requests of different durations never have to
+    mutate shared module state; shorter requests are padded to the bucket and masked.
+    """
+    seq_cfg: SequenceConfig
+    latent_rot: torch.Tensor
+    clip_rot: torch.Tensor
+
+    @property
+    def duration(self) -> float:
+        return self.seq_cfg.duration
+
+    @property
+    def latent_seq_len(self) -> int:
+        return self.seq_cfg.latent_seq_len
+
+    @property
+    def clip_seq_len(self) -> int:
+        return self.seq_cfg.clip_seq_len
+
+    @property
+    def sync_seq_len(self) -> int:
+        return self.seq_cfg.sync_seq_len
+
+    def get_seq_cfg(self, duration: float) -> SequenceConfig:
+        assert duration <= self.duration, f'{duration=} does not fit in {self.duration=}'
+        return dataclasses.replace(self.seq_cfg, duration=duration)
+
+    def get_valid_lengths(self, durations: Sequence[float],
+                          device: torch.device) -> tuple[torch.Tensor, torch.Tensor]:
+        # number of valid (unpadded) latent and clip tokens of each sample
+        seq_cfgs = [self.get_seq_cfg(duration) for duration in durations]
+        latent_lens = torch.tensor([cfg.latent_seq_len for cfg in seq_cfgs], device=device)
+        clip_lens = torch.tensor([cfg.clip_seq_len for cfg in seq_cfgs], device=device)
+        return latent_lens, clip_lens
+
+
+def make_bucket(net: 'MMAudio', seq_cfg: SequenceConfig, duration: float) -> DurationBucket:
+    bucket_cfg = dataclasses.replace(seq_cfg, duration=duration)
+    latent_rot, clip_rot = net.compute_rotations(bucket_cfg.latent_seq_len, bucket_cfg.clip_seq_len)
+    return DurationBucket(bucket_cfg, latent_rot, clip_rot)
+
+
+class DurationBuckets:
+    """
+    Precomputes one DurationBucket per duration for a given network.
+    A request is served by the smallest bucket that is at least as long as it.
+    """
+
+    def __init__(self,
+                 net: 'MMAudio',
+                 seq_cfg: SequenceConfig,
+                 durations: Sequence[float] = DEFAULT_BUCKET_DURATIONS):
+        assert len(durations) > 0
+        self.buckets = [make_bucket(net, seq_cfg, duration) for duration in sorted(durations)]
+        log.info(f'Duration buckets: {[bucket.duration for bucket in self.buckets]}')
+
+    @property
+    def max_duration(self) -> float:
+        return self.buckets[-1].duration
+
+    def select(self, duration: float) -> DurationBucket:
+        for bucket in self.buckets:
+            if duration <= bucket.duration:
+                return bucket
+        raise ValueError(f'Duration {duration} exceeds the longest bucket ({self.max_duration})')
+
+
+def pad_sequence(x: torch.Tensor, length: int, pad_feat: torch.Tensor) -> torch.Tensor:
+    """
+    x: (B, N, D) -> (B, length, D), padded with pad_feat (1, D) or truncated
+    """
+    if x.shape[1] >= length:
+        return x[:, :length]
+    padding = pad_feat.to(x.dtype).view(1, 1, -1).expand(x.shape[0], length - x.shape[1], -1)
+    return torch.cat([x, padding], dim=1)
@@ -1,4 +1,5 @@
 import logging
+import math
 from typing import Callable, Optional
 
 import torch
@@ -6,24 +7,64 @@ from torchdiffeq import odeint
 
 log = logging.getLogger()
 
+# fixed-step solvers and the number of network evaluations they take per step;
+# heun takes one more in its first step, see FlowMatching.num_function_evals
+SOLVERS = {'euler': 1, 'heun': 1, 'midpoint': 2, 'dpm_multistep': 1}
+SCHEDULES = ('uniform', 'shifted', 'cosine')
+
+
+def get_num_function_evals(inference_mode: str, num_steps: int) -> int:
+    # of a fixed-step solver, per sample and CFG branch
+    return SOLVERS[inference_mode] * num_steps + (1 if inference_mode == 'heun' else 0)
+
+
+def get_num_steps(inference_mode: str, num_function_evals: int) -> Optional[int]:
+    # the number of steps of a fixed-step solver for exactly num_function_evals, if there is one
+    for num_steps in range(1, num_function_evals + 1):
+        if get_num_function_evals(inference_mode, num_steps) == num_function_evals:
+            return num_steps
+    return None
+
 
 # Partially from https://github.com/gle-bellier/flow-matching
 class FlowMatching:
 
-    def __init__(self, min_sigma: float = 0.0, inference_mode='euler', num_steps: int = 25):
-        # inference_mode: 'euler' or 'adaptive'
-        # num_steps: number of steps in the euler inference mode
+    def __init__(self,
+                 min_sigma: float = 0.0,
+                 inference_mode='euler',
+                 num_steps: int = 25,
+                 schedule: str = 'uniform',
+                 shift: float = 3.0):
+        # inference_mode: 'adaptive' or one of the fixed-step solvers:
+        #   'euler',
+        #   'heun' (second order; the evaluation at the end of a step is reused as the start of
+        #   the next one, so that a step takes one new evaluation after the first),
+        #   'midpoint' (second order, two evaluations per step),
+        #   'dpm_multistep' (second order from the previous step's evaluation, DPM-Solver++(2M))
+        # num_steps: number of steps of the fixed-step solvers
+        # schedule: spacing of the steps; 'uniform', 'shifted' (denser near the noise, by shift)
+        #   or 'cosine' (denser at both ends)
         super().__init__()
         self.min_sigma = min_sigma
         self.inference_mode = inference_mode
         self.num_steps = num_steps
+        self.schedule = schedule
+        self.shift = shift
 
         # self.fm = ExactOptimalTransportConditionalFlowMatcher(sigma=min_sigma)
 
-        assert self.inference_mode in ['euler', 'adaptive']
+        assert self.inference_mode in ['adaptive', *SOLVERS], f'{inference_mode=}'
+        assert self.schedule in SCHEDULES, f'{schedule=}'
         if self.inference_mode == 'adaptive' and num_steps > 0:
             log.info('The number of steps is ignored in adaptive inference mode ')
 
+    @property
+    def num_function_evals(self) -> Optional[int]:
+        # per sample and CFG branch; None if adaptive
+        if self.inference_mode == 'adaptive':
+            return None
+        return get_num_function_evals(self.inference_mode, self.num_steps)
+
     def get_conditional_flow(self, x0: torch.Tensor, x1: torch.Tensor,
                              t: torch.Tensor) -> torch.Tensor:
         # which is psi_t(x), eq 22 in flow matching for generative models
@@ -48,24 +89,105 @@ class FlowMatching:
         xt = self.get_conditional_flow(x0, x1, t)
         return x0, x1, xt, Cs
 
-    def to_prior(self, fn: Callable, x1: torch.Tensor) -> torch.Tensor:
-        return self.run_t0_to_t1(fn, x1, 1, 0)
-
-    def to_data(self, fn: Callable, x0: torch.Tensor) -> torch.Tensor:
-        return self.run_t0_to_t1(fn, x0, 0, 1)
-
-    def run_t0_to_t1(self, fn: Callable, x0: torch.Tensor, t0: float, t1: float) -> torch.Tensor:
+    def to_prior(self,
+                 fn: Callable,
+                 x1: torch.Tensor,
+                 callback: Optional[Callable[[int, int], None]] = None) -> torch.Tensor:
+        return self.run_t0_to_t1(fn, x1, 1, 0, callback=callback)
+
+    def to_data(self,
+                fn: Callable,
+                x0: torch.Tensor,
+                callback: Optional[Callable[[int, int], None]] = None) -> torch.Tensor:
+        return self.run_t0_to_t1(fn, x0, 0, 1, callback=callback)
+
+    def get_timesteps(self, t0: float, t1: float) -> torch.Tensor:
+        # num_steps + 1 times from t0 to t1 - min_sigma, spaced by the schedule
+        u = torch.linspace(0, 1, self.num_steps + 1, dtype=torch.float64)
+        if t1 < t0:
+            # towards the prior: the same spacing, traversed backwards
+            u = 1 - u
+        if self.schedule == 'shifted':
+            # the timestep shift of SD3, applied to the noise level 1 - u
+            sigma = 1 - u
+            u = 1 - self.shift * sigma / (1 + (self.shift - 1) * sigma)
+        elif self.schedule == 'cosine':
+            u = (1 - torch.cos(math.pi * u)) / 2
+        if t1 < t0:
+            u = 1 - u
+        return (t0 + (t1 - self.min_sigma - t0) * u).float()
+
+    def get_evaluation_times(self, t0: float, t1: float) -> torch.Tensor:
+        # every time at which run_t0_to_t1 evaluates fn, computed exactly as in the solver loop
+        steps = self.get_timesteps(t0, t1)
+        t, next_t = steps[:-1], steps[1:]
+        if self.inference_mode == 'heun':
+            return steps
+        elif self.inference_mode == 'midpoint':
+            return torch.cat([t, t + (next_t - t) / 2])
+        return t
+
+    def _predict_x1(self, x: torch.Tensor, flow: torch.Tensor, t: float) -> torch.Tensor:
+        # the data prediction from a flow at time t on the path of get_conditional_flow
+        return (1 - (1 - self.min_sigma) * t) * flow + (1 - self.min_sigma) * x
+
+    def _dpm_step(self, x: torch.Tensor, x1_pred: torch.Tensor, prev_x1_pred: Optional[torch.Tensor],
+                  t_prev: Optional[float], t: float, next_t: float) -> torch.Tensor:
+        # DPM-Solver++(2M) with alpha_t = t and sigma_t = 1 - (1 - min_sigma) * t.
+        # Its first-order step is exactly an euler step; the second-order correction needs
+        # finite log-SNRs, so the steps that start or end at t=0 or t=1 stay first-order.
+        alpha, sigma = t, 1 - (1 - self.min_sigma) * t
+        next_alpha, next_sigma = next_t, 1 - (1 - self.min_sigma) * next_t
+
+        def log_snr(t: float) -> float:
+            return math.log(t) - math.log(1 - (1 - self.min_sigma) * t)
+
+        data = x1_pred
+        if prev_x1_pred is not None and all(0 < s < 1 for s in (t_prev, t, next_t)):
+            h = log_snr(next_t) - log_snr(t)
+            h_prev = log_snr(t) - log_snr(t_prev)
+            r = h_prev / h
+            data = x1_pred + (x1_pred - prev_x1_pred) / (2 * r)
+        return (next_sigma / sigma) * x + (next_alpha - alpha * next_sigma / sigma) * data
+
+    def run_t0_to_t1(self,
+                     fn: Callable,
+                     x0: torch.Tensor,
+                     t0: float,
+                     t1: float,
+                     callback: Optional[Callable[[int, int], None]] = None) -> torch.Tensor:
         # fn: a function that takes (t, x) and returns the direction x0->x1
+        # callback: called with (completed steps, total steps) after every step
 
         if self.inference_mode == 'adaptive':
             return odeint(fn, x0, torch.tensor([t0, t1], device=x0.device, dtype=x0.dtype))
-        elif self.inference_mode == 'euler':
-            x = x0
-            steps = torch.linspace(t0, t1 - self.min_sigma, self.num_steps + 1)
-            for ti, t in enumerate(steps[:-1]):
+
+        x = x0
+        steps = self.get_timesteps(t0, t1)
+        prev_x1_pred = t_prev = None
+        next_flow = None
+        for ti, t in enumerate(steps[:-1]):
+            if next_flow is not None:
+                # the flow at the end of the previous heun step, evaluated at its euler prediction
+                # of x; it differs from the flow at x by O(dt^2), which keeps the second order
+                flow = next_flow
+            else:
                 flow = fn(t, x)
-                next_t = steps[ti + 1]
-                dt = next_t - t
+            next_t = steps[ti + 1]
+            dt = next_t - t
+            if self.inference_mode == 'euler':
                 x = x + dt * flow
+            elif self.inference_mode == 'heun':
+                next_flow = fn(next_t, x + dt * flow)
+                x = x + dt * (flow + next_flow) / 2
+            elif self.inference_mode == 'midpoint':
+                mid_flow = fn(t + dt / 2, x + dt / 2 * flow)
+                x = x + dt * mid_flow
+            elif self.inference_mode == 'dpm_multistep':
+                x1_pred = self._predict_x1(x, flow, t.item())
+                x = self._dpm_step(x, x1_pred, prev_x1_pred, t_prev, t.item(), next_t.item())
+                prev_x1_pred, t_prev = x1_pred, t.item()
+            if callback is not None:
+                callback(ti + 1, self.num_steps)
 
         return x
@@ -0,0 +1,56 @@
+import dataclasses
+import math
+from typing import Optional, Union
+
+import torch
+
+CFG_SCHEDULES = ('constant', 'linear', 'cosine')
+
+
+@dataclasses.dataclass(frozen=True)
+class GuidanceSchedule:
+    """
+    Classifier-free guidance as a function of the flow time t (0: noise, 1: data).
+    Outside interval, no guidance is applied and the unconditional branch is not evaluated.
+    schedule: how the strength varies inside the interval;
+        'constant': cfg_strength
+        'linear'/'cosine': increasing from 1 at the start of the interval towards the data, with a
+            mean of cfg_strength, so that the overall amount of guidance stays comparable
+    """
+    cfg_strength: float
+    interval: tuple[float, float] = (0.0, 1.0)
+    schedule: str = 'constant'
+
+    def __post_init__(self):
+        start, end = self.interval
+        if not 0 <= start <= end <= 1:
+            raise ValueError(f'Invalid guidance interval: {self.interval}')
+        if self.schedule not in CFG_SCHEDULES:
+            raise ValueError(f'Unknown guidance schedule: {self.schedule}; '
+                             f'expected one of {list(CFG_SCHEDULES)}')
+
+    @property
+    def always_on(self) -> bool:
+        return self.cfg_strength >= 1.0 and self.interval == (0.0, 1.0)
+
+    def get_strength(self, t: Union[float, torch.Tensor]) -> Optional[float]:
+        # None if the step is not guided
+        if self.cfg_strength < 1.0:
+            return None
+        start, end = self.interval
+        t = float(t)
+        if not start <= t <= end:
+            return None
+        if self.schedule == 'constant' or end == start:
+            return self.cfg_strength
+
+        u = (t - start) / (end - start)
+        if self.schedule == 'linear':
+            weight = 2 * u
+        else:
+            weight = 1 - math.cos(math.pi * u)
+        return 1 + (self.cfg_strength - 1) * weight
+
+    def count_network_evals(self, timesteps: torch.Tensor) -> int:
+        # per sample, counting the unconditional branch of the guided steps
+        return sum(1 if self.get_strength(t) is None else 2 for t in timesteps)
@@ -1,6 +1,8 @@
+import dataclasses
 import logging
 from dataclasses import dataclass
-from typing import Optional
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional, Union
 
 import torch
 import torch.nn as nn
@@ -9,11 +11,30 @@ import torch.nn.functional as F
 from mmaudio.ext.rotary_embeddings import compute_rope_rotations
 from mmaudio.model.embeddings import TimestepEmbedder
 from mmaudio.model.low_level import MLP, ChannelLastConv1d, ConvMLP
-from mmaudio.model.transformer_layers import (FinalBlock, JointBlock, MMDitSingleBlock)
+from mmaudio.model.transformer_layers import (FinalBlock, JointBlock, MMDitSingleBlock, modulate)
+from mmaudio.utils.weight_utils import check_materialized, init_empty_weights, load_state_dict
+
+if TYPE_CHECKING:
+    from mmaudio.model.buckets import DurationBucket
+    from mmaudio.model.step_cache import StepCacheState
 
 log = logging.getLogger()
 
 
+@dataclass
+class StepConditions:
+    """
+    The parts of predict_flow that only depend on the timestep and the global conditions,
+    precomputed for every timestep at which a fixed-step solver evaluates the network
+    """
+    # timestep -> index into the tensors below
+    step_indices: dict[float, int]
+    global_c: torch.Tensor  # (S, B, 1, D)
+    # the adaLN modulations of the clip and text blocks of every joint block, (S, B, 1, k * D)
+    joint_modulations: list[tuple[torch.Tensor, torch.Tensor]]
+    final_modulation: torch.Tensor  # (S, B, 1, 2 * D)
+
+
 @dataclass
 class PreprocessedConditions:
     clip_f: torch.Tensor
@@ -21,6 +42,16 @@ class PreprocessedConditions:
     text_f: torch.Tensor
     clip_f_c: torch.Tensor
     text_f_c: torch.Tensor
+    # rotations of the sequence lengths that these conditions were computed for
+    latent_rot: Optional[torch.Tensor] = None
+    clip_rot: Optional[torch.Tensor] = None
+    # boolean key masks of padded samples; None if nothing is padded
+    joint_attn_mask: Optional[torch.Tensor] = None  # (B, 1, 1, N_latent + N_clip + N_text)
+    latent_attn_mask: Optional[torch.Tensor] = None  # (B, 1, 1, N_latent)
+    # see MMAudio.precompute_steps
+    steps: Optional[StepConditions] = None
+    # see StepCache.attach
+    step_cache: Optional['StepCacheState'] = None
 
 
 # Partially from https://github.com/facebookresearch/DiT
@@ -149,22 +180,32 @@ class MMAudio(nn.Module):
         self.empty_clip_feat = nn.Parameter(torch.zeros(1, clip_dim), requires_grad=True)
         self.empty_sync_feat = nn.Parameter(torch.zeros(1, sync_dim), requires_grad=True)
 
+        # the empty (unconditional) branch only depends on the weights and the sequence lengths;
+        # when enabled, its preprocessing is cached at inference time. Only enable this if the
+        # weights do not change other than through load_weights (i.e., not during training)
+        self.cache_empty_conditions = False
+        self._empty_conditions_cache: dict[tuple, PreprocessedConditions] = {}
+
         self.initialize_weights()
         self.initialize_rotations()
 
-    def initialize_rotations(self):
+    def compute_rotations(self, latent_seq_len: int,
+                          clip_seq_len: int) -> tuple[torch.Tensor, torch.Tensor]:
         base_freq = 1.0
-        latent_rot = compute_rope_rotations(self._latent_seq_len,
+        latent_rot = compute_rope_rotations(latent_seq_len,
                                             self.hidden_dim // self.num_heads,
                                             10000,
                                             freq_scaling=base_freq,
                                             device=self.device)
-        clip_rot = compute_rope_rotations(self._clip_seq_len,
+        clip_rot = compute_rope_rotations(clip_seq_len,
                                           self.hidden_dim // self.num_heads,
                                           10000,
-                                          freq_scaling=base_freq * self._latent_seq_len /
-                                          self._clip_seq_len,
+                                          freq_scaling=base_freq * latent_seq_len / clip_seq_len,
                                           device=self.device)
+        return latent_rot, clip_rot
+
+    def initialize_rotations(self):
+        latent_rot, clip_rot = self.compute_rotations(self._latent_seq_len, self._clip_seq_len)
 
         self.latent_rot = nn.Buffer(latent_rot, persistent=False)
         self.clip_rot = nn.Buffer(clip_rot, persistent=False)
@@ -174,6 +215,7 @@ class MMAudio(nn.Module):
         self._clip_seq_len = clip_seq_len
         self._sync_seq_len = sync_seq_len
         self.initialize_rotations()
+        self._empty_conditions_cache.clear()
 
     def initialize_weights(self):
 
@@ -220,49 +262,153 @@ class MMAudio(nn.Module):
         # return x * self.latent_std + self.latent_mean
         return x.mul_(self.latent_std).add_(self.latent_mean)
 
-    def preprocess_conditions(self, clip_f: torch.Tensor, sync_f: torch.Tensor,
-                              text_f: torch.Tensor) -> PreprocessedConditions:
+    def _get_seq_params(
+        self, bucket: Optional['DurationBucket']
+    ) -> tuple[int, int, int, torch.Tensor, torch.Tensor]:
+        if bucket is None:
+            return (self._latent_seq_len, self._clip_seq_len, self._sync_seq_len, self.latent_rot,
+                    self.clip_rot)
+        return (bucket.latent_seq_len, bucket.clip_seq_len, bucket.sync_seq_len, bucket.latent_rot,
+                bucket.clip_rot)
+
+    def _get_attn_masks(
+        self,
+        latent_seq_len: int,
+        clip_seq_len: int,
+        latent_lens: Optional[torch.Tensor],
+        clip_lens: Optional[torch.Tensor],
+    ) -> tuple[Optional[torch.Tensor], Optional[torch.Tensor]]:
+        if latent_lens is None and clip_lens is None:
+            return None, None
+        if ((latent_lens is None or bool((latent_lens >= latent_seq_len).all()))
+                and (clip_lens is None or bool((clip_lens >= clip_seq_len).all()))):
+            # nothing is padded; do not pass a mask so that the fused attention kernels are used
+            return None, None
+
+        bs = latent_lens.shape[0] if latent_lens is not None else clip_lens.shape[0]
+        device = self.device
+        if latent_lens is None:
+            latent_mask = torch.ones(bs, latent_seq_len, dtype=torch.bool, device=device)
+        else:
+            latent_mask = torch.arange(latent_seq_len, device=device) < latent_lens[:, None]
+        if clip_lens is None:
+            clip_mask = torch.ones(bs, clip_seq_len, dtype=torch.bool, device=device)
+        else:
+            clip_mask = torch.arange(clip_seq_len, device=device) < clip_lens[:, None]
+        text_mask = torch.ones(bs, self._text_seq_len, dtype=torch.bool, device=device)
+
+        joint_mask = torch.cat([latent_mask, clip_mask, text_mask], dim=1)
+        return joint_mask[:, None, None], latent_mask[:, None, None]
+
+    def _preprocess_text(self, text_f: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+        text_f = self.text_input_proj(text_f)  # (B, VN, D)
+        text_f_c = self.text_cond_proj(text_f.mean(dim=1))  # (B, D)
+        return text_f, text_f_c
+
+    def preprocess_conditions(self,
+                              clip_f: torch.Tensor,
+                              sync_f: torch.Tensor,
+                              text_f: torch.Tensor,
+                              *,
+                              bucket: Optional['DurationBucket'] = None,
+                              latent_lens: Optional[torch.Tensor] = None,
+                              clip_lens: Optional[torch.Tensor] = None) -> PreprocessedConditions:
         """
         cache computations that do not depend on the latent/time step
         i.e., the features are reused over steps during inference
+
+        bucket: use the sequence lengths/rotations of the bucket instead of those of the module
+        latent_lens/clip_lens: (B,) numbers of valid tokens when shorter samples are padded;
+            the padding is excluded from attention and from the pooled clip condition
         """
-        assert clip_f.shape[1] == self._clip_seq_len, f'{clip_f.shape=} {self._clip_seq_len=}'
-        assert sync_f.shape[1] == self._sync_seq_len, f'{sync_f.shape=} {self._sync_seq_len=}'
+        latent_seq_len, clip_seq_len, sync_seq_len, latent_rot, clip_rot = self._get_seq_params(
+            bucket)
+        assert clip_f.shape[1] == clip_seq_len, f'{clip_f.shape=} {clip_seq_len=}'
+        assert sync_f.shape[1] == sync_seq_len, f'{sync_f.shape=} {sync_seq_len=}'
         assert text_f.shape[1] == self._text_seq_len, f'{text_f.shape=} {self._text_seq_len=}'
 
         bs = clip_f.shape[0]
 
         # B * num_segments (24) * 8 * 768
-        num_sync_segments = self._sync_seq_len // 8
+        num_sync_segments = sync_seq_len // 8
         sync_f = sync_f.view(bs, num_sync_segments, 8, -1) + self.sync_pos_emb
         sync_f = sync_f.flatten(1, 2)  # (B, VN, D)
 
         # extend vf to match x
         clip_f = self.clip_input_proj(clip_f)  # (B, VN, D)
         sync_f = self.sync_input_proj(sync_f)  # (B, VN, D)
-        text_f = self.text_input_proj(text_f)  # (B, VN, D)
+        text_f, text_f_c = self._preprocess_text(text_f)  # (B, VN, D), (B, D)
 
         # upsample the sync features to match the audio
         sync_f = sync_f.transpose(1, 2)  # (B, D, VN)
-        sync_f = F.interpolate(sync_f, size=self._latent_seq_len, mode='nearest-exact')
+        sync_f = F.interpolate(sync_f, size=latent_seq_len, mode='nearest-exact')
         sync_f = sync_f.transpose(1, 2)  # (B, N, D)
 
         # get conditional features from the clip side
-        clip_f_c = self.clip_cond_proj(clip_f.mean(dim=1))  # (B, D)
-        text_f_c = self.text_cond_proj(text_f.mean(dim=1))  # (B, D)
+        if clip_lens is not None and bool((clip_lens < clip_seq_len).any()):
+            clip_mask = torch.arange(clip_seq_len, device=clip_f.device) < clip_lens[:, None]
+            clip_mask = clip_mask.unsqueeze(-1).to(clip_f.dtype)
+            clip_f_mean = (clip_f * clip_mask).sum(dim=1) / clip_mask.sum(dim=1).clamp(min=1)
+        else:
+            clip_f_mean = clip_f.mean(dim=1)
+        clip_f_c = self.clip_cond_proj(clip_f_mean)  # (B, D)
+
+        joint_attn_mask, latent_attn_mask = self._get_attn_masks(latent_seq_len, clip_seq_len,
+                                                                 latent_lens, clip_lens)
 
         return PreprocessedConditions(clip_f=clip_f,
                                       sync_f=sync_f,
                                       text_f=text_f,
                                       clip_f_c=clip_f_c,
-                                      text_f_c=text_f_c)
-
-    def predict_flow(self, latent: torch.Tensor, t: torch.Tensor,
-                     conditions: PreprocessedConditions) -> torch.Tensor:
+                                      text_f_c=text_f_c,
+                                      latent_rot=latent_rot,
+                                      clip_rot=clip_rot,
+                                      joint_attn_mask=joint_attn_mask,
+                                      latent_attn_mask=latent_attn_mask)
+
+    def precompute_steps(self, conditions: PreprocessedConditions,
+                         timesteps: torch.Tensor) -> PreprocessedConditions:
+        """
+        Computes the timestep embeddings, global_c, and the adaLN modulations that depend on it
+        (of the clip/text blocks and of the final layer) for all timesteps at once, with one
+        matmul per layer, so that each step only runs the token-dependent work.
+        timesteps: (S,), e.g., FlowMatching.get_evaluation_times(); predict_flow falls back to
+        computing everything for other timesteps.
+        """
+        dtype = conditions.clip_f_c.dtype
+        # the ode wrappers cast t to the dtype of the latents as well
+        t = timesteps.to(self.device, dtype)
+        global_c = self.global_cond_mlp(conditions.clip_f_c + conditions.text_f_c)  # (B, D)
+        global_c = self.t_embed(t)[:, None, None] + global_c[None, :, None]  # (S, B, 1, D)
+
+        joint_modulations = [(block.clip_block.adaLN_modulation(global_c),
+                              block.text_block.adaLN_modulation(global_c))
+                             for block in self.joint_blocks]
+        steps = StepConditions(step_indices={float(t): i for i, t in enumerate(timesteps)},
+                               global_c=global_c,
+                               joint_modulations=joint_modulations,
+                               final_modulation=self.final_layer.adaLN_modulation(global_c))
+        return dataclasses.replace(conditions, steps=steps)
+
+    @staticmethod
+    def _find_step(t: torch.Tensor, conditions: PreprocessedConditions) -> Optional[int]:
+        # only for timesteps on the CPU, to not synchronize with the GPU
+        if conditions.steps is None or t.device.type != 'cpu' or t.numel() != 1:
+            return None
+        return conditions.steps.step_indices.get(float(t))
+
+    def predict_flow(self,
+                     latent: torch.Tensor,
+                     t: torch.Tensor,
+                     conditions: PreprocessedConditions,
+                     step: Optional[int] = None) -> torch.Tensor:
         """
         for non-cacheable computations
+        step: the index of t in conditions.steps, if precomputed
         """
-        assert latent.shape[1] == self._latent_seq_len, f'{latent.shape=} {self._latent_seq_len=}'
+        latent_rot = conditions.latent_rot if conditions.latent_rot is not None else self.latent_rot
+        clip_rot = conditions.clip_rot if conditions.clip_rot is not None else self.clip_rot
+        assert latent.shape[1] == latent_rot.shape[1], f'{latent.shape=} {latent_rot.shape=}'
 
         clip_f = conditions.clip_f
         sync_f = conditions.sync_f
@@ -271,19 +417,44 @@ class MMAudio(nn.Module):
         text_f_c = conditions.text_f_c
 
         latent = self.audio_input_proj(latent)  # (B, N, D)
-        global_c = self.global_cond_mlp(clip_f_c + text_f_c)  # (B, D)
-
-        global_c = self.t_embed(t).unsqueeze(1) + global_c.unsqueeze(1)  # (B, D)
+        if step is not None:
+            steps = conditions.steps
+            global_c = steps.global_c[step]
+            joint_modulations = [(clip_mod[step], text_mod[step])
+                                 for clip_mod, text_mod in steps.joint_modulations]
+            final_modulation = steps.final_modulation[step]
+        else:
+            global_c = self.global_cond_mlp(clip_f_c + text_f_c)  # (B, D)
+            global_c = self.t_embed(t).unsqueeze(1) + global_c.unsqueeze(1)  # (B, D)
+            joint_modulations = [None] * len(self.joint_blocks)
+            final_modulation = None
         extended_c = global_c + sync_f
 
-        for block in self.joint_blocks:
-            latent, clip_f, text_f = block(latent, clip_f, text_f, global_c, extended_c,
-                                           self.latent_rot, self.clip_rot)  # (B, N, D)
-
-        for block in self.fused_blocks:
-            latent = block(latent, extended_c, self.latent_rot)
+        step_cache = conditions.step_cache
+        skip_fused_blocks = False
+        first_latent_modulation = None
+        if step_cache is not None:
+            first_block = self.joint_blocks[0].latent_block
+            first_latent_modulation = first_block.adaLN_modulation(extended_c)
+            shift, scale = first_latent_modulation.chunk(6, dim=-1)[:2]
+            skip_fused_blocks = step_cache.should_skip(
+                modulate(first_block.norm1(latent), shift, scale))
+
+        for i, (block, modulations) in enumerate(zip(self.joint_blocks, joint_modulations)):
+            latent, clip_f, text_f = block(latent, clip_f, text_f, global_c, extended_c, latent_rot,
+                                           clip_rot, conditions.joint_attn_mask, modulations,
+                                           first_latent_modulation if i == 0 else None)  # (B, N, D)
+
+        if skip_fused_blocks:
+            latent = step_cache.apply(latent)
+        else:
+            fused_input = latent
+            for block in self.fused_blocks:
+                latent = block(latent, extended_c, latent_rot, conditions.latent_attn_mask)
+            if step_cache is not None:
+                step_cache.store(fused_input, latent)
 
-        flow = self.final_layer(latent, global_c)  # (B, N, out_dim), remove t
+        flow = self.final_layer(latent, global_c, final_modulation)  # (B, N, out_dim), remove t
         return flow
 
     def forward(self, latent: torch.Tensor, clip_f: torch.Tensor, sync_f: torch.Tensor,
@@ -300,45 +471,150 @@ class MMAudio(nn.Module):
     def get_empty_string_sequence(self, bs: int) -> torch.Tensor:
         return self.empty_string_feat.unsqueeze(0).expand(bs, -1, -1)
 
-    def get_empty_clip_sequence(self, bs: int) -> torch.Tensor:
-        return self.empty_clip_feat.unsqueeze(0).expand(bs, self._clip_seq_len, -1)
-
-    def get_empty_sync_sequence(self, bs: int) -> torch.Tensor:
-        return self.empty_sync_feat.unsqueeze(0).expand(bs, self._sync_seq_len, -1)
+    def get_empty_clip_sequence(self, bs: int, length: Optional[int] = None) -> torch.Tensor:
+        length = self._clip_seq_len if length is None else length
+        return self.empty_clip_feat.unsqueeze(0).expand(bs, length, -1)
+
+    def get_empty_sync_sequence(self, bs: int, length: Optional[int] = None) -> torch.Tensor:
+        length = self._sync_seq_len if length is None else length
+        return self.empty_sync_feat.unsqueeze(0).expand(bs, length, -1)
+
+    def _get_single_empty_conditions(
+            self, bucket: Optional['DurationBucket']) -> PreprocessedConditions:
+        # the preprocessed empty conditions with a batch size of one
+        latent_seq_len, clip_seq_len, sync_seq_len, latent_rot, clip_rot = self._get_seq_params(
+            bucket)
+        use_cache = self.cache_empty_conditions and not torch.is_grad_enabled()
+        key = (latent_seq_len, clip_seq_len, sync_seq_len, self.empty_clip_feat.dtype, self.device)
+        if use_cache and key in self._empty_conditions_cache:
+            conditions = self._empty_conditions_cache[key]
+            return dataclasses.replace(conditions, latent_rot=latent_rot, clip_rot=clip_rot)
+
+        conditions = self.preprocess_conditions(self.get_empty_clip_sequence(1, clip_seq_len),
+                                                self.get_empty_sync_sequence(1, sync_seq_len),
+                                                self.get_empty_string_sequence(1),
+                                                bucket=bucket)
+        if use_cache:
+            self._empty_conditions_cache[key] = conditions
+        return conditions
 
     def get_empty_conditions(
             self,
             bs: int,
             *,
-            negative_text_features: Optional[torch.Tensor] = None) -> PreprocessedConditions:
+            negative_text_features: Optional[torch.Tensor] = None,
+            bucket: Optional['DurationBucket'] = None,
+            latent_lens: Optional[torch.Tensor] = None,
+            clip_lens: Optional[torch.Tensor] = None) -> PreprocessedConditions:
+        latent_seq_len, clip_seq_len, _, _, _ = self._get_seq_params(bucket)
+        empty_conditions = self._get_single_empty_conditions(bucket)
+
         if negative_text_features is not None:
-            empty_text = negative_text_features
+            text_f, text_f_c = self._preprocess_text(negative_text_features)
         else:
-            empty_text = self.get_empty_string_sequence(1)
-
-        empty_clip = self.get_empty_clip_sequence(1)
-        empty_sync = self.get_empty_sync_sequence(1)
-        conditions = self.preprocess_conditions(empty_clip, empty_sync, empty_text)
-        conditions.clip_f = conditions.clip_f.expand(bs, -1, -1)
-        conditions.sync_f = conditions.sync_f.expand(bs, -1, -1)
-        conditions.clip_f_c = conditions.clip_f_c.expand(bs, -1)
-        if negative_text_features is None:
-            conditions.text_f = conditions.text_f.expand(bs, -1, -1)
-            conditions.text_f_c = conditions.text_f_c.expand(bs, -1)
+            text_f = empty_conditions.text_f.expand(bs, -1, -1)
+            text_f_c = empty_conditions.text_f_c.expand(bs, -1)
 
-        return conditions
+        # the empty clip features are identical at every position, so only attention needs masking
+        joint_attn_mask, latent_attn_mask = self._get_attn_masks(latent_seq_len, clip_seq_len,
+                                                                 latent_lens, clip_lens)
+
+        return PreprocessedConditions(clip_f=empty_conditions.clip_f.expand(bs, -1, -1),
+                                      sync_f=empty_conditions.sync_f.expand(bs, -1, -1),
+                                      text_f=text_f,
+                                      clip_f_c=empty_conditions.clip_f_c.expand(bs, -1),
+                                      text_f_c=text_f_c,
+                                      latent_rot=empty_conditions.latent_rot,
+                                      clip_rot=empty_conditions.clip_rot,
+                                      joint_attn_mask=joint_attn_mask,
+                                      latent_attn_mask=latent_attn_mask)
 
     def ode_wrapper(self, t: torch.Tensor, latent: torch.Tensor, conditions: PreprocessedConditions,
                     empty_conditions: PreprocessedConditions, cfg_strength: float) -> torch.Tensor:
+        step = self._find_step(t, conditions)
+        empty_step = self._find_step(t, empty_conditions)
         t = t * torch.ones(len(latent), device=latent.device, dtype=latent.dtype)
 
         if cfg_strength < 1.0:
-            return self.predict_flow(latent, t, conditions)
+            return self.predict_flow(latent, t, conditions, step)
         else:
-            return (cfg_strength * self.predict_flow(latent, t, conditions) +
-                    (1 - cfg_strength) * self.predict_flow(latent, t, empty_conditions))
+            return (cfg_strength * self.predict_flow(latent, t, conditions, step) +
+                    (1 - cfg_strength) * self.predict_flow(latent, t, empty_conditions, empty_step))
 
-    def load_weights(self, src_dict) -> None:
+    @staticmethod
+    def concat_conditions(conditions: PreprocessedConditions,
+                          empty_conditions: PreprocessedConditions) -> PreprocessedConditions:
+        """
+        stack the conditional and the unconditional branch along the batch dimension
+        so that classifier-free guidance needs one forward pass instead of two
+        """
+
+        def _cat_masks(a: Optional[torch.Tensor],
+                       b: Optional[torch.Tensor]) -> Optional[torch.Tensor]:
+            if a is None and b is None:
+                return None
+            if a is None:
+                a = torch.ones_like(b)
+            if b is None:
+                b = torch.ones_like(a)
+            return torch.cat([a, b], dim=0)
+
+        return PreprocessedConditions(
+            clip_f=torch.cat([conditions.clip_f, empty_conditions.clip_f], dim=0),
+            sync_f=torch.cat([conditions.sync_f, empty_conditions.sync_f], dim=0),
+            text_f=torch.cat([conditions.text_f, empty_conditions.text_f], dim=0),
+            clip_f_c=torch.cat([conditions.clip_f_c, empty_conditions.clip_f_c], dim=0),
+            text_f_c=torch.cat([conditions.text_f_c, empty_conditions.text_f_c], dim=0),
+            latent_rot=conditions.latent_rot,
+            clip_rot=conditions.clip_rot,
+            joint_attn_mask=_cat_masks(conditions.joint_attn_mask,
+                                       empty_conditions.joint_attn_mask),
+            latent_attn_mask=_cat_masks(conditions.latent_attn_mask,
+                                        empty_conditions.latent_attn_mask))
+
+    @staticmethod
+    def expand_conditions(conditions: PreprocessedConditions,
+                          num_samples: int) -> PreprocessedConditions:
+        """
+        repeat every sample of the conditions num_samples times along the batch dimension
+        (B -> B * num_samples, the copies of one sample are adjacent)
+        so that several latents can be sampled from conditions that are preprocessed only once
+        """
+        if num_samples == 1:
+            return conditions
+
+        def _expand(x: Optional[torch.Tensor]) -> Optional[torch.Tensor]:
+            if x is None:
+                return None
+            x = x.unsqueeze(1).expand(-1, num_samples, *x.shape[1:])
+            return x.reshape(-1, *x.shape[2:])
+
+        return PreprocessedConditions(clip_f=_expand(conditions.clip_f),
+                                      sync_f=_expand(conditions.sync_f),
+                                      text_f=_expand(conditions.text_f),
+                                      clip_f_c=_expand(conditions.clip_f_c),
+                                      text_f_c=_expand(conditions.text_f_c),
+                                      latent_rot=conditions.latent_rot,
+                                      clip_rot=conditions.clip_rot,
+                                      joint_attn_mask=_expand(conditions.joint_attn_mask),
+                                      latent_attn_mask=_expand(conditions.latent_attn_mask))
+
+    def batched_cfg_ode_wrapper(self, t: torch.Tensor, latent: torch.Tensor,
+                                cfg_conditions: PreprocessedConditions,
+                                cfg_strength: float) -> torch.Tensor:
+        """
+        same as ode_wrapper with cfg_strength >= 1, but evaluates both branches in one forward pass
+        cfg_conditions: the output of concat_conditions(conditions, empty_conditions)
+        """
+        bs = len(latent)
+        step = self._find_step(t, cfg_conditions)
+        t = t * torch.ones(bs * 2, device=latent.device, dtype=latent.dtype)
+
+        flow = self.predict_flow(torch.cat([latent, latent], dim=0), t, cfg_conditions, step)
+        cond_flow, uncond_flow = flow.chunk(2, dim=0)
+        return cfg_strength * cond_flow + (1 - cfg_strength) * uncond_flow
+
+    def load_weights(self, src_dict, assign: bool = False) -> None:
         if 't_embed.freqs' in src_dict:
             del src_dict['t_embed.freqs']
         if 'latent_rot' in src_dict:
@@ -346,7 +622,8 @@ class MMAudio(nn.Module):
         if 'clip_rot' in src_dict:
             del src_dict['clip_rot']
 
-        self.load_state_dict(src_dict, strict=True)
+        self.load_state_dict(src_dict, strict=True, assign=assign)
+        self._empty_conditions_cache.clear()
 
     @property
     def device(self) -> torch.device:
@@ -461,6 +738,21 @@ def get_my_mmaudio(name: str, **kwargs) -> MMAudio:
     raise ValueError(f'Unknown model name: {name}')
 
 
+def load_my_mmaudio(name: str, weights_path: Union[str, Path], **kwargs) -> MMAudio:
+    """
+    Builds the network with its parameters on the meta device, skipping their random
+    initialization, and binds them to the memory-mapped weights (see load_state_dict).
+    Move it to the target device/dtype afterwards.
+    """
+    with init_empty_weights():
+        net = get_my_mmaudio(name, **kwargs)
+    net.load_weights(load_state_dict(weights_path), assign=True)
+    # the rotations were computed on the device of the (meta) parameters
+    net.initialize_rotations()
+    check_materialized(net)
+    return net
+
+
 if __name__ == '__main__':
     network = get_my_mmaudio('small_16k')
 
@@ -0,0 +1,64 @@
+import logging
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from mmaudio.model.low_level import ChannelLastConv1d
+
+log = logging.getLogger()
+
+
+class WeightOnlyInt8Conv1d(nn.Module):
+    """
+    A Conv1d with int8 weights and a float32 scale per output channel.
+    The weights are dequantized in every forward pass: this saves memory and memory bandwidth,
+    the convolution itself still runs in float32.
+    """
+
+    def __init__(self, conv: nn.Conv1d):
+        super().__init__()
+        assert conv.padding_mode == 'zeros', conv.padding_mode
+        weight = conv.weight.detach().float()
+        scale = weight.abs().amax(dim=(1, 2), keepdim=True).clamp(min=1e-12) / 127
+        self.weight_int8 = nn.Buffer((weight / scale).round().clamp(-127, 127).to(torch.int8))
+        self.weight_scale = nn.Buffer(scale)
+        self.register_buffer('bias', conv.bias.detach().float() if conv.bias is not None else None)
+        self.stride = conv.stride
+        self.padding = conv.padding
+        self.dilation = conv.dilation
+        self.groups = conv.groups
+        self.channel_last = isinstance(conv, ChannelLastConv1d)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        if self.channel_last:
+            x = x.permute(0, 2, 1)
+        weight = self.weight_int8.to(x.dtype) * self.weight_scale.to(x.dtype)
+        x = F.conv1d(x, weight, self.bias, self.stride, self.padding, self.dilation, self.groups)
+        if self.channel_last:
+            x = x.permute(0, 2, 1)
+        return x
+
+
+def quantize_int8(net: nn.Module) -> nn.Module:
+    """
+    Quantizes a float32 network on the CPU for inference, in place:
+    nn.Linear layers to dynamic int8 (int8 weights, activations quantized on the fly)
+    and Conv1d layers to weight-only int8.
+    The weights must be loaded before.
+    """
+    assert next(net.parameters()).dtype == torch.float32, 'quantize a float32 network'
+    assert next(net.parameters()).device.type == 'cpu', 'dynamic quantization runs on the CPU'
+    net.eval()
+
+    num_convs = 0
+    for module in list(net.modules()):
+        for name, child in module.named_children():
+            if isinstance(child, nn.Conv1d):
+                setattr(module, name, WeightOnlyInt8Conv1d(child))
+                num_convs += 1
+
+    num_linears = sum(isinstance(module, nn.Linear) for module in net.modules())
+    torch.ao.quantization.quantize_dynamic(net, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    log.info(f'Quantized {num_linears} linear and {num_convs} convolutional layers to int8')
+    return net
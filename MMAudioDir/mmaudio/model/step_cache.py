@@ -0,0 +1,74 @@
+import dataclasses
+from typing import TYPE_CHECKING, Optional
+
+import torch
+
+if TYPE_CHECKING:
+    from mmaudio.model.networks import PreprocessedConditions
+
+
+class StepCache:
+    """
+    Skips the fused blocks on ODE steps where their input has barely changed (as in TeaCache).
+    The relative L1 change of the modulated input of the first joint block is accumulated over
+    steps; while it stays below threshold, the residual that the fused blocks added in the last
+    full evaluation is added instead of running them. A higher threshold skips more blocks at a
+    larger deviation from the uncached result; 0 never skips.
+
+    Each branch of classifier-free guidance that is evaluated separately needs its own state,
+    see attach(); the statistics are shared.
+    """
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self.num_evals = 0
+        self.num_skipped = 0
+
+    def attach(self, conditions: 'PreprocessedConditions') -> 'PreprocessedConditions':
+        return dataclasses.replace(conditions, step_cache=StepCacheState(self))
+
+    @property
+    def skipped_fraction(self) -> float:
+        # of the fused block evaluations
+        return self.num_skipped / self.num_evals if self.num_evals > 0 else 0.0
+
+    def stats(self) -> dict:
+        return {
+            'threshold': self.threshold,
+            'evals': self.num_evals,
+            'skipped': self.num_skipped,
+            'skipped_fraction': self.skipped_fraction,
+        }
+
+
+class StepCacheState:
+    # the state of one branch; used by MMAudio.predict_flow
+
+    def __init__(self, cache: StepCache):
+        self.cache = cache
+        self.previous_input: Optional[torch.Tensor] = None
+        self.residual: Optional[torch.Tensor] = None
+        self.accumulated_change = 0.0
+
+    def should_skip(self, modulated_input: torch.Tensor) -> bool:
+        previous_input, self.previous_input = self.previous_input, modulated_input
+        skip = False
+        if (self.residual is not None and previous_input is not None
+                and previous_input.shape == modulated_input.shape):
+            # this synchronizes with the GPU once per step, which is small next to the blocks
+            change = ((modulated_input - previous_input).abs().mean() /
+                      previous_input.abs().mean().clamp(min=1e-8)).item()
+            self.accumulated_change += change
+            skip = self.accumulated_change < self.cache.threshold
+        if not skip:
+            self.accumulated_change = 0.0
+
+        self.cache.num_evals += 1
+        self.cache.num_skipped += int(skip)
+        return skip
+
+    def store(self, fused_input: torch.Tensor, fused_output: torch.Tensor) -> None:
+        self.residual = fused_output - fused_input
+
+    def apply(self, fused_input: torch.Tensor) -> torch.Tensor:
+        return fused_input + self.residual
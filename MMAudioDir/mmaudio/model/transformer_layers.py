@@ -14,14 +14,18 @@ def modulate(x: torch.Tensor, shift: torch.Tensor, scale: torch.Tensor):
     return x * (1 + scale) + shift
 
 
-def attention(q: torch.Tensor, k: torch.Tensor, v: torch.Tensor):
+def attention(q: torch.Tensor,
+              k: torch.Tensor,
+              v: torch.Tensor,
+              attn_mask: Optional[torch.Tensor] = None):
     # training will crash without these contiguous calls and the CUDNN limitation
     # I believe this is related to https://github.com/pytorch/pytorch/issues/133974
     # unresolved at the time of writing
+    # attn_mask: optional boolean (B, 1, 1, N_k) mask of the keys that can be attended to
     q = q.contiguous()
     k = k.contiguous()
     v = v.contiguous()
-    out = F.scaled_dot_product_attention(q, k, v)
+    out = F.scaled_dot_product_attention(q, k, v, attn_mask=attn_mask)
     out = rearrange(out, 'b h n d -> b n (h d)').contiguous()
     return out
 
@@ -102,10 +106,16 @@ class MMDitSingleBlock(nn.Module):
 
             self.adaLN_modulation = nn.Sequential(nn.SiLU(), nn.Linear(dim, 6 * dim, bias=True))
 
-    def pre_attention(self, x: torch.Tensor, c: torch.Tensor, rot: Optional[torch.Tensor]):
+    def pre_attention(self,
+                      x: torch.Tensor,
+                      c: torch.Tensor,
+                      rot: Optional[torch.Tensor],
+                      modulation: Optional[torch.Tensor] = None):
         # x: BS * N * D
         # cond: BS * D
-        modulation = self.adaLN_modulation(c)
+        # modulation: adaLN_modulation(c) if it has been precomputed
+        if modulation is None:
+            modulation = self.adaLN_modulation(c)
         if self.pre_only:
             (shift_msa, scale_msa) = modulation.chunk(2, dim=-1)
             gate_msa = shift_mlp = scale_mlp = gate_mlp = None
@@ -128,12 +138,15 @@ class MMDitSingleBlock(nn.Module):
 
         return x
 
-    def forward(self, x: torch.Tensor, cond: torch.Tensor,
-                rot: Optional[torch.Tensor]) -> torch.Tensor:
+    def forward(self,
+                x: torch.Tensor,
+                cond: torch.Tensor,
+                rot: Optional[torch.Tensor],
+                attn_mask: Optional[torch.Tensor] = None) -> torch.Tensor:
         # x: BS * N * D
         # cond: BS * D
         x_qkv, x_conditions = self.pre_attention(x, cond, rot)
-        attn_out = attention(*x_qkv)
+        attn_out = attention(*x_qkv, attn_mask=attn_mask)
         x = self.post_attention(x, attn_out, x_conditions)
 
         return x
@@ -158,15 +171,32 @@ class JointBlock(nn.Module):
                                            padding=1)
         self.text_block = MMDitSingleBlock(dim, nhead, mlp_ratio, pre_only=pre_only, kernel_size=1)
 
-    def forward(self, latent: torch.Tensor, clip_f: torch.Tensor, text_f: torch.Tensor,
-                global_c: torch.Tensor, extended_c: torch.Tensor, latent_rot: torch.Tensor,
-                clip_rot: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+    def forward(self,
+                latent: torch.Tensor,
+                clip_f: torch.Tensor,
+                text_f: torch.Tensor,
+                global_c: torch.Tensor,
+                extended_c: torch.Tensor,
+                latent_rot: torch.Tensor,
+                clip_rot: torch.Tensor,
+                attn_mask: Optional[torch.Tensor] = None,
+                global_modulations: Optional[tuple[torch.Tensor, torch.Tensor]] = None,
+                latent_modulation: Optional[torch.Tensor] = None
+                ) -> tuple[torch.Tensor, torch.Tensor]:
         # latent: BS * N1 * D
         # clip_f: BS * N2 * D
         # c: BS * (1/N) * D
-        x_qkv, x_mod = self.latent_block.pre_attention(latent, extended_c, latent_rot)
-        c_qkv, c_mod = self.clip_block.pre_attention(clip_f, global_c, clip_rot)
-        t_qkv, t_mod = self.text_block.pre_attention(text_f, global_c, rot=None)
+        # attn_mask: BS * 1 * 1 * (N1 + N2 + N3), over the concatenated latent/clip/text keys
+        # global_modulations: the precomputed modulations of the clip and text blocks from global_c
+        # latent_modulation: the precomputed modulation of the latent block from extended_c
+        clip_modulation, text_modulation = global_modulations or (None, None)
+        x_qkv, x_mod = self.latent_block.pre_attention(latent, extended_c, latent_rot,
+                                                       latent_modulation)
+        c_qkv, c_mod = self.clip_block.pre_attention(clip_f, global_c, clip_rot, clip_modulation)
+        t_qkv, t_mod = self.text_block.pre_attention(text_f,
+                                                     global_c,
+                                                     rot=None,
+                                                     modulation=text_modulation)
 
         latent_len = latent.shape[1]
         clip_len = clip_f.shape[1]
@@ -174,7 +204,7 @@ class JointBlock(nn.Module):
 
         joint_qkv = [torch.cat([x_qkv[i], c_qkv[i], t_qkv[i]], dim=2) for i in range(3)]
 
-        attn_out = attention(*joint_qkv)
+        attn_out = attention(*joint_qkv, attn_mask=attn_mask)
         x_attn_out = attn_out[:, :latent_len]
         c_attn_out = attn_out[:, latent_len:latent_len + clip_len]
         t_attn_out = attn_out[:, latent_len + clip_len:]
@@ -195,8 +225,10 @@ class FinalBlock(nn.Module):
         self.norm = nn.LayerNorm(dim, elementwise_affine=False)
         self.conv = ChannelLastConv1d(dim, out_dim, kernel_size=7, padding=3)
 
-    def forward(self, latent, c):
-        shift, scale = self.adaLN_modulation(c).chunk(2, dim=-1)
+    def forward(self, latent, c, modulation=None):
+        if modulation is None:
+            modulation = self.adaLN_modulation(c)
+        shift, scale = modulation.chunk(2, dim=-1)
         latent = modulate(self.norm(latent), shift, scale)
         latent = self.conv(latent)
         return latent
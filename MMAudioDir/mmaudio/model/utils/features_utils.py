@@ -12,6 +12,10 @@ from mmaudio.ext.autoencoder import AutoEncoderModule
 from mmaudio.ext.mel_converter import get_mel_converter
 from mmaudio.ext.synchformer import Synchformer
 from mmaudio.model.utils.distributions import DiagonalGaussianDistribution
+from mmaudio.model.utils.text_cache import TextFeatureCache
+from mmaudio.utils.weight_utils import check_materialized, init_empty_weights, load_state_dict
+
+CLIP_MODEL_NAME = 'hf-hub:apple/DFN5B-CLIP-ViT-H-14-384'
 
 
 def patch_clip(clip_model):
@@ -42,19 +46,33 @@ class FeaturesUtils(nn.Module):
         enable_conditions: bool = True,
         mode=Literal['16k', '44k'],
         need_vae_encoder: bool = True,
+        text_cache: Optional[TextFeatureCache] = None,
+        decode_chunk_size: Optional[int] = None,
+        decode_overlap: int = 8,
+        vocode_chunk_size: Optional[int] = None,
+        vocode_overlap: int = 16,
     ):
         super().__init__()
 
+        # optional cache of encode_text outputs; its model_id should identify the CLIP model
+        self.text_cache = text_cache
+        # with a chunk size (in latent/spectrogram frames), long sequences are decoded/vocoded
+        # in crossfaded chunks to bound the peak memory; None decodes them in one pass
+        self.decode_chunk_size = decode_chunk_size
+        self.decode_overlap = decode_overlap
+        self.vocode_chunk_size = vocode_chunk_size
+        self.vocode_overlap = vocode_overlap
+
         if enable_conditions:
-            self.clip_model = create_model_from_pretrained('hf-hub:apple/DFN5B-CLIP-ViT-H-14-384',
-                                                           return_transform=False)
+            self.clip_model = create_model_from_pretrained(CLIP_MODEL_NAME, return_transform=False)
             self.clip_preprocess = Normalize(mean=[0.48145466, 0.4578275, 0.40821073],
                                              std=[0.26862954, 0.26130258, 0.27577711])
             self.clip_model = patch_clip(self.clip_model)
 
-            self.synchformer = Synchformer()
-            self.synchformer.load_state_dict(
-                torch.load(synchformer_ckpt, weights_only=True, map_location='cpu'))
+            with init_empty_weights():
+                self.synchformer = Synchformer()
+            self.synchformer.load_state_dict(load_state_dict(synchformer_ckpt), assign=True)
+            check_materialized(self.synchformer)
 
             self.tokenizer = open_clip.get_tokenizer('ViT-H-14-378-quickgelu')  # same as 'ViT-H-14'
         else:
@@ -130,6 +148,20 @@ class FeaturesUtils(nn.Module):
 
     @torch.inference_mode()
     def encode_text(self, text: list[str]) -> torch.Tensor:
+        if self.text_cache is None:
+            return self._encode_text(text)
+
+        features = [self.text_cache.get(t, self.dtype) for t in text]
+        missing_text = list(dict.fromkeys(t for t, f in zip(text, features) if f is None))
+        if missing_text:
+            # encode every distinct missing prompt once, in a single batch
+            encoded = dict(zip(missing_text, self._encode_text(missing_text)))
+            for t, f in encoded.items():
+                self.text_cache.put(t, f.to(self.dtype))
+            features = [encoded[t] if f is None else f for t, f in zip(text, features)]
+        return torch.stack([f.to(self.device, self.dtype, non_blocking=True) for f in features])
+
+    def _encode_text(self, text: list[str]) -> torch.Tensor:
         assert self.clip_model is not None, 'CLIP is not loaded'
         assert self.tokenizer is not None, 'Tokenizer is not loaded'
         # x: (B, L)
@@ -148,12 +180,12 @@ class FeaturesUtils(nn.Module):
     @torch.inference_mode()
     def vocode(self, mel: torch.Tensor) -> torch.Tensor:
         assert self.tod is not None, 'VAE is not loaded'
-        return self.tod.vocode(mel)
+        return self.tod.vocode(mel, self.vocode_chunk_size, self.vocode_overlap)
 
     @torch.inference_mode()
     def decode(self, z: torch.Tensor) -> torch.Tensor:
         assert self.tod is not None, 'VAE is not loaded'
-        return self.tod.decode(z.transpose(1, 2))
+        return self.tod.decode(z.transpose(1, 2), self.decode_chunk_size, self.decode_overlap)
 
     @property
     def device(self):
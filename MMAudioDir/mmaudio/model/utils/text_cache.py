@@ -0,0 +1,131 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Union
+
+import torch
+
+log = logging.getLogger()
+
+
+class TextFeatureCache:
+    """
+    A bounded LRU cache of text features, e.g., the (77, 1024) CLIP outputs of prompts.
+    Entries are keyed on the model id, the dtype, and the normalized prompt, and are evicted when
+    either max_entries or max_bytes is exceeded.
+
+    With disk_dir, every entry is also written to disk and read back memory-mapped on a miss,
+    so that the cache survives restarts.
+    """
+
+    def __init__(self,
+                 model_id: str,
+                 *,
+                 max_entries: int = 4096,
+                 max_bytes: int = 1 << 30,
+                 disk_dir: Optional[Union[str, Path]] = None):
+        self.model_id = model_id
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_dir = Path(disk_dir) if disk_dir is not None else None
+        if self.disk_dir is not None:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+
+        self._entries: OrderedDict[str, torch.Tensor] = OrderedDict()
+        self._num_bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        # the CLIP tokenizer lower-cases and collapses whitespace anyway
+        return ' '.join(text.split()).lower()
+
+    def _key(self, text: str, dtype: torch.dtype) -> str:
+        return f'{self.model_id}\0{dtype}\0{self.normalize(text)}'
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / f'{hashlib.sha256(key.encode()).hexdigest()}.pt'
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def num_bytes(self) -> int:
+        return self._num_bytes
+
+    def get(self, text: str, dtype: torch.dtype) -> Optional[torch.Tensor]:
+        key = self._key(text, dtype)
+        with self._lock:
+            features = self._entries.get(key)
+            if features is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return features
+
+        if self.disk_dir is not None:
+            path = self._disk_path(key)
+            if path.exists():
+                try:
+                    features = torch.load(path, mmap=True, weights_only=True)
+                except Exception as e:
+                    log.warning(f'Failed to read cached text features from {path}: {e}')
+                else:
+                    with self._lock:
+                        self.disk_hits += 1
+                    self._insert(key, features)
+                    return features
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, text: str, features: torch.Tensor) -> None:
+        key = self._key(text, features.dtype)
+        # a copy, so that a row of a batched output does not keep the whole batch alive
+        features = features.detach().clone()
+        self._insert(key, features)
+
+        if self.disk_dir is not None:
+            path = self._disk_path(key)
+            if not path.exists():
+                # write to a temporary file first so that readers never see a partial entry
+                tmp_path = path.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+                torch.save(features.cpu(), tmp_path)
+                os.replace(tmp_path, path)
+
+    def _insert(self, key: str, features: torch.Tensor) -> None:
+        num_bytes = features.numel() * features.element_size()
+        with self._lock:
+            if key in self._entries:
+                old = self._entries.pop(key)
+                self._num_bytes -= old.numel() * old.element_size()
+            self._entries[key] = features
+            self._num_bytes += num_bytes
+
+            while self._entries and (len(self._entries) > self.max_entries
+                                     or self._num_bytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._num_bytes -= evicted.numel() * evicted.element_size()
+
+    def clear(self) -> None:
+        # only clears the memory tier
+        with self._lock:
+            self._entries.clear()
+            self._num_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._num_bytes,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+            }
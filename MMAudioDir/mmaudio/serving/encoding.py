@@ -0,0 +1,152 @@
+import dataclasses
+import io
+import struct
+from typing import Iterator
+
+import av
+import numpy as np
+import torch
+
+
+@dataclasses.dataclass(frozen=True)
+class AudioFormat:
+    container: str
+    media_type: str
+    # supported bit depths
+    bit_depths: tuple[int, ...]
+
+
+AUDIO_FORMATS = {
+    'flac': AudioFormat('flac', 'audio/flac', (16, 24)),
+    'opus': AudioFormat('ogg', 'audio/ogg', (16, )),
+    'wav': AudioFormat('wav', 'audio/wav', (16, 24, 32)),
+}
+
+# libopus only accepts a few sampling rates; the audio is resampled to this one
+_OPUS_SAMPLING_RATE = 48000
+
+
+def get_audio_format(name: str, bit_depth: int) -> AudioFormat:
+    if name not in AUDIO_FORMATS:
+        raise ValueError(f'Unknown audio format: {name}; expected one of {list(AUDIO_FORMATS)}')
+    audio_format = AUDIO_FORMATS[name]
+    if bit_depth not in audio_format.bit_depths:
+        raise ValueError(f'{name} supports bit depths {list(audio_format.bit_depths)}, '
+                         f'not {bit_depth}')
+    return audio_format
+
+
+class _ChunkWriter:
+    # a non-seekable file object for av that hands out what has been written so far
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def pop(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _iter_wav(audio: np.ndarray, sampling_rate: int, bit_depth: int,
+              chunk_size: int) -> Iterator[bytes]:
+    # the length is known up front, so the header can be written first with the exact sizes
+    num_samples = audio.shape[-1]
+    sample_width = bit_depth // 8
+    data_size = num_samples * sample_width
+    format_tag = 3 if bit_depth == 32 else 1  # IEEE float or PCM
+    yield (b'RIFF' + struct.pack('<I', 36 + data_size) + b'WAVE' + b'fmt ' +
+           struct.pack('<IHHIIHH', 16, format_tag, 1, sampling_rate, sampling_rate * sample_width,
+                       sample_width, bit_depth) + b'data' + struct.pack('<I', data_size))
+
+    for start in range(0, num_samples, chunk_size):
+        chunk = audio[0, start:start + chunk_size]
+        if bit_depth == 32:
+            yield chunk.astype('<f4').tobytes()
+            continue
+        chunk = np.clip(chunk, -1, 1)
+        if bit_depth == 16:
+            yield (chunk * 32767).round().astype('<i2').tobytes()
+        else:
+            # little-endian 24-bit: the three low bytes of each int32
+            chunk = (chunk * 8388607).round().astype('<i4')
+            yield chunk.view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+
+
+def _encode_with_av(audio: np.ndarray, sampling_rate: int, format: str, bit_depth: int,
+                    chunk_size: int, file) -> Iterator[None]:
+    # encodes into file, yielding after every chunk
+    audio_format = AUDIO_FORMATS[format]
+    with av.open(file, 'w', format=audio_format.container) as container:
+        if format == 'opus':
+            stream = container.add_stream('libopus', rate=_OPUS_SAMPLING_RATE, layout='mono')
+        else:
+            stream = container.add_stream('flac', rate=sampling_rate, layout='mono')
+            # the FLAC encoder stores s32 input as 24-bit samples
+            stream.format = 's16' if bit_depth == 16 else 's32'
+
+        for start in range(0, audio.shape[-1], chunk_size):
+            chunk = np.ascontiguousarray(audio[:, start:start + chunk_size])
+            frame = av.AudioFrame.from_ndarray(chunk, format='flt', layout='mono')
+            frame.sample_rate = sampling_rate
+            for packet in stream.encode(frame):
+                container.mux(packet)
+            yield
+
+        for packet in stream.encode():
+            container.mux(packet)
+
+
+def _prepare_audio(audio: torch.Tensor, sampling_rate: int, format: str, bit_depth: int,
+                   chunk_sec: float) -> tuple[np.ndarray, int]:
+    get_audio_format(format, bit_depth)
+    assert audio.dim() == 2 and audio.shape[0] == 1, f'Expected mono audio, got {audio.shape}'
+    return audio.detach().float().cpu().numpy(), max(1, int(chunk_sec * sampling_rate))
+
+
+def iter_encoded_audio(audio: torch.Tensor,
+                       sampling_rate: int,
+                       format: str = 'flac',
+                       bit_depth: int = 16,
+                       chunk_sec: float = 0.5) -> Iterator[bytes]:
+    """
+    Encodes mono audio (1, L) in chunks of chunk_sec seconds and yields the encoded bytes as soon
+    as they are available, so that a response can start before the whole file is encoded.
+    Nothing is written to disk. The output cannot be seeked back into, so a FLAC stream lacks
+    the total number of samples and the MD5 in its header; use encode_audio for stored files.
+    """
+    audio_np, chunk_size = _prepare_audio(audio, sampling_rate, format, bit_depth, chunk_sec)
+    if format == 'wav':
+        yield from _iter_wav(audio_np, sampling_rate, bit_depth, chunk_size)
+        return
+
+    writer = _ChunkWriter()
+    for _ in _encode_with_av(audio_np, sampling_rate, format, bit_depth, chunk_size, writer):
+        data = writer.pop()
+        if data:
+            yield data
+    yield writer.pop()
+
+
+def encode_audio(audio: torch.Tensor,
+                 sampling_rate: int,
+                 format: str = 'flac',
+                 bit_depth: int = 16) -> bytes:
+    """
+    Encodes the whole of mono audio (1, L) in memory into a complete file; the muxer can seek
+    back to finalize the header, as when writing to disk
+    """
+    audio_np, chunk_size = _prepare_audio(audio, sampling_rate, format, bit_depth, 8.0)
+    if format == 'wav':
+        return b''.join(_iter_wav(audio_np, sampling_rate, bit_depth, chunk_size))
+
+    buffer = io.BytesIO()
+    for _ in _encode_with_av(audio_np, sampling_rate, format, bit_depth, chunk_size, buffer):
+        pass
+    return buffer.getvalue()
@@ -0,0 +1,227 @@
+import dataclasses
+import heapq
+import itertools
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, Callable, Hashable, Literal, Optional
+
+if TYPE_CHECKING:
+    from mmaudio.serving.worker import InferenceRequest, InferenceResult
+
+JobStatus = Literal['queued', 'running', 'completed', 'failed', 'cancelled']
+
+
+class QueueFullError(RuntimeError):
+    pass
+
+
+class QueueClosedError(RuntimeError):
+    pass
+
+
+@dataclasses.dataclass(eq=False)
+class Job:
+    request: 'InferenceRequest'
+    priority: int = 0
+    id: str = dataclasses.field(default_factory=lambda: uuid.uuid4().hex)
+    status: JobStatus = 'queued'
+    # number of completed ODE steps out of total_steps
+    progress: int = 0
+    total_steps: int = 0
+    result: Optional['InferenceResult'] = None
+    error: Optional[str] = None
+    # where the encoded result was stored, if it was
+    output_url: Optional[str] = None
+    created_at: float = dataclasses.field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    future: Future = dataclasses.field(default_factory=Future, repr=False)
+
+    @property
+    def done(self) -> bool:
+        return self.status in ('completed', 'failed', 'cancelled')
+
+    def set_progress(self, step: int, total_steps: int) -> None:
+        self.progress = step
+        self.total_steps = total_steps
+
+    def set_running(self) -> bool:
+        if not self.future.set_running_or_notify_cancel():
+            # the future may have been cancelled directly rather than through cancel()
+            self._set_cancelled()
+            return False
+        self.status = 'running'
+        self.started_at = time.time()
+        return True
+
+    def cancel(self) -> bool:
+        # only a job that has not started running can be cancelled
+        if not self.future.cancel():
+            return False
+        self._set_cancelled()
+        return True
+
+    def _set_cancelled(self) -> None:
+        if self.status != 'cancelled':
+            self.status = 'cancelled'
+            self.finished_at = time.time()
+
+    def set_result(self, result: 'InferenceResult') -> None:
+        self.result = result
+        self.status = 'completed'
+        self.finished_at = time.time()
+        self.future.set_result(result)
+
+    def set_exception(self, e: BaseException) -> None:
+        self.error = str(e)
+        self.status = 'failed'
+        self.finished_at = time.time()
+        self.future.set_exception(e)
+
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'status': self.status,
+            'progress': self.progress,
+            'total_steps': self.total_steps,
+            'error': self.error,
+            'output_url': self.output_url,
+            'skipped_block_fraction':
+            self.result.skipped_block_fraction if self.result is not None else None,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class JobQueue:
+    """
+    A bounded, thread-safe priority queue of jobs.
+    Jobs with a higher priority are served first; ties are served in submission order.
+    `put` refuses new jobs instead of blocking when the queue is full so that callers can apply
+    backpressure upstream.
+    """
+
+    def __init__(self, maxsize: int = 64):
+        self.maxsize = maxsize
+        self._heap: list[tuple[int, int, Job]] = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def __len__(self) -> int:
+        with self._cond:
+            return len(self._heap)
+
+    def put(self, job: Job) -> None:
+        with self._cond:
+            if self._closed:
+                raise QueueClosedError('The job queue is closed')
+            if self.maxsize > 0 and len(self._heap) >= self.maxsize:
+                raise QueueFullError(f'The job queue is full ({self.maxsize} jobs)')
+            heapq.heappush(self._heap, (-job.priority, next(self._counter), job))
+            self._cond.notify()
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Job]:
+        """
+        Returns None when the queue is closed and drained, or on timeout
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._heap or self._closed, timeout):
+                return None
+            if not self._heap:
+                return None
+            return heapq.heappop(self._heap)[-1]
+
+    def get_batch(self,
+                  max_samples: int,
+                  max_wait: float,
+                  key: Callable[[Job], Hashable],
+                  timeout: Optional[float] = None) -> list[Job]:
+        """
+        Blocks for the first job, then keeps collecting queued jobs with the same key for up to
+        max_wait seconds or until they request max_samples samples in total (see
+        InferenceRequest.num_samples); the first job is always taken.
+        Jobs with other keys stay in the queue in their original order.
+        Returns an empty list when the queue is closed and drained, or on timeout
+        """
+        first_job = self.get(timeout)
+        if first_job is None:
+            return []
+
+        batch = [first_job]
+        batch_key = key(first_job)
+        num_samples = first_job.request.num_samples
+        deadline = time.monotonic() + max_wait
+        with self._cond:
+            while num_samples < max_samples:
+                matching = sorted(item for item in self._heap if key(item[-1]) == batch_key)
+                if matching:
+                    # in serving order, as long as they fit
+                    fitting = []
+                    for item in matching:
+                        if num_samples + item[-1].request.num_samples > max_samples:
+                            break
+                        fitting.append(item)
+                        num_samples += item[-1].request.num_samples
+                    if not fitting:
+                        break
+                    taken = {id(item[-1]) for item in fitting}
+                    self._heap = [item for item in self._heap if id(item[-1]) not in taken]
+                    heapq.heapify(self._heap)
+                    batch.extend(item[-1] for item in fitting)
+                    continue
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._closed:
+                    break
+                self._cond.wait(remaining)
+        return batch
+
+    def position(self, job: Job) -> Optional[int]:
+        # 0-based position in the serving order, None if the job is not waiting
+        with self._cond:
+            for i, (_, _, queued_job) in enumerate(sorted(self._heap)):
+                if queued_job is job:
+                    return i
+        return None
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class JobRegistry:
+    """
+    Keeps the jobs addressable by id; finished jobs are evicted oldest-first beyond a limit
+    so that completed results do not accumulate forever.
+    """
+
+    def __init__(self, max_finished_jobs: int = 256):
+        self.max_finished_jobs = max_finished_jobs
+        self._jobs: dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def add(self, job: Job) -> None:
+        with self._lock:
+            self._jobs[job.id] = job
+            self._evict()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _evict(self) -> None:
+        finished = [job for job in self._jobs.values() if job.done]
+        if len(finished) <= self.max_finished_jobs:
+            return
+        finished.sort(key=lambda job: job.finished_at)
+        for job in finished[:len(finished) - self.max_finished_jobs]:
+            del self._jobs[job.id]
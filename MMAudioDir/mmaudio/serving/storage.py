@@ -0,0 +1,212 @@
+import asyncio
+import json
+import logging
+import shutil
+import sqlite3
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Optional, TypeVar, Union
+
+log = logging.getLogger()
+
+T = TypeVar('T')
+
+
+class StorageError(RuntimeError):
+    pass
+
+
+class StorageBackend(ABC):
+    """
+    Where the uploaded videos and the generated audio are stored, and where the metadata records
+    of the generations are kept.
+    The methods are coroutines; the blocking I/O runs on the backend's own thread pool so that it
+    never blocks the event loop and overlaps with sampling on the inference worker.
+    """
+
+    def __init__(self, max_workers: int):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix=type(self).__name__)
+
+    async def _run(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._executor, partial(fn, *args, **kwargs))
+        except StorageError:
+            raise
+        except Exception as e:
+            raise StorageError(str(e)) from e
+
+    async def upload_file(self,
+                          path: Union[str, Path],
+                          key: str,
+                          content_type: Optional[str] = None) -> str:
+        """
+        Stores the file at path under key and returns its public URL
+        """
+        return await self._run(self._upload_file, Path(path), key, content_type)
+
+    async def upload_bytes(self, data: bytes, key: str, content_type: Optional[str] = None) -> str:
+        """
+        Stores data under key and returns its public URL
+        """
+        return await self._run(self._upload_bytes, data, key, content_type)
+
+    async def insert_record(self, table: str, record: dict[str, Any]) -> str:
+        """
+        Inserts a metadata record and returns its id
+        """
+        return await self._run(self._insert_record, table, record)
+
+    async def update_record(self, table: str, record_id: str, fields: dict[str, Any]) -> None:
+        await self._run(self._update_record, table, record_id, fields)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+    @abstractmethod
+    def _upload_file(self, path: Path, key: str, content_type: Optional[str]) -> str:
+        ...
+
+    @abstractmethod
+    def _upload_bytes(self, data: bytes, key: str, content_type: Optional[str]) -> str:
+        ...
+
+    @abstractmethod
+    def _insert_record(self, table: str, record: dict[str, Any]) -> str:
+        ...
+
+    @abstractmethod
+    def _update_record(self, table: str, record_id: str, fields: dict[str, Any]) -> None:
+        ...
+
+
+class SupabaseStorage(StorageBackend):
+    """
+    Supabase storage bucket + Postgres tables.
+    One client is shared by all threads of the pool; it keeps a pool of HTTP connections, so
+    concurrent uploads and writes reuse connections instead of opening one each.
+    """
+
+    def __init__(self, url: str, key: str, bucket: str, *, max_workers: int = 8):
+        # supabase is only needed by the server, not by the mmaudio package
+        from supabase import create_client
+
+        super().__init__(max_workers)
+        self.client = create_client(url, key)
+        self.bucket = bucket
+
+    def _upload_file(self, path: Path, key: str, content_type: Optional[str]) -> str:
+        # the client streams the file instead of reading it into memory
+        with open(path, 'rb') as f:
+            return self._upload(f, key, content_type)
+
+    def _upload_bytes(self, data: bytes, key: str, content_type: Optional[str]) -> str:
+        return self._upload(data, key, content_type)
+
+    def _upload(self, data: Union[bytes, BinaryIO], key: str, content_type: Optional[str]) -> str:
+        storage = self.client.storage.from_(self.bucket)
+        file_options = {'content-type': content_type} if content_type is not None else None
+        response = storage.upload(key, data, file_options=file_options)
+        status_code = getattr(response, 'status_code', 200)
+        if status_code != 200:
+            raise StorageError(f'Error uploading {key}: {getattr(response, "text", status_code)}')
+        return storage.get_public_url(key)
+
+    def _insert_record(self, table: str, record: dict[str, Any]) -> str:
+        response = self.client.table(table).insert(record).execute()
+        if getattr(response, 'error', None):
+            raise StorageError(f'Error creating database record: {response.error.message}')
+        return response.data[0]['id']
+
+    def _update_record(self, table: str, record_id: str, fields: dict[str, Any]) -> None:
+        response = self.client.table(table).update(fields).eq('id', record_id).execute()
+        if getattr(response, 'error', None):
+            raise StorageError(f'Error updating database record: {response.error.message}')
+
+
+class LocalStorage(StorageBackend):
+    """
+    Files in a local directory and records in a SQLite database, for tests and on-prem
+    deployments. Records are stored as JSON objects so that any table and fields can be used.
+    """
+
+    def __init__(self,
+                 root: Union[str, Path],
+                 *,
+                 db_path: Optional[Union[str, Path]] = None,
+                 base_url: Optional[str] = None,
+                 max_workers: int = 4):
+        super().__init__(max_workers)
+        self.root = Path(root).resolve()
+        self.root.mkdir(parents=True, exist_ok=True)
+        # the URL prefix under which root is served, if any
+        self.base_url = base_url.rstrip('/') if base_url is not None else None
+
+        db_path = Path(db_path) if db_path is not None else self.root / 'metadata.sqlite3'
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db_lock = threading.Lock()
+        self._tables: set[str] = set()
+
+    def _get_path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if self.root not in path.parents:
+            raise StorageError(f'Invalid key: {key}')
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def _get_url(self, path: Path) -> str:
+        if self.base_url is None:
+            return path.as_uri()
+        return f'{self.base_url}/{path.relative_to(self.root).as_posix()}'
+
+    def _upload_file(self, path: Path, key: str, content_type: Optional[str]) -> str:
+        target = self._get_path(key)
+        shutil.copyfile(path, target)
+        return self._get_url(target)
+
+    def _upload_bytes(self, data: bytes, key: str, content_type: Optional[str]) -> str:
+        target = self._get_path(key)
+        target.write_bytes(data)
+        return self._get_url(target)
+
+    def _ensure_table(self, table: str) -> None:
+        if not table.isidentifier():
+            raise StorageError(f'Invalid table name: {table}')
+        if table not in self._tables:
+            self._db.execute(f'CREATE TABLE IF NOT EXISTS {table} '
+                             '(id TEXT PRIMARY KEY, record TEXT NOT NULL)')
+            self._tables.add(table)
+
+    def _insert_record(self, table: str, record: dict[str, Any]) -> str:
+        record_id = uuid.uuid4().hex
+        with self._db_lock:
+            self._ensure_table(table)
+            self._db.execute(f'INSERT INTO {table} (id, record) VALUES (?, ?)',
+                             (record_id, json.dumps(record)))
+        return record_id
+
+    def _update_record(self, table: str, record_id: str, fields: dict[str, Any]) -> None:
+        with self._db_lock:
+            self._ensure_table(table)
+            cursor = self._db.execute(
+                f'UPDATE {table} SET record = json_patch(record, ?) WHERE id = ?',
+                (json.dumps(fields), record_id))
+        if cursor.rowcount == 0:
+            raise StorageError(f'No record {record_id} in {table}')
+
+    def get_record(self, table: str, record_id: str) -> Optional[dict[str, Any]]:
+        with self._db_lock:
+            self._ensure_table(table)
+            row = self._db.execute(f'SELECT record FROM {table} WHERE id = ?',
+                                   (record_id, )).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def close(self) -> None:
+        super().close()
+        self._db.close()
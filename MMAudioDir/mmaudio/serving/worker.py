@@ -0,0 +1,432 @@
+import dataclasses
+import logging
+import math
+import threading
+from pathlib import Path
+from typing import Callable, Hashable, Optional, Sequence
+
+import torch
+
+from mmaudio.data.feature_store import VideoFeatures, VideoFeatureStore, hash_file
+from mmaudio.eval_utils import ModelConfig, all_model_cfg, generate, load_video
+from mmaudio.model.buckets import (DEFAULT_BUCKET_DURATIONS, DurationBucket, DurationBuckets,
+                                   pad_sequence)
+from mmaudio.model.flow_matching import SCHEDULES, SOLVERS, FlowMatching
+from mmaudio.model.guidance import GuidanceSchedule
+from mmaudio.model.networks import MMAudio, load_my_mmaudio
+from mmaudio.model.quantization import quantize_int8
+from mmaudio.model.sequence_config import SequenceConfig
+from mmaudio.model.step_cache import StepCache
+from mmaudio.model.utils.features_utils import CLIP_MODEL_NAME, FeaturesUtils
+from mmaudio.model.utils.text_cache import TextFeatureCache
+from mmaudio.serving.jobs import Job, JobQueue, JobRegistry
+
+log = logging.getLogger()
+
+
+@dataclasses.dataclass
+class InferenceRequest:
+    prompt: str = ''
+    negative_prompt: str = ''
+    video_path: Optional[Path] = None
+    # the audio is generated for [start_sec, start_sec + duration] of the video
+    start_sec: float = 0.0
+    duration: float = 8.0
+    num_steps: int = 25
+    # ODE solver and step schedule, see FlowMatching
+    sampler: str = 'euler'
+    schedule: str = 'uniform'
+    # skip the fused blocks while the relative change of their input stays below this; 0 disables
+    cache_threshold: float = 0.0
+    cfg_strength: float = 4.5
+    # guidance is only applied for flow times t in the interval (0: noise, 1: data),
+    # with a strength that follows the schedule, see GuidanceSchedule
+    cfg_interval: tuple[float, float] = (0.0, 1.0)
+    cfg_schedule: str = 'constant'
+    seed: int = 42
+    mask_away_clip: bool = False
+    # number of variations, sampled from differently-seeded noise with shared conditions
+    num_samples: int = 1
+    # SHA-256 of the video file; computed by the worker if needed and not given
+    video_hash: Optional[str] = None
+
+    @property
+    def batch_key(self) -> Hashable:
+        # requests with the same key and duration bucket can be sampled together
+        # in a single generate() call
+        return (self.num_steps, self.sampler, self.schedule, self.cache_threshold,
+                self.cfg_strength, tuple(self.cfg_interval), self.cfg_schedule,
+                self.video_path is not None, self.mask_away_clip, self.num_samples)
+
+
+@dataclasses.dataclass
+class InferenceResult:
+    audio: torch.Tensor  # (num_samples, L), float32 on the CPU
+    sampling_rate: int
+    duration_sec: float
+    # the fraction of fused block evaluations that the step cache skipped, if enabled
+    skipped_block_fraction: Optional[float] = None
+
+
+def get_default_device() -> str:
+    if torch.cuda.is_available():
+        return 'cuda'
+    elif torch.backends.mps.is_available():
+        return 'mps'
+    log.warning('CUDA/MPS are not available, running on CPU')
+    return 'cpu'
+
+
+class InferenceWorker:
+    """
+    Keeps the network, the feature extractors, and the flow matching samplers resident
+    and runs the submitted jobs on a dedicated thread.
+    Jobs wait in a bounded priority queue; `submit` raises QueueFullError when it is full.
+
+    Requests are served from precomputed duration buckets: the sequence lengths and rotations
+    live in the buckets and shorter requests are padded and masked, so the network is never
+    mutated per request.
+    Jobs that share a bucket and a batch key (see InferenceRequest.batch_key) and arrive within
+    max_batch_wait seconds of each other are sampled together, up to max_batch_size samples
+    (counting the num_samples variations of every job) at once.
+    A worker serves a single model variant.
+
+    The modules are passed in so that a small, randomly-initialized network can be used on the CPU,
+    and so can a feature extractor without checkpoints: feature_utils only needs the interface of
+    FeaturesUtils that generate and the worker use (encode_text, encode_video_with_clip/sync,
+    decode, vocode, device, dtype, and text_cache); see tests/conftest.py.
+    Use `from_pretrained` to load a released model.
+    """
+
+    def __init__(self,
+                 net: MMAudio,
+                 feature_utils: FeaturesUtils,
+                 seq_cfg: SequenceConfig,
+                 *,
+                 max_queue_size: int = 64,
+                 max_finished_jobs: int = 256,
+                 max_batch_size: int = 8,
+                 max_batch_wait: float = 0.02,
+                 bucket_durations: Sequence[float] = DEFAULT_BUCKET_DURATIONS,
+                 batched_cfg: bool = True,
+                 scale_in_decoder: bool = True,
+                 feature_store: Optional[VideoFeatureStore] = None):
+        self.net = net
+        # the worker only runs inference with fixed weights
+        self.net.cache_empty_conditions = True
+        self.feature_utils = feature_utils
+        self.seq_cfg = seq_cfg
+        self.buckets = DurationBuckets(net, seq_cfg, bucket_durations)
+        self.batched_cfg = batched_cfg
+        self.scale_in_decoder = scale_in_decoder
+        self.feature_store = feature_store
+        self.max_batch_size = max_batch_size
+        self.max_batch_wait = max_batch_wait
+
+        # FlowMatching is stateless apart from its settings; keep one per number of steps
+        self._fms: dict[tuple[int, str, str], FlowMatching] = {}
+        self.queue = JobQueue(max_queue_size)
+        self.jobs = JobRegistry(max_finished_jobs)
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_pretrained(cls,
+                        variant: str = 'large_44k_v2',
+                        *,
+                        device: Optional[str] = None,
+                        full_precision: bool = False,
+                        text_cache: Optional[TextFeatureCache] = None,
+                        feature_store_dir: Optional[Path] = None,
+                        decode_chunk_sec: Optional[float] = None,
+                        quantize: bool = False,
+                        **kwargs) -> 'InferenceWorker':
+        """
+        decode_chunk_sec: decode and vocode in crossfaded chunks of about this many seconds,
+            which bounds their peak memory for long durations
+        quantize: run the network in int8 (dynamic for linear layers, weight-only for
+            convolutions); CPU only, everything else runs in float32
+        """
+        if variant not in all_model_cfg:
+            raise ValueError(f'Unknown model variant: {variant}')
+        model: ModelConfig = all_model_cfg[variant]
+        model.download_if_needed()
+
+        if device is None:
+            device = 'cpu' if quantize else get_default_device()
+        if quantize and torch.device(device).type != 'cpu':
+            raise ValueError('Quantization is only supported on the CPU')
+        dtype = torch.float32 if full_precision or quantize else torch.bfloat16
+
+        net: MMAudio = load_my_mmaudio(model.model_name, model.model_path).to(device, dtype).eval()
+        log.info(f'Loaded weights from {model.model_path}')
+        if quantize:
+            net = quantize_int8(net)
+
+        feature_utils = FeaturesUtils(tod_vae_ckpt=model.vae_path,
+                                      synchformer_ckpt=model.synchformer_ckpt,
+                                      enable_conditions=True,
+                                      mode=model.mode,
+                                      bigvgan_vocoder_ckpt=model.bigvgan_16k_path,
+                                      need_vae_encoder=False,
+                                      text_cache=text_cache)
+        if decode_chunk_sec is not None:
+            seq_cfg = dataclasses.replace(model.seq_cfg, duration=decode_chunk_sec)
+            feature_utils.decode_chunk_size = seq_cfg.latent_seq_len
+            feature_utils.vocode_chunk_size = seq_cfg.latent_seq_len * seq_cfg.latent_downsample_rate
+        feature_utils = feature_utils.to(device, dtype).eval()
+
+        feature_store = None
+        if feature_store_dir is not None:
+            # the frame resampling also affects the features
+            decoder = 'libav' if kwargs.get('scale_in_decoder', True) else 'torchvision'
+            model_version = f'{CLIP_MODEL_NAME}|{model.synchformer_ckpt.name}|{dtype}|{decoder}'
+            feature_store = VideoFeatureStore(feature_store_dir, model_version)
+
+        return cls(net, feature_utils, model.seq_cfg, feature_store=feature_store, **kwargs)
+
+    @property
+    def device(self) -> torch.device:
+        return self.feature_utils.device
+
+    def stats(self) -> dict:
+        stats = {'queued_jobs': len(self.queue)}
+        if self.feature_utils.text_cache is not None:
+            stats['text_cache'] = self.feature_utils.text_cache.stats()
+        if self.feature_store is not None:
+            stats['feature_store'] = self.feature_store.stats()
+        return stats
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.is_running:
+            return
+        if self.queue.closed:
+            self.queue = JobQueue(self.queue.maxsize)
+        self._thread = threading.Thread(target=self._loop, name='mmaudio-worker', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        if not self.is_running:
+            return
+        # the loop exits once the pending jobs are done
+        self.queue.close()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def submit(self, request: InferenceRequest, priority: int = 0) -> Job:
+        if not request.duration > 0:
+            raise ValueError('duration must be positive')
+        # raises ValueError for durations beyond the longest bucket
+        self.buckets.select(request.duration)
+        if request.start_sec < 0:
+            raise ValueError('start_sec must not be negative')
+        if request.num_steps < 1:
+            raise ValueError('num_steps must be at least 1')
+        if not 1 <= request.num_samples <= self.max_batch_size:
+            raise ValueError(f'num_samples must be between 1 and {self.max_batch_size}')
+        if request.sampler not in SOLVERS:
+            raise ValueError(f'Unknown sampler: {request.sampler}; expected one of {list(SOLVERS)}')
+        if request.schedule not in SCHEDULES:
+            raise ValueError(f'Unknown schedule: {request.schedule}; '
+                             f'expected one of {list(SCHEDULES)}')
+        if request.cache_threshold < 0:
+            raise ValueError('cache_threshold must not be negative')
+        if not 0 <= request.cfg_strength < math.inf:
+            raise ValueError('cfg_strength must be a non-negative number')
+        # raises ValueError for invalid intervals and schedules
+        GuidanceSchedule(request.cfg_strength, tuple(request.cfg_interval), request.cfg_schedule)
+        job = Job(request=request, priority=priority, total_steps=request.num_steps)
+        self.queue.put(job)
+        self.jobs.add(job)
+        return job
+
+    def _loop(self) -> None:
+        while True:
+            jobs = self.queue.get_batch(self.max_batch_size,
+                                        self.max_batch_wait,
+                                        key=self._batch_key)
+            if not jobs:
+                break
+            jobs = [job for job in jobs if job.set_running()]
+
+            # a job whose inputs cannot be prepared (e.g., an undecodable video) fails on its own
+            prepared = []
+            for job in list(jobs):
+                try:
+                    prepared.append(self._prepare(job.request))
+                except Exception as e:
+                    log.exception(f'Preparing job {job.id} failed')
+                    job.set_exception(e)
+                    jobs.remove(job)
+            if not jobs:
+                continue
+
+            def progress_callback(step: int, total_steps: int) -> None:
+                for job in jobs:
+                    job.set_progress(step, total_steps)
+
+            try:
+                results = self.run_batch([job.request for job in jobs],
+                                         progress_callback=progress_callback,
+                                         prepared=prepared)
+            except Exception as e:
+                log.exception(f'Batch of {len(jobs)} job(s) failed')
+                for job in jobs:
+                    job.set_exception(e)
+                continue
+
+            for job, result in zip(jobs, results):
+                job.set_result(result)
+
+    def _batch_key(self, job: Job) -> Hashable:
+        return (self.buckets.select(job.request.duration).duration, job.request.batch_key)
+
+    def _get_fm(self, request: InferenceRequest) -> FlowMatching:
+        key = (request.num_steps, request.sampler, request.schedule)
+        if key not in self._fms:
+            self._fms[key] = FlowMatching(min_sigma=0,
+                                          inference_mode=request.sampler,
+                                          num_steps=request.num_steps,
+                                          schedule=request.schedule)
+        return self._fms[key]
+
+    @torch.inference_mode()
+    def _prepare(self, request: InferenceRequest) -> VideoFeatures:
+        if request.video_path is None:
+            return VideoFeatures(clip_features=None, sync_features=None,
+                                 duration_sec=request.duration)
+
+        need_clip = not request.mask_away_clip
+        if self.feature_store is not None:
+            if request.video_hash is None:
+                request.video_hash = hash_file(request.video_path)
+            features = self.feature_store.get(request.video_hash,
+                                              request.duration,
+                                              request.start_sec,
+                                              need_clip=need_clip)
+            if features is not None:
+                log.info(f'Using cached features of video {request.video_path}')
+                if not need_clip:
+                    features.clip_features = None
+                return features
+
+        log.info(f'Using video {request.video_path}')
+        video_info = load_video(request.video_path,
+                                request.duration,
+                                scale_in_decoder=self.scale_in_decoder,
+                                start_sec=request.start_sec)
+        device = self.device
+        dtype = self.feature_utils.dtype
+        clip_features = None
+        if need_clip:
+            clip_features = self.feature_utils.encode_video_with_clip(
+                video_info.clip_frames.unsqueeze(0).to(device, dtype), batch_size=40)
+        sync_features = self.feature_utils.encode_video_with_sync(
+            video_info.sync_frames.unsqueeze(0).to(device, dtype), batch_size=40)
+        features = VideoFeatures(clip_features=clip_features,
+                                 sync_features=sync_features,
+                                 duration_sec=video_info.duration_sec)
+
+        if self.feature_store is not None:
+            self.feature_store.put(request.video_hash, request.duration, request.start_sec,
+                                   features)
+        return features
+
+    def run(self,
+            request: InferenceRequest,
+            progress_callback: Optional[Callable[[int, int], None]] = None) -> InferenceResult:
+        return self.run_batch([request], progress_callback=progress_callback)[0]
+
+    @torch.inference_mode()
+    def run_batch(
+            self,
+            requests: list[InferenceRequest],
+            progress_callback: Optional[Callable[[int, int], None]] = None,
+            prepared: Optional[list[VideoFeatures]] = None) -> list[InferenceResult]:
+        """
+        Runs requests that share a batch key and returns their results in order.
+        All requests are sampled in the bucket of the longest one.
+        prepared: the inputs of the requests from _prepare, if they have been prepared already
+        """
+        assert len({request.batch_key for request in requests}) == 1
+
+        if prepared is None:
+            prepared = [self._prepare(request) for request in requests]
+        bucket = self.buckets.select(max(request.duration for request in requests))
+        step_cache = None
+        if requests[0].cache_threshold > 0:
+            step_cache = StepCache(requests[0].cache_threshold)
+        audios = self._generate(requests, prepared, bucket, progress_callback, step_cache)
+        skipped_block_fraction = step_cache.skipped_fraction if step_cache is not None else None
+
+        results = []
+        num_samples = requests[0].num_samples
+        for i, inputs in enumerate(prepared):
+            num_audio_frames = bucket.get_seq_cfg(inputs.duration_sec).num_audio_frames
+            audio = audios[i * num_samples:(i + 1) * num_samples]
+            results.append(
+                InferenceResult(audio=audio[:, :num_audio_frames],
+                                sampling_rate=self.seq_cfg.sampling_rate,
+                                duration_sec=inputs.duration_sec,
+                                skipped_block_fraction=skipped_block_fraction))
+        return results
+
+    def _generate(self, requests: list[InferenceRequest], prepared: list[VideoFeatures],
+                  bucket: DurationBucket,
+                  progress_callback: Optional[Callable[[int, int], None]],
+                  step_cache: Optional[StepCache] = None) -> torch.Tensor:
+        device = self.device
+        dtype = self.feature_utils.dtype
+
+        # the videos can have different lengths; pad their features to the bucket
+        clip_features = sync_features = None
+        if prepared[0].clip_features is not None:
+            clip_features = torch.cat([
+                pad_sequence(inputs.clip_features.to(device, dtype), bucket.clip_seq_len,
+                             self.net.empty_clip_feat) for inputs in prepared
+            ])
+        if prepared[0].sync_features is not None:
+            sync_features = torch.cat([
+                pad_sequence(inputs.sync_features.to(device, dtype), bucket.sync_seq_len,
+                             self.net.empty_sync_feat) for inputs in prepared
+            ])
+
+        # draw the initial noise of every request from its own seed so that the result
+        # does not depend on what else is in the batch
+        x0 = []
+        for request in requests:
+            rng = torch.Generator(device=device)
+            rng.manual_seed(request.seed)
+            x0.append(
+                torch.randn(request.num_samples,
+                            bucket.latent_seq_len,
+                            self.net.latent_dim,
+                            device=device,
+                            dtype=dtype,
+                            generator=rng))
+        x0 = torch.cat(x0, dim=0)
+
+        audios = generate(None,
+                          None, [request.prompt for request in requests],
+                          negative_text=[request.negative_prompt for request in requests],
+                          feature_utils=self.feature_utils,
+                          net=self.net,
+                          fm=self._get_fm(requests[0]),
+                          rng=None,
+                          cfg_strength=requests[0].cfg_strength,
+                          progress_callback=progress_callback,
+                          x0=x0,
+                          bucket=bucket,
+                          durations=[inputs.duration_sec for inputs in prepared],
+                          clip_features=clip_features,
+                          sync_features=sync_features,
+                          batched_cfg=self.batched_cfg,
+                          num_samples_per_prompt=requests[0].num_samples,
+                          step_cache=step_cache,
+                          cfg_interval=requests[0].cfg_interval,
+                          cfg_schedule=requests[0].cfg_schedule)
+        # (B * num_samples, L)
+        return audios.float().cpu().flatten(0, -2)
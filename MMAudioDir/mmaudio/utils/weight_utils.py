@@ -0,0 +1,107 @@
+import contextlib
+import logging
+from pathlib import Path
+from typing import Iterator, Optional, Union
+
+import torch
+import torch.nn as nn
+from safetensors.torch import load_file, save_file
+
+log = logging.getLogger()
+
+
+def get_safetensors_path(path: Union[str, Path]) -> Path:
+    return Path(path).with_suffix('.safetensors')
+
+
+def _torch_load(path: Union[str, Path]) -> dict:
+    try:
+        return torch.load(path, map_location='cpu', weights_only=True, mmap=True)
+    except RuntimeError:
+        # checkpoints in the legacy (non-zip) format cannot be memory-mapped
+        return torch.load(path, map_location='cpu', weights_only=True)
+
+
+def convert_to_safetensors(src: Union[str, Path],
+                           dst: Optional[Union[str, Path]] = None,
+                           *,
+                           key: Optional[str] = None) -> Path:
+    """
+    Converts a torch checkpoint to safetensors, by default next to it where load_state_dict
+    picks it up.
+    key: convert the state dict stored under this key of the checkpoint, e.g., 'generator';
+        load_state_dict must then be called with the same key
+    """
+    src = Path(src)
+    dst = Path(dst) if dst is not None else get_safetensors_path(src)
+    state_dict = _torch_load(src)
+    if key is not None:
+        state_dict = state_dict[key]
+
+    # safetensors stores every tensor on its own and contiguously
+    tensors = {}
+    storages = set()
+    for name, value in state_dict.items():
+        if not isinstance(value, torch.Tensor):
+            log.warning(f'Skipping {name} in {src}: not a tensor')
+            continue
+        value = value.contiguous()
+        storage = value.untyped_storage().data_ptr()
+        if storage in storages:
+            value = value.clone()
+        storages.add(storage)
+        tensors[name] = value
+
+    save_file(tensors, dst, metadata={'source': src.name})
+    log.info(f'Converted {src} to {dst}')
+    return dst
+
+
+def load_state_dict(path: Union[str, Path],
+                    *,
+                    key: Optional[str] = None) -> dict[str, torch.Tensor]:
+    """
+    Loads a state dict to the CPU without copying it into memory: from the safetensors version
+    of path if it has been converted (see convert_to_safetensors), otherwise memory-mapped
+    from the torch checkpoint. The tensors are paged in from the file when they are used.
+    """
+    safetensors_path = get_safetensors_path(path)
+    if safetensors_path.exists():
+        return load_file(safetensors_path, device='cpu')
+    state_dict = _torch_load(path)
+    return state_dict[key] if key is not None else state_dict
+
+
+@contextlib.contextmanager
+def init_empty_weights() -> Iterator[None]:
+    """
+    Creates the parameters of the modules constructed in this context on the meta device, so that
+    they take no memory and their random initialization is skipped; load them with
+    load_state_dict(..., assign=True) afterwards. Buffers, which are often computed and not
+    stored in checkpoints, are created as usual.
+    """
+    register_parameter = nn.Module.register_parameter
+
+    def register_empty_parameter(module: nn.Module, name: str,
+                                 param: Optional[nn.Parameter]) -> None:
+        register_parameter(module, name, param)
+        if param is not None:
+            param = module._parameters[name]
+            module._parameters[name] = type(param)(param.to('meta'),
+                                                   requires_grad=param.requires_grad)
+
+    nn.Module.register_parameter = register_empty_parameter
+    try:
+        yield
+    finally:
+        nn.Module.register_parameter = register_parameter
+
+
+def check_materialized(module: nn.Module) -> None:
+    # raises if a parameter or buffer was not loaded after init_empty_weights
+    missing = [
+        name for name, tensor in [*module.named_parameters(), *module.named_buffers()]
+        if tensor.is_meta
+    ]
+    if missing:
+        raise RuntimeError(f'Weights missing from the checkpoint: {missing}')
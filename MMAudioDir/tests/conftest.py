@@ -0,0 +1,137 @@
+import zlib
+from typing import Callable, Iterator
+
+import pytest
+import torch
+import torch.nn as nn
+
+from mmaudio.model.networks import MMAudio
+from mmaudio.model.sequence_config import SequenceConfig
+from mmaudio.serving.worker import InferenceWorker
+
+# the dimensions of the tiny network
+LATENT_DIM = 8
+FEATURE_DIM = 16
+LATENT_SEQ_LEN = 25
+CLIP_SEQ_LEN = 8
+SYNC_SEQ_LEN = 24
+TEXT_SEQ_LEN = 7
+
+# 50 latents per second; 32 audio samples per latent
+TINY_SEQ_CFG = SequenceConfig(duration=2.0, sampling_rate=1600, spectrogram_frame_rate=16)
+
+
+@pytest.fixture
+def tiny_net() -> MMAudio:
+    # a small, randomly-initialized network that runs on the CPU
+    torch.manual_seed(0)
+    net = MMAudio(latent_dim=LATENT_DIM,
+                  clip_dim=FEATURE_DIM,
+                  sync_dim=FEATURE_DIM,
+                  text_dim=FEATURE_DIM,
+                  hidden_dim=64,
+                  depth=3,
+                  fused_depth=1,
+                  num_heads=2,
+                  latent_seq_len=LATENT_SEQ_LEN,
+                  clip_seq_len=CLIP_SEQ_LEN,
+                  sync_seq_len=SYNC_SEQ_LEN,
+                  text_seq_len=TEXT_SEQ_LEN).eval()
+    with torch.no_grad():
+        # the default initialization zeros the output layers
+        for p in net.parameters():
+            p.normal_(std=0.1)
+    return net
+
+
+@pytest.fixture
+def random_features() -> Callable[[int], tuple[torch.Tensor, torch.Tensor, torch.Tensor]]:
+    # makes clip, sync and text features of the tiny network for a batch size
+    def make(batch_size: int) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        return (torch.randn(batch_size, CLIP_SEQ_LEN, FEATURE_DIM),
+                torch.randn(batch_size, SYNC_SEQ_LEN, FEATURE_DIM),
+                torch.randn(batch_size, TEXT_SEQ_LEN, FEATURE_DIM))
+
+    return make
+
+
+@pytest.fixture
+def random_latent() -> Callable[[int], torch.Tensor]:
+    # makes latents of the tiny network for a batch size
+    def make(batch_size: int) -> torch.Tensor:
+        return torch.randn(batch_size, LATENT_SEQ_LEN, LATENT_DIM)
+
+    return make
+
+
+class TinyFeaturesUtils(nn.Module):
+    """
+    The interface of FeaturesUtils that the worker and generate use, without any checkpoint:
+    text and video features are random (deterministic per prompt) and the latents are decoded
+    by a random linear layer into TINY_SEQ_CFG's audio samples
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.text_cache = None
+        self.decode_chunk_size = None
+        self.decode_overlap = 8
+        self.vocode_chunk_size = None
+        self.vocode_overlap = 16
+        self.decoder = nn.Linear(
+            LATENT_DIM, TINY_SEQ_CFG.spectrogram_frame_rate * TINY_SEQ_CFG.latent_downsample_rate)
+
+    @property
+    def device(self) -> torch.device:
+        return self.decoder.weight.device
+
+    @property
+    def dtype(self) -> torch.dtype:
+        return self.decoder.weight.dtype
+
+    def encode_text(self, text: list[str]) -> torch.Tensor:
+        features = [
+            torch.randn(TEXT_SEQ_LEN,
+                        FEATURE_DIM,
+                        generator=torch.Generator().manual_seed(zlib.crc32(t.encode())))
+            for t in text
+        ]
+        return torch.stack(features).to(self.device, self.dtype)
+
+    def encode_video_with_clip(self, x: torch.Tensor, batch_size: int = -1) -> torch.Tensor:
+        # x: (B, T, C, H, W) -> (B, T, D)
+        return torch.randn(*x.shape[:2], FEATURE_DIM).to(self.device, self.dtype)
+
+    def encode_video_with_sync(self, x: torch.Tensor, batch_size: int = -1) -> torch.Tensor:
+        # x: (B, T, C, H, W) -> (B, 8 per segment, D)
+        cfg = TINY_SEQ_CFG
+        num_segments = (x.shape[1] - cfg.sync_num_frames_per_segment) // cfg.sync_step_size + 1
+        return torch.randn(x.shape[0], num_segments * 8, FEATURE_DIM).to(self.device, self.dtype)
+
+    @torch.inference_mode()
+    def decode(self, z: torch.Tensor) -> torch.Tensor:
+        # (B, N, latent_dim) -> (B, N, samples per latent)
+        return self.decoder(z)
+
+    @torch.inference_mode()
+    def vocode(self, spec: torch.Tensor) -> torch.Tensor:
+        return spec.flatten(1)
+
+
+@pytest.fixture
+def tiny_features() -> TinyFeaturesUtils:
+    torch.manual_seed(1)
+    return TinyFeaturesUtils().eval()
+
+
+@pytest.fixture
+def tiny_worker(tiny_net: MMAudio, tiny_features: TinyFeaturesUtils) -> Iterator[InferenceWorker]:
+    # serves 1 and 2 second requests with the tiny network on the CPU
+    worker = InferenceWorker(tiny_net,
+                             tiny_features,
+                             TINY_SEQ_CFG,
+                             max_batch_size=4,
+                             max_batch_wait=0.05,
+                             bucket_durations=(1.0, 2.0))
+    yield worker
+    worker.stop()
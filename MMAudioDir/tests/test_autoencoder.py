@@ -0,0 +1,81 @@
+import pytest
+import torch
+import torch.nn as nn
+
+from mmaudio.ext.autoencoder.autoencoder import AutoEncoderModule, overlap_add
+
+# (length, chunk_size, overlap): a partial last chunk, chunks that end exactly at the end,
+# no overlap, and sequences that fit in one chunk
+CHUNKINGS = [(101, 10, 3), (101, 40, 8), (88, 16, 4), (101, 10, 0), (101, 101, 8), (50, 200, 8)]
+
+
+def _upsample(x: torch.Tensor) -> torch.Tensor:
+    return x.repeat_interleave(3, dim=-1)
+
+
+@pytest.mark.parametrize('length, chunk_size, overlap', CHUNKINGS)
+def test_ramp_weights_sum_to_one(length: int, chunk_size: int, overlap: int):
+    # every output frame is the weighted sum of ones, once per chunk that covers it
+    x = torch.zeros(2, 4, length)
+    output = overlap_add(lambda x: _upsample(torch.ones_like(x)), x, chunk_size, overlap)
+    torch.testing.assert_close(output, torch.ones(2, 4, length * 3))
+
+
+@pytest.mark.parametrize('length, chunk_size, overlap', CHUNKINGS)
+def test_pointwise_fn_is_reproduced(length: int, chunk_size: int, overlap: int):
+    # the chunks cover the whole range, so a pointwise fn gives the one-shot output
+    x = torch.randn(2, 4, length)
+    fn = lambda x: _upsample(x) * 2
+    torch.testing.assert_close(overlap_add(fn, x, chunk_size, overlap), fn(x))
+
+
+def test_overlap_must_be_smaller_than_the_chunk():
+    with pytest.raises(AssertionError):
+        overlap_add(_upsample, torch.randn(1, 1, 10), 4, 4)
+
+
+class RandomVAE(nn.Module):
+
+    def __init__(self):
+        super().__init__()
+        self.conv = nn.Conv1d(8, 16, kernel_size=3, padding=1)
+
+    def decode(self, z: torch.Tensor) -> torch.Tensor:
+        return self.conv(z)
+
+
+@pytest.fixture
+def autoencoder() -> AutoEncoderModule:
+    # the checkpoints are replaced with small random modules that have a local receptive field
+    torch.manual_seed(0)
+    autoencoder = AutoEncoderModule.__new__(AutoEncoderModule)
+    nn.Module.__init__(autoencoder)
+    autoencoder.vae = RandomVAE().eval()
+    autoencoder.vocoder = nn.Sequential(nn.Conv1d(16, 1, kernel_size=3, padding=1),
+                                        nn.Upsample(scale_factor=4)).eval()
+    return autoencoder
+
+
+def _relative_error(x: torch.Tensor, reference: torch.Tensor) -> float:
+    return ((x - reference).norm() / reference.norm()).item()
+
+
+@pytest.mark.parametrize('chunk_size, overlap', [(32, 16), (40, 16)])
+def test_chunked_decode_is_close_to_one_shot(autoencoder: AutoEncoderModule, chunk_size: int,
+                                             overlap: int):
+    z = torch.randn(2, 8, 100)
+    reference = autoencoder.decode(z)
+    chunked = autoencoder.decode(z, chunk_size=chunk_size, overlap=overlap)
+    assert chunked.shape == reference.shape
+    # only the frames next to the chunk edges see the zero padding, and they are faded out
+    assert _relative_error(chunked, reference) < 0.02
+
+
+@pytest.mark.parametrize('chunk_size, overlap', [(32, 16), (40, 16)])
+def test_chunked_vocode_is_close_to_one_shot(autoencoder: AutoEncoderModule, chunk_size: int,
+                                             overlap: int):
+    spec = torch.randn(2, 16, 100)
+    reference = autoencoder.vocode(spec)
+    chunked = autoencoder.vocode(spec, chunk_size=chunk_size, overlap=overlap)
+    assert chunked.shape == reference.shape == (2, 1, 400)
+    assert _relative_error(chunked, reference) < 0.02
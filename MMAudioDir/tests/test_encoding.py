@@ -0,0 +1,72 @@
+import io
+import wave
+
+import av
+import numpy as np
+import pytest
+import torch
+
+from mmaudio.serving.encoding import encode_audio, get_audio_format, iter_encoded_audio
+
+SAMPLING_RATE = 16000
+
+
+@pytest.fixture
+def audio() -> torch.Tensor:
+    # 1.3 s of a sine, so that the last chunk is partial
+    t = torch.arange(int(1.3 * SAMPLING_RATE)) / SAMPLING_RATE
+    return (0.5 * torch.sin(2 * torch.pi * 440 * t)).unsqueeze(0)
+
+
+def _decode(data: bytes) -> np.ndarray:
+    # the mono samples in [-1, 1]
+    with av.open(io.BytesIO(data)) as container:
+        frames = [frame.to_ndarray() for frame in container.decode(audio=0)]
+    samples = np.concatenate(frames, axis=-1).reshape(-1)
+    if samples.dtype.kind == 'i':
+        # 24-bit samples are decoded into the high bits of int32
+        samples = samples / float(np.iinfo(samples.dtype).max + 1)
+    return samples.astype(np.float32)
+
+
+def test_wav(audio: torch.Tensor):
+    data = encode_audio(audio, SAMPLING_RATE, 'wav', 16)
+    with wave.open(io.BytesIO(data)) as f:
+        assert f.getframerate() == SAMPLING_RATE
+        assert f.getnchannels() == 1
+        assert f.getnframes() == audio.shape[-1]
+        samples = np.frombuffer(f.readframes(f.getnframes()), dtype='<i2') / 32767
+    np.testing.assert_allclose(samples, audio[0].numpy(), atol=1e-4)
+    # the streamed chunks make up the same file
+    assert b''.join(iter_encoded_audio(audio, SAMPLING_RATE, 'wav', 16, chunk_sec=0.5)) == data
+
+
+@pytest.mark.parametrize('bit_depth', [16, 24])
+def test_flac_is_lossless(audio: torch.Tensor, bit_depth: int):
+    data = encode_audio(audio, SAMPLING_RATE, 'flac', bit_depth)
+    decoded = _decode(data)
+    assert decoded.shape == (audio.shape[-1], )
+    # up to the quantization to bit_depth
+    np.testing.assert_allclose(decoded, audio[0].numpy(), atol=2.0**(2 - bit_depth))
+
+
+def test_flac_header_has_the_number_of_samples(audio: torch.Tensor):
+    data = encode_audio(audio, SAMPLING_RATE, 'flac', 16)
+    assert data[:4] == b'fLaC'
+    # STREAMINFO follows the 4-byte block header; the total number of samples is the low 36 bits
+    # of its bytes 10 to 17
+    streaminfo = data[8:42]
+    assert int.from_bytes(streaminfo[10:18], 'big') & ((1 << 36) - 1) == audio.shape[-1]
+
+
+def test_streamed_flac_decodes_to_the_same_audio(audio: torch.Tensor):
+    chunks = list(iter_encoded_audio(audio, SAMPLING_RATE, 'flac', 16, chunk_sec=0.25))
+    assert len(chunks) > 1
+    np.testing.assert_array_equal(_decode(b''.join(chunks)),
+                                  _decode(encode_audio(audio, SAMPLING_RATE, 'flac', 16)))
+
+
+@pytest.mark.parametrize('format, bit_depth', [('mp3', 16), ('opus', 24), ('wav', 8)])
+def test_invalid_formats(format: str, bit_depth: int):
+    with pytest.raises(ValueError):
+        get_audio_format(format, bit_depth)
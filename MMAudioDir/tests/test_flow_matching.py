@@ -0,0 +1,72 @@
+import math
+
+import pytest
+import torch
+
+from mmaudio.model.flow_matching import (SCHEDULES, SOLVERS, FlowMatching, get_num_function_evals,
+                                         get_num_steps)
+
+
+@pytest.fixture
+def x0() -> torch.Tensor:
+    return torch.randn(2, 16, 4, dtype=torch.float64, generator=torch.Generator().manual_seed(0))
+
+
+@pytest.mark.parametrize('schedule', SCHEDULES)
+def test_timesteps(schedule: str):
+    fm = FlowMatching(num_steps=10, schedule=schedule)
+    steps = fm.get_timesteps(0, 1)
+    assert steps[0] == 0 and steps[-1] == 1
+    assert (steps.diff() > 0).all()
+    torch.testing.assert_close(fm.get_timesteps(1, 0), steps.flip(0))
+
+
+@pytest.mark.parametrize('schedule', SCHEDULES)
+@pytest.mark.parametrize('mode', SOLVERS)
+def test_linear_flow_is_exact(x0: torch.Tensor, mode: str, schedule: str):
+    # every solver integrates a constant velocity exactly
+    target = torch.randn_like(x0)
+    fm = FlowMatching(inference_mode=mode, num_steps=10, schedule=schedule)
+    torch.testing.assert_close(fm.to_data(lambda t, x: target - x0, x0), target)
+
+
+def test_second_order_solvers_are_more_accurate(x0: torch.Tensor):
+    # dx/dt = -2tx, x(1) = x(0) / e, at 8 function evaluations
+    errors = {}
+    for mode in SOLVERS:
+        fm = FlowMatching(inference_mode=mode, num_steps=get_num_steps(mode, 8))
+        assert fm.num_function_evals == 8
+        x1 = fm.to_data(lambda t, x: -2 * t * x, x0)
+        errors[mode] = (x1 - x0 / math.e).abs().max().item()
+    assert errors['heun'] < errors['euler']
+    assert errors['midpoint'] < errors['euler']
+    assert errors['dpm_multistep'] < errors['euler']
+
+
+@pytest.mark.parametrize('mode', SOLVERS)
+def test_num_function_evals(x0: torch.Tensor, mode: str):
+    num_evals = 0
+
+    def fn(t: torch.Tensor, x: torch.Tensor) -> torch.Tensor:
+        nonlocal num_evals
+        num_evals += 1
+        return -x
+
+    fm = FlowMatching(inference_mode=mode, num_steps=6)
+    fm.to_data(fn, x0)
+    assert num_evals == fm.num_function_evals
+
+
+@pytest.mark.parametrize('num_steps', [1, 2, 5, 25])
+def test_heun_reuses_the_end_point_evaluation(x0: torch.Tensor, num_steps: int):
+    times = []
+
+    def fn(t: torch.Tensor, x: torch.Tensor) -> torch.Tensor:
+        times.append(t.item())
+        return -x
+
+    FlowMatching(inference_mode='heun', num_steps=num_steps).to_data(fn, x0)
+    # one evaluation per step, plus the one at the start
+    assert len(times) == get_num_function_evals('heun', num_steps) == num_steps + 1
+    # the end of every step is evaluated once
+    assert len(set(times)) == len(times)
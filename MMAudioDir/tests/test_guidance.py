@@ -0,0 +1,29 @@
+import pytest
+import torch
+
+from mmaudio.model.guidance import CFG_SCHEDULES, GuidanceSchedule
+
+
+@pytest.mark.parametrize('schedule', CFG_SCHEDULES)
+def test_mean_strength_matches_cfg_strength(schedule: str):
+    guidance = GuidanceSchedule(4.5, schedule=schedule)
+    strengths = torch.tensor([guidance.get_strength(t) for t in torch.linspace(0, 1, 1001)])
+    assert abs(strengths.mean().item() - 4.5) < 1e-2
+
+
+def test_interval():
+    guidance = GuidanceSchedule(4.5, interval=(0.0, 0.5))
+    assert guidance.get_strength(0.7) is None
+    assert guidance.get_strength(0.5) == 4.5
+    # 13 of the 25 euler steps are guided
+    assert guidance.count_network_evals(torch.linspace(0, 1, 26)[:-1]) == 25 + 13
+
+
+def test_no_guidance_below_one():
+    assert GuidanceSchedule(0.5).get_strength(0.3) is None
+
+
+@pytest.mark.parametrize('interval', [(0.5, 0.2), (-0.1, 1.0), (0.0, 1.5)])
+def test_invalid_interval(interval: tuple[float, float]):
+    with pytest.raises(ValueError):
+        GuidanceSchedule(4.5, interval=interval)
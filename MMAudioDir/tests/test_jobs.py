@@ -0,0 +1,95 @@
+import time
+
+from mmaudio.serving.jobs import Job, JobQueue, JobRegistry
+from mmaudio.serving.worker import InferenceRequest
+
+
+def _job(priority: int = 0, **request_kwargs) -> Job:
+    return Job(request=InferenceRequest(**request_kwargs), priority=priority)
+
+
+def _duration_key(job: Job) -> float:
+    return job.request.duration
+
+
+def test_priority_order():
+    queue = JobQueue()
+    jobs = [_job(priority) for priority in (0, 5, 1, 5)]
+    for job in jobs:
+        queue.put(job)
+
+    # higher priority first, ties in submission order
+    assert [queue.get(timeout=0) for _ in jobs] == [jobs[1], jobs[3], jobs[2], jobs[0]]
+    assert queue.get(timeout=0) is None
+
+
+def test_get_batch_takes_jobs_with_the_same_key():
+    queue = JobQueue()
+    jobs = [_job(duration=8.0), _job(duration=4.0), _job(duration=8.0), _job(duration=4.0)]
+    for job in jobs:
+        queue.put(job)
+
+    assert queue.get_batch(8, 0.0, key=_duration_key) == [jobs[0], jobs[2]]
+    # the jobs with another key stay queued in their order
+    assert queue.get_batch(8, 0.0, key=_duration_key) == [jobs[1], jobs[3]]
+    assert len(queue) == 0
+
+
+def test_get_batch_is_bounded_by_the_total_number_of_samples():
+    queue = JobQueue()
+    jobs = [_job(num_samples=2) for _ in range(3)]
+    for job in jobs:
+        queue.put(job)
+
+    assert queue.get_batch(4, 0.0, key=_duration_key) == jobs[:2]
+    assert queue.get_batch(4, 0.0, key=_duration_key) == jobs[2:]
+
+
+def test_get_batch_returns_when_closed():
+    queue = JobQueue()
+    queue.close()
+    start = time.monotonic()
+    assert queue.get_batch(4, 10.0, key=_duration_key) == []
+    assert time.monotonic() - start < 1.0
+
+
+def test_registry_evicts_the_oldest_finished_jobs():
+    registry = JobRegistry(max_finished_jobs=2)
+    queued = _job()
+    registry.add(queued)
+    finished = []
+    for _ in range(3):
+        job = _job()
+        registry.add(job)
+        assert job.set_running()
+        job.set_result(None)
+        finished.append(job)
+
+    cancelled = _job()
+    registry.add(cancelled)
+    assert cancelled.cancel()
+    assert cancelled.status == 'cancelled' and cancelled.done
+
+    # adding a job evicts the finished jobs beyond the limit, oldest first
+    registry.add(_job())
+    assert registry.get(queued.id) is queued
+    assert registry.get(finished[0].id) is None
+    assert registry.get(finished[1].id) is None
+    assert registry.get(finished[2].id) is finished[2]
+    assert registry.get(cancelled.id) is cancelled
+
+
+def test_running_jobs_cannot_be_cancelled():
+    job = _job()
+    assert job.set_running()
+    assert not job.cancel()
+    assert job.status == 'running'
+
+
+def test_a_job_whose_future_was_cancelled_is_marked_cancelled():
+    job = _job()
+    assert job.future.cancel()
+    # the worker finds out when it tries to run the job
+    assert not job.set_running()
+    assert job.status == 'cancelled' and job.done
+    assert job.finished_at is not None
@@ -0,0 +1,80 @@
+import pytest
+import torch
+
+from mmaudio.model.networks import MMAudio
+from mmaudio.model.step_cache import StepCache
+
+BATCH_SIZE = 3
+CFG_STRENGTH = 4.5
+
+
+@torch.inference_mode()
+def test_batched_cfg_matches_two_passes(tiny_net: MMAudio, random_features, random_latent):
+    conditions = tiny_net.preprocess_conditions(*random_features(BATCH_SIZE))
+    empty_conditions = tiny_net.get_empty_conditions(BATCH_SIZE)
+    latent = random_latent(BATCH_SIZE)
+    t = torch.tensor(0.3)
+
+    two_pass = tiny_net.ode_wrapper(t, latent, conditions, empty_conditions, CFG_STRENGTH)
+    one_pass = tiny_net.batched_cfg_ode_wrapper(
+        t, latent, tiny_net.concat_conditions(conditions, empty_conditions), CFG_STRENGTH)
+    torch.testing.assert_close(one_pass, two_pass, atol=1e-5, rtol=0)
+
+
+@torch.inference_mode()
+def test_expanded_conditions_match_repeated_samples(tiny_net: MMAudio,
+                                                    random_features,
+                                                    random_latent):
+    num_samples = 2
+    clip_f, sync_f, text_f = random_features(BATCH_SIZE)
+    expanded = tiny_net.expand_conditions(tiny_net.preprocess_conditions(clip_f, sync_f, text_f),
+                                          num_samples)
+    repeated = tiny_net.preprocess_conditions(clip_f.repeat_interleave(num_samples, 0),
+                                              sync_f.repeat_interleave(num_samples, 0),
+                                              text_f.repeat_interleave(num_samples, 0))
+    latent = random_latent(BATCH_SIZE * num_samples)
+    t = torch.full((BATCH_SIZE * num_samples, ), 0.3)
+
+    torch.testing.assert_close(tiny_net.predict_flow(latent, t, expanded),
+                               tiny_net.predict_flow(latent, t, repeated),
+                               atol=1e-5,
+                               rtol=0)
+
+
+@torch.inference_mode()
+def test_precomputed_steps_match_per_step_conditioning(tiny_net: MMAudio,
+                                                       random_features,
+                                                       random_latent):
+    conditions = tiny_net.preprocess_conditions(*random_features(BATCH_SIZE))
+    empty_conditions = tiny_net.get_empty_conditions(BATCH_SIZE)
+    timesteps = torch.linspace(0, 1, 5)
+    precomputed = tiny_net.precompute_steps(conditions, timesteps)
+    empty_precomputed = tiny_net.precompute_steps(empty_conditions, timesteps)
+    latent = random_latent(BATCH_SIZE)
+
+    for t in timesteps[:-1]:
+        assert tiny_net._find_step(t, precomputed) is not None
+        reference = tiny_net.ode_wrapper(t, latent, conditions, empty_conditions, CFG_STRENGTH)
+        flow = tiny_net.ode_wrapper(t, latent, precomputed, empty_precomputed, CFG_STRENGTH)
+        torch.testing.assert_close(flow, reference, atol=1e-5, rtol=0)
+
+
+@pytest.mark.parametrize('threshold', [0.0, 1e9])
+@torch.inference_mode()
+def test_step_cache(tiny_net: MMAudio, random_features, random_latent, threshold: float):
+    # never skips with a threshold of 0, and reuses the fused blocks after the first step otherwise
+    conditions = tiny_net.preprocess_conditions(*random_features(BATCH_SIZE))
+    step_cache = StepCache(threshold)
+    cached_conditions = step_cache.attach(conditions)
+    latent = random_latent(BATCH_SIZE)
+    timesteps = torch.linspace(0, 1, 5)[:-1]
+
+    for t in timesteps:
+        t = t.expand(BATCH_SIZE)
+        reference = tiny_net.predict_flow(latent, t, conditions)
+        flow = tiny_net.predict_flow(latent, t, cached_conditions)
+        if threshold == 0:
+            torch.testing.assert_close(flow, reference, atol=1e-5, rtol=0)
+
+    assert step_cache.num_evals == len(timesteps)
+    assert step_cache.num_skipped == (0 if threshold == 0 else len(timesteps) - 1)
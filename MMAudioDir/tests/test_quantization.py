@@ -0,0 +1,22 @@
+import copy
+
+import torch
+
+from mmaudio.model.networks import MMAudio
+from mmaudio.model.quantization import WeightOnlyInt8Conv1d, quantize_int8
+
+
+@torch.inference_mode()
+def test_int8_flow_is_close_to_float32(tiny_net: MMAudio, random_features, random_latent):
+    quantized = quantize_int8(copy.deepcopy(tiny_net))
+    assert any(isinstance(module, WeightOnlyInt8Conv1d) for module in quantized.modules())
+
+    batch_size = 2
+    features = random_features(batch_size)
+    latent = random_latent(batch_size)
+    t = torch.full((batch_size, ), 0.3)
+    reference = tiny_net.predict_flow(latent, t, tiny_net.preprocess_conditions(*features))
+    flow = quantized.predict_flow(latent, t, quantized.preprocess_conditions(*features))
+
+    error = ((flow - reference).norm() / reference.norm()).item()
+    assert error < 0.05, error
@@ -0,0 +1,68 @@
+import asyncio
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+
+from mmaudio.serving.storage import LocalStorage, StorageError
+
+
+@pytest.fixture
+def storage(tmp_path: Path) -> Iterator[LocalStorage]:
+    storage = LocalStorage(tmp_path / 'storage', base_url='http://localhost:8000/files/')
+    yield storage
+    storage.close()
+
+
+def test_upload_bytes(storage: LocalStorage):
+    url = asyncio.run(storage.upload_bytes(b'audio', 'generated_audio/a.flac', 'audio/flac'))
+    assert url == 'http://localhost:8000/files/generated_audio/a.flac'
+    assert (storage.root / 'generated_audio' / 'a.flac').read_bytes() == b'audio'
+
+
+def test_upload_file(storage: LocalStorage, tmp_path: Path):
+    source = tmp_path / 'video.mp4'
+    source.write_bytes(b'video')
+    url = asyncio.run(storage.upload_file(source, 'videos/video.mp4'))
+    assert url.endswith('/videos/video.mp4')
+    assert (storage.root / 'videos' / 'video.mp4').read_bytes() == b'video'
+
+
+def test_file_urls_without_base_url(tmp_path: Path):
+    storage = LocalStorage(tmp_path / 'storage')
+    try:
+        url = asyncio.run(storage.upload_bytes(b'audio', 'a.flac'))
+    finally:
+        storage.close()
+    assert url == (storage.root / 'a.flac').as_uri()
+
+
+@pytest.mark.parametrize('key', ['../outside.flac', '/etc/outside.flac'])
+def test_keys_cannot_leave_the_root(storage: LocalStorage, key: str):
+    with pytest.raises(StorageError):
+        asyncio.run(storage.upload_bytes(b'audio', key))
+
+
+def test_records(storage: LocalStorage):
+
+    async def create_and_update() -> str:
+        record_id = await storage.insert_record('generations', {
+            'prompt': 'rain',
+            'status': 'queued'
+        })
+        await storage.update_record('generations', record_id, {'status': 'completed'})
+        return record_id
+
+    record_id = asyncio.run(create_and_update())
+    assert storage.get_record('generations', record_id) == {
+        'prompt': 'rain',
+        'status': 'completed'
+    }
+    assert storage.get_record('generations', 'missing') is None
+
+
+def test_invalid_records(storage: LocalStorage):
+    with pytest.raises(StorageError):
+        asyncio.run(storage.update_record('generations', 'missing', {'status': 'failed'}))
+    with pytest.raises(StorageError):
+        asyncio.run(storage.insert_record('generations; DROP TABLE x', {}))
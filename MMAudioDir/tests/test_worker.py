@@ -0,0 +1,111 @@
+from pathlib import Path
+
+import pytest
+import torch
+
+from mmaudio.data.feature_store import VideoFeatures, VideoFeatureStore, hash_file
+from mmaudio.serving.worker import InferenceRequest, InferenceWorker
+
+TIMEOUT = 120
+
+
+def _num_audio_frames(worker: InferenceWorker, duration: float) -> int:
+    return worker.buckets.select(duration).get_seq_cfg(duration).num_audio_frames
+
+
+def test_run_batch(tiny_worker: InferenceWorker):
+    requests = [
+        InferenceRequest(prompt='rain', duration=2.0, num_steps=2),
+        InferenceRequest(prompt='a dog barking', duration=1.5, num_steps=2, seed=1),
+    ]
+    results = tiny_worker.run_batch(requests)
+
+    assert len(results) == 2
+    for request, result in zip(requests, results):
+        assert result.duration_sec == request.duration
+        assert result.sampling_rate == tiny_worker.seq_cfg.sampling_rate
+        assert result.audio.shape == (1, _num_audio_frames(tiny_worker, request.duration))
+        assert result.audio.dtype == torch.float32
+        assert torch.isfinite(result.audio).all()
+
+
+def test_batched_result_does_not_depend_on_the_batch(tiny_worker: InferenceWorker):
+    request = InferenceRequest(prompt='rain', duration=2.0, num_steps=2, seed=3)
+    other = InferenceRequest(prompt='ocean waves', duration=2.0, num_steps=2, seed=4)
+    alone = tiny_worker.run(request).audio
+    batched = tiny_worker.run_batch([other, request])[1].audio
+    torch.testing.assert_close(batched, alone, atol=1e-4, rtol=1e-4)
+
+
+def test_num_samples(tiny_worker: InferenceWorker):
+    request = InferenceRequest(prompt='rain', duration=1.0, num_steps=2, num_samples=3)
+    audio = tiny_worker.run(request).audio
+    assert audio.shape == (3, _num_audio_frames(tiny_worker, 1.0))
+    # the variations are sampled from different noise
+    assert not torch.allclose(audio[0], audio[1])
+
+
+def test_submit(tiny_worker: InferenceWorker):
+    tiny_worker.start()
+    progress = []
+    jobs = [
+        tiny_worker.submit(InferenceRequest(prompt=prompt, duration=1.0, num_steps=2))
+        for prompt in ('rain', 'wind', 'thunder')
+    ]
+    for job in jobs:
+        result = job.future.result(timeout=TIMEOUT)
+        progress.append(job.progress)
+        assert job.status == 'completed'
+        assert job.result is result
+        assert tiny_worker.jobs.get(job.id) is job
+    assert progress == [2, 2, 2]
+
+
+@pytest.mark.parametrize('request_kwargs', [
+    {'duration': 3.0},
+    {'duration': 0.0},
+    {'start_sec': -1.0},
+    {'num_steps': 0},
+    {'cfg_strength': -1.0},
+    {'cfg_strength': float('nan')},
+    {'num_samples': 0},
+    {'num_samples': 5},
+    {'sampler': 'rk4'},
+    {'schedule': 'exponential'},
+    {'cache_threshold': -0.1},
+    {'cfg_interval': (0.8, 0.2)},
+    {'cfg_schedule': 'step'},
+])
+def test_submit_rejects_invalid_requests(tiny_worker: InferenceWorker, request_kwargs: dict):
+    with pytest.raises(ValueError):
+        tiny_worker.submit(InferenceRequest(prompt='rain', **request_kwargs))
+    assert len(tiny_worker.queue) == 0
+
+
+def test_failed_preparation_fails_only_its_job(tiny_worker: InferenceWorker, tmp_path: Path):
+    # the features of the healthy video are cached, so that it is not decoded
+    tiny_worker.feature_store = VideoFeatureStore(tmp_path / 'features', 'test')
+    video_path = tmp_path / 'video.mp4'
+    video_path.write_bytes(b'not decoded')
+    cfg = tiny_worker.buckets.select(1.0).get_seq_cfg(1.0)
+    tiny_worker.feature_store.put(
+        hash_file(video_path), 1.0, 0.0,
+        VideoFeatures(clip_features=torch.randn(1, cfg.clip_seq_len, 16),
+                      sync_features=torch.randn(1, cfg.sync_seq_len, 16),
+                      duration_sec=1.0))
+
+    # both jobs are queued before the worker starts, so that they are batched together
+    healthy = tiny_worker.submit(
+        InferenceRequest(prompt='rain', video_path=video_path, duration=1.0, num_steps=2))
+    broken = tiny_worker.submit(
+        InferenceRequest(prompt='rain',
+                         video_path=tmp_path / 'missing.mp4',
+                         duration=1.0,
+                         num_steps=2))
+    tiny_worker.start()
+
+    healthy.future.result(timeout=TIMEOUT)
+    with pytest.raises(FileNotFoundError):
+        broken.future.result(timeout=TIMEOUT)
+    assert healthy.status == 'completed'
+    assert broken.status == 'failed'
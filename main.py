@@ -1,19 +1,101 @@
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import FileResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from supabase import create_client, Client
-import subprocess
+from contextlib import asynccontextmanager
+import asyncio
+import hashlib
 import os
 import sys
 import tempfile
+import threading
 import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import List
 import magic
 
+from mmaudio.model.utils.features_utils import CLIP_MODEL_NAME
+from mmaudio.model.utils.text_cache import TextFeatureCache
+from mmaudio.serving.encoding import encode_audio, get_audio_format, iter_encoded_audio
+from mmaudio.serving.jobs import Job, QueueFullError
+from mmaudio.serving.storage import LocalStorage, StorageBackend, StorageError, SupabaseStorage
+from mmaudio.serving.worker import InferenceRequest, InferenceWorker
+
 print(sys.path)
 print(sys.executable)
 
-app = FastAPI()
+MMAUDIO_VARIANT = os.environ.get("MMAUDIO_VARIANT", "large_44k_v2")
+MMAUDIO_FULL_PRECISION = os.environ.get("MMAUDIO_FULL_PRECISION", "0") == "1"
+# int8 network for CPU-only deployments
+MMAUDIO_QUANTIZE = os.environ.get("MMAUDIO_QUANTIZE", "0") == "1"
+MAX_QUEUE_SIZE = int(os.environ.get("MMAUDIO_MAX_QUEUE_SIZE", "64"))
+MAX_BATCH_SIZE = int(os.environ.get("MMAUDIO_MAX_BATCH_SIZE", "8"))
+MAX_BATCH_WAIT_MS = float(os.environ.get("MMAUDIO_MAX_BATCH_WAIT_MS", "20"))
+TEXT_CACHE_ENTRIES = int(os.environ.get("MMAUDIO_TEXT_CACHE_ENTRIES", "4096"))
+TEXT_CACHE_BYTES = int(os.environ.get("MMAUDIO_TEXT_CACHE_BYTES", str(1 << 30)))
+TEXT_CACHE_DIR = os.environ.get("MMAUDIO_TEXT_CACHE_DIR")  # optional on-disk tier
+FEATURE_STORE_DIR = os.environ.get("MMAUDIO_FEATURE_STORE_DIR")  # cached video features
+# decode/vocode in chunks of this many seconds to bound their memory; unset decodes in one pass
+DECODE_CHUNK_SEC = float(os.environ["MMAUDIO_DECODE_CHUNK_SEC"]) if "MMAUDIO_DECODE_CHUNK_SEC" in os.environ else None
+DURATION_BUCKETS = [float(d) for d in os.environ.get("MMAUDIO_DURATION_BUCKETS", "2,4,8,10,16").split(",")]
+# "supabase", or "local" for a local directory + SQLite database
+STORAGE_BACKEND = os.environ.get("MMAUDIO_STORAGE_BACKEND", "supabase")
+LOCAL_STORAGE_DIR = os.environ.get("MMAUDIO_LOCAL_STORAGE_DIR", "./storage")
+LOCAL_STORAGE_URL = os.environ.get("MMAUDIO_LOCAL_STORAGE_URL")  # where the directory is served, if at all
+STORAGE_MAX_WORKERS = int(os.environ.get("MMAUDIO_STORAGE_MAX_WORKERS", "8"))
+# encoding the generated audio runs on its own pool so that it overlaps with sampling the next job
+OUTPUT_MAX_WORKERS = int(os.environ.get("MMAUDIO_OUTPUT_MAX_WORKERS", "4"))
+
+SUPABASE_URL = os.environ.get("SUPABASE_URL")
+SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
+SUPABASE_BUCKET = os.environ.get("SUPABASE_BUCKET")
+
+GENERATIONS_TABLE = "user_generations"
+
+
+def create_storage() -> StorageBackend:
+    if STORAGE_BACKEND == "local":
+        return LocalStorage(LOCAL_STORAGE_DIR, base_url=LOCAL_STORAGE_URL, max_workers=STORAGE_MAX_WORKERS)
+    if STORAGE_BACKEND != "supabase":
+        raise ValueError(f"Unknown storage backend: {STORAGE_BACKEND}")
+    if not all([SUPABASE_URL, SUPABASE_KEY, SUPABASE_BUCKET]):
+        raise ValueError("Required environment variables are not set")
+    return SupabaseStorage(SUPABASE_URL, SUPABASE_KEY, SUPABASE_BUCKET, max_workers=STORAGE_MAX_WORKERS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.storage = create_storage()
+    app.state.output_executor = ThreadPoolExecutor(max_workers=OUTPUT_MAX_WORKERS, thread_name_prefix="output")
+
+    # Load the models once and keep them resident for the lifetime of the server
+    text_cache = TextFeatureCache(
+        CLIP_MODEL_NAME,
+        max_entries=TEXT_CACHE_ENTRIES,
+        max_bytes=TEXT_CACHE_BYTES,
+        disk_dir=TEXT_CACHE_DIR,
+    )
+    worker = InferenceWorker.from_pretrained(
+        MMAUDIO_VARIANT,
+        full_precision=MMAUDIO_FULL_PRECISION,
+        quantize=MMAUDIO_QUANTIZE,
+        text_cache=text_cache,
+        feature_store_dir=FEATURE_STORE_DIR,
+        decode_chunk_sec=DECODE_CHUNK_SEC,
+        max_queue_size=MAX_QUEUE_SIZE,
+        max_batch_size=MAX_BATCH_SIZE,
+        max_batch_wait=MAX_BATCH_WAIT_MS / 1000,
+        bucket_durations=DURATION_BUCKETS,
+    )
+    worker.start()
+    app.state.worker = worker
+    yield
+    worker.stop()
+    app.state.output_executor.shutdown(wait=True)
+    app.state.storage.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Explicit CORS configuration
 origins = [
@@ -37,172 +119,418 @@ app.add_middleware(
     ],
 )
 
-# Initialize Supabase client
-SUPABASE_URL = os.environ.get("SUPABASE_URL")
-SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
-SUPABASE_BUCKET = os.environ.get("SUPABASE_BUCKET")
-
-if not all([SUPABASE_URL, SUPABASE_KEY, SUPABASE_BUCKET]):
-    raise ValueError("Required environment variables are not set")
-
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-
 # Constants
 MAX_VIDEO_SIZE = 100 * 1024 * 1024  # 100MB
 ALLOWED_VIDEO_TYPES = ["video/mp4", "video/quicktime", "video/x-msvideo"]
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB
 
-def validate_video_file(file: UploadFile) -> None:
-    """Validate video file size and type."""
-    if file.size > MAX_VIDEO_SIZE:
-        raise HTTPException(
-            status_code=400,
-            detail=f"File size exceeds maximum limit of {MAX_VIDEO_SIZE/1024/1024}MB"
-        )
-    
-    # Read first 2048 bytes for file type detection
-    file_header = file.file.read(2048)
-    file.file.seek(0)  # Reset file pointer
-    mime_type = magic.from_buffer(file_header, mime=True)
-    
+def video_size_error() -> HTTPException:
+    return HTTPException(
+        status_code=400,
+        detail=f"File size exceeds maximum limit of {MAX_VIDEO_SIZE/1024/1024}MB"
+    )
+
+def validate_video_header(header: bytes) -> None:
+    """Validate the video type from the first bytes of the file."""
+    mime_type = magic.from_buffer(header[:2048], mime=True)
     if mime_type not in ALLOWED_VIDEO_TYPES:
         raise HTTPException(
             status_code=400,
             detail=f"Invalid file type. Allowed types: {', '.join(ALLOWED_VIDEO_TYPES)}"
         )
 
+def write_chunk(temp_file, sha256, chunk: bytes) -> None:
+    sha256.update(chunk)
+    temp_file.write(chunk)
+
+async def save_video_upload(file: UploadFile) -> tuple[str, str]:
+    """
+    Stream an uploaded video to a unique file in the temp directory, one chunk at a time.
+    The type is validated on the first chunk and the size while streaming.
+    Returns the path and the SHA-256 of the content, which keys the cached video features.
+    """
+    if file.size is not None and file.size > MAX_VIDEO_SIZE:
+        raise video_size_error()
+
+    temp_path = os.path.join(tempfile.gettempdir(), f"{uuid.uuid4()}_{os.path.basename(file.filename or 'video')}")
+    sha256 = hashlib.sha256()
+    num_bytes = 0
+    try:
+        with open(temp_path, "wb") as temp_file:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                if num_bytes == 0:
+                    validate_video_header(chunk)
+                num_bytes += len(chunk)
+                if num_bytes > MAX_VIDEO_SIZE:
+                    raise video_size_error()
+                await run_in_threadpool(write_chunk, temp_file, sha256, chunk)
+        if num_bytes == 0:
+            raise HTTPException(status_code=400, detail="The uploaded video is empty")
+    except BaseException:
+        remove_file(temp_path)
+        raise
+    return temp_path, sha256.hexdigest()
+
+def remove_file(path: str) -> None:
+    try:
+        if os.path.exists(path):
+            os.remove(path)
+    except Exception as e:
+        print(f"Error cleaning up temporary file {path}: {e}")
+
+def remove_file_when_done(path: str, *futures) -> None:
+    """
+    Remove a temporary file once every future that reads it (job or upload) is done.
+    Job futures complete on the worker thread, so the count is guarded by a lock.
+    """
+    lock = threading.Lock()
+    pending = len(futures)
+
+    def on_done(_) -> None:
+        nonlocal pending
+        with lock:
+            pending -= 1
+            last = pending == 0
+        if last:
+            remove_file(path)
+
+    for future in futures:
+        future.add_done_callback(on_done)
+
+def submit_job(request: InferenceRequest, priority: int = 0):
+    """Queue a request on the inference worker, rejecting it with 429 when the queue is full."""
+    try:
+        return app.state.worker.submit(request, priority=priority)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "10"})
+
+async def store_job_output(job: Job, sample: int = 0) -> str:
+    """
+    Encode a finished job's audio on the output pool and upload it under a key unique to the job.
+    Returns the URL of the stored audio, which is also recorded on the job.
+    """
+    loop = asyncio.get_running_loop()
+    result = job.result
+    data = await loop.run_in_executor(
+        app.state.output_executor, encode_audio, result.audio[sample:sample + 1], result.sampling_rate
+    )
+    suffix = f"_{sample}" if sample > 0 else ""
+    job.output_url = await app.state.storage.upload_bytes(
+        data, f"generated_audio/{job.id}{suffix}.flac", content_type="audio/flac"
+    )
+    return job.output_url
+
+def store_job_output_when_done(job: Job, loop: asyncio.AbstractEventLoop) -> None:
+    """Upload the audio of a background job as soon as it completes."""
+
+    async def store() -> None:
+        try:
+            await store_job_output(job)
+        except StorageError as e:
+            print(f"Error storing the output of job {job.id}: {e}")
+
+    def on_done(future: Future) -> None:
+        if not future.cancelled() and future.exception() is None:
+            asyncio.run_coroutine_threadsafe(store(), loop)
+
+    job.future.add_done_callback(on_done)
+
+async def upload_video_and_create_record(storage: StorageBackend, prompt: str, duration: int,
+                                        temp_video_path: str = None) -> tuple[str, str]:
+    """Upload the input video (if any) and create the metadata record; returns (video URL, record id)."""
+    video_url = None
+    if temp_video_path:
+        try:
+            video_url = await storage.upload_file(
+                temp_video_path, f"uploaded_videos/{os.path.basename(temp_video_path)}"
+            )
+        except StorageError:
+            raise HTTPException(status_code=500, detail="Error uploading video to storage")
+
+    try:
+        record_id = await storage.insert_record(
+            GENERATIONS_TABLE,
+            {"prompt": prompt, "duration": duration, "video_url": video_url, "status": "processing"},
+        )
+    except StorageError as e:
+        raise HTTPException(status_code=500, detail=f"Error creating database record: {e}")
+    return video_url, record_id
+
 @app.post("/generate_sfx")
 async def generate_sfx(
     prompt: str = Form(...),
     duration: int = Form(8),
     video: UploadFile = File(None)
 ):
-    temp_files = []  # Track temporary files for cleanup
-    supabase_video_url = None
-    supabase_audio_url = None
+    storage: StorageBackend = app.state.storage
+    video_url = None
+    audio_url = None
     database_record_id = None
+    job = None
 
+    temp_video_path = video_hash = None
     try:
-        # Validate video if provided
         if video:
-            validate_video_file(video)
+            # Stream the upload to disk once; the same file is uploaded to storage and decoded locally
+            temp_video_path, video_hash = await save_video_upload(video)
 
-        # 1. Upload Video to Supabase (if provided)
-        if video:
-            video_filename = f"{uuid.uuid4()}_{video.filename}"
-            temp_video_path = os.path.join(tempfile.gettempdir(), video_filename)
-            temp_files.append(temp_video_path)
-            
-            # Save uploaded file temporarily
-            with open(temp_video_path, "wb") as temp_file:
-                content = await video.read()
-                temp_file.write(content)
+        # 1. Queue the request on the resident inference worker first so that sampling
+        # overlaps with the storage upload and the database write
+        inference_request = InferenceRequest(
+            prompt=prompt,
+            duration=duration,
+            video_path=temp_video_path,
+            video_hash=video_hash,
+        )
+        try:
+            job = submit_job(inference_request)
+        except HTTPException:
+            if temp_video_path:
+                remove_file(temp_video_path)
+            raise
 
-            try:
-                with open(temp_video_path, "rb") as video_file:
-                    response = supabase.storage.from_(SUPABASE_BUCKET).upload(
-                        f"uploaded_videos/{video_filename}",
-                        video_file
-                    )
-                    supabase_video_url = supabase.storage.from_(SUPABASE_BUCKET).get_public_url(
-                        f"uploaded_videos/{video_filename}"
-                    )
-            except Exception as e:
-                raise HTTPException(
-                    status_code=500,
-                    detail="Error uploading video to storage"
-                )
+        # 2. Upload the video and create the metadata record while the job runs
+        upload = asyncio.ensure_future(
+            upload_video_and_create_record(storage, prompt, duration, temp_video_path)
+        )
+        if temp_video_path:
+            # both the worker and the upload read the video, so it is removed once both are done
+            remove_file_when_done(temp_video_path, job.future, upload)
+        # shielded so that a disconnecting client does not abandon the upload halfway through
+        video_url, database_record_id = await asyncio.shield(upload)
+
+        # 3. Wait for the generated audio; shielded so that the job is only cancelled through
+        # job.cancel() below
+        await asyncio.shield(asyncio.wrap_future(job.future))
 
-        # 2. Create Metadata Record in Supabase
+        # 4. Encode the audio in memory and upload it to storage under the job's own key;
+        # the worker is already sampling the next job meanwhile
         try:
-            video_db_data = {"prompt": prompt, "duration": duration, "video_url": supabase_video_url, "status": "processing"}
-            response = supabase.table("user_generations").insert(video_db_data).execute()
-            if response.error:
-                raise HTTPException(status_code=500, detail=f"Error creating database record: {response.error.message}")
-            database_record_id = response.data[0]['id']
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error creating database record: {e}")
-
-        # 3. Execute MMAudio demo.py
-        cmd = [
-            sys.executable,
-            "./MMAudioDir/demo.py",
-            f"--duration={duration}",
-            f"--prompt={prompt}"
-        ]
-        if supabase_video_url:
-            cmd.append(f"--video={supabase_video_url}")
-
-        process = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        print("MMAudio script output:", process.stdout)
-        if process.stderr:
-            print("MMAudio script errors:", process.stderr)
-
-        # 4. Upload Generated Audio to Supabase
-        output_audio_path = "./MMAudioDir/output/audio.flac"  # Assuming default output path
-        if os.path.exists(output_audio_path):
-            audio_filename = f"{uuid.uuid4()}_audio.flac"
-            try:
-                with open(output_audio_path, "rb") as audio_file:
-                    response = supabase.storage.from_(SUPABASE_BUCKET).upload(
-                        f"generated_audio/{audio_filename}", audio_file
-                    )
-                if response.status_code == 200:
-                    supabase_audio_url = supabase.storage.from_(SUPABASE_BUCKET).get_public_url(f"generated_audio/{audio_filename}")
-                else:
-                    raise HTTPException(status_code=500, detail=f"Error uploading audio to Supabase: {response.text}")
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=f"Error uploading audio to Supabase: {e}")
-        else:
-            raise HTTPException(status_code=500, detail="Generated audio file not found.")
+            audio_url = await store_job_output(job)
+        except StorageError as e:
+            raise HTTPException(status_code=500, detail=f"Error uploading audio to storage: {e}")
 
         # 5. Update Metadata Record with Audio URL
         try:
-            response = supabase.table("user_generations").update({"audio_url": supabase_audio_url, "status": "completed"}).eq("id", database_record_id).execute()
-            if response.error:
-                raise HTTPException(status_code=500, detail=f"Error updating database record with audio URL: {response.error.message}")
-        except Exception as e:
+            await storage.update_record(
+                GENERATIONS_TABLE, database_record_id, {"audio_url": audio_url, "status": "completed"}
+            )
+        except StorageError as e:
             raise HTTPException(status_code=500, detail=f"Error updating database record with audio URL: {e}")
 
-        return {"status": "done", "audio_url": supabase_audio_url, "video_url": supabase_video_url, "database_id": database_record_id}
+        return {"status": "done", "audio_url": audio_url, "video_url": video_url, "database_id": database_record_id}
 
     except HTTPException as e:
         # Update database record with failure status
         if database_record_id:
             try:
-                supabase.table("user_generations").update({"status": "failed", "error_message": str(e.detail)}).eq("id", database_record_id).execute()
-            except Exception as db_update_error:
+                await storage.update_record(
+                    GENERATIONS_TABLE, database_record_id, {"status": "failed", "error_message": str(e.detail)}
+                )
+            except StorageError as db_update_error:
                 print(f"Error updating database with failure status: {db_update_error}")
         raise e
-    except subprocess.CalledProcessError as e:
-        # Update database record with failure status
-        if database_record_id:
-            try:
-                supabase.table("user_generations").update({"status": "failed", "error_message": f"MMAudio script failed: {e.stderr}"}).eq("id", database_record_id).execute()
-            except Exception as db_update_error:
-                print(f"Error updating database with subprocess failure status: {db_update_error}")
-        raise HTTPException(status_code=500, detail=f"MMAudio script failed: {e.stderr}")
     except Exception as e:
         # Update database record with failure status
         if database_record_id:
             try:
-                supabase.table("user_generations").update({"status": "failed", "error_message": str(e)}).eq("id", database_record_id).execute()
-            except Exception as db_update_error:
+                await storage.update_record(
+                    GENERATIONS_TABLE, database_record_id, {"status": "failed", "error_message": str(e)}
+                )
+            except StorageError as db_update_error:
                 print(f"Error updating database with general failure status: {db_update_error}")
         raise HTTPException(status_code=500, detail=str(e))
     finally:
-        # Clean up temporary files
-        for temp_file in temp_files:
-            try:
-                if os.path.exists(temp_file):
-                    os.remove(temp_file)
-            except Exception as e:
-                print(f"Error cleaning up temporary file {temp_file}: {e}")
+        # Don't sample for a request that has already failed, if sampling has not started yet
+        if job is not None:
+            job.cancel()
+
+@app.post("/jobs", status_code=202)
+async def create_job(
+    prompt: str = Form(...),
+    negative_prompt: str = Form(""),
+    duration: float = Form(8.0),
+    start_sec: float = Form(0.0),
+    num_steps: int = Form(25),
+    sampler: str = Form("euler"),
+    schedule: str = Form("uniform"),
+    cache_threshold: float = Form(0.0),
+    cfg_strength: float = Form(4.5),
+    cfg_interval_start: float = Form(0.0),
+    cfg_interval_end: float = Form(1.0),
+    cfg_schedule: str = Form("constant"),
+    seed: int = Form(42),
+    num_samples: int = Form(1),
+    priority: int = Form(0),
+    store: bool = Form(False),
+    video: UploadFile = File(None)
+):
+    temp_video_path = video_hash = None
+    if video:
+        temp_video_path, video_hash = await save_video_upload(video)
+
+    inference_request = InferenceRequest(
+        prompt=prompt,
+        negative_prompt=negative_prompt,
+        start_sec=start_sec,
+        duration=duration,
+        num_steps=num_steps,
+        sampler=sampler,
+        schedule=schedule,
+        cache_threshold=cache_threshold,
+        cfg_strength=cfg_strength,
+        cfg_interval=(cfg_interval_start, cfg_interval_end),
+        cfg_schedule=cfg_schedule,
+        seed=seed,
+        num_samples=num_samples,
+        video_path=temp_video_path,
+        video_hash=video_hash,
+    )
+    try:
+        job = submit_job(inference_request, priority=priority)
+    except HTTPException:
+        if temp_video_path:
+            remove_file(temp_video_path)
+        raise
+
+    if temp_video_path:
+        remove_file_when_done(temp_video_path, job.future)
+    if store:
+        # the URL shows up as output_url in the job status once the upload is done
+        store_job_output_when_done(job, asyncio.get_running_loop())
+    return {"id": job.id, "status": job.status}
+
+def get_job_or_404(job_id: str):
+    job = app.state.worker.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = get_job_or_404(job_id)
+    status = job.to_dict()
+    status["queue_position"] = app.state.worker.queue.position(job)
+    return status
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str, sample: int = 0):
+    job = get_job_or_404(job_id)
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=f"Job failed: {job.error}")
+    if job.status == "cancelled":
+        raise HTTPException(status_code=409, detail="Job was cancelled")
+    if not job.done:
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    if not 0 <= sample < len(job.result.audio):
+        raise HTTPException(status_code=404, detail=f"Job has no sample {sample}")
+
+    content = await asyncio.get_running_loop().run_in_executor(
+        app.state.output_executor, encode_audio, job.result.audio[sample:sample + 1], job.result.sampling_rate
+    )
+    return Response(content=content, media_type="audio/flac")
+
+async def stream_job_audio(job: Job, format: str, bit_depth: int, sample: int,
+                           owned: bool = False) -> StreamingResponse:
+    """
+    Wait for a job and stream its audio, encoded chunk by chunk straight from memory.
+    Only a job owned by the request (submitted by it) is cancelled when its client disconnects.
+    """
+    try:
+        audio_format = get_audio_format(format, bit_depth)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not 0 <= sample < job.request.num_samples:
+        raise HTTPException(status_code=404, detail=f"Job has no sample {sample}")
+
+    try:
+        # shielded so that a disconnecting client does not cancel the job's future behind its back
+        result = await asyncio.shield(asyncio.wrap_future(job.future))
+    except asyncio.CancelledError:
+        if job.future.cancelled():
+            raise HTTPException(status_code=409, detail="Job was cancelled")
+        if owned:
+            # nobody else is waiting for it; a job that has started sampling runs to completion
+            job.cancel()
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Job failed: {e}")
+
+    chunks = iter_encoded_audio(result.audio[sample:sample + 1], result.sampling_rate, format, bit_depth)
+    return StreamingResponse(chunks, media_type=audio_format.media_type)
+
+@app.get("/jobs/{job_id}/stream")
+async def stream_job_result(job_id: str, format: str = "flac", bit_depth: int = 16, sample: int = 0):
+    """Stream the audio of a job as soon as it is generated; waits for the job if it is not done yet."""
+    return await stream_job_audio(get_job_or_404(job_id), format, bit_depth, sample)
+
+@app.post("/generate_stream")
+async def generate_stream(
+    prompt: str = Form(...),
+    negative_prompt: str = Form(""),
+    duration: float = Form(8.0),
+    start_sec: float = Form(0.0),
+    num_steps: int = Form(25),
+    sampler: str = Form("euler"),
+    schedule: str = Form("uniform"),
+    cache_threshold: float = Form(0.0),
+    cfg_strength: float = Form(4.5),
+    cfg_interval_start: float = Form(0.0),
+    cfg_interval_end: float = Form(1.0),
+    cfg_schedule: str = Form("constant"),
+    seed: int = Form(42),
+    format: str = Form("flac"),
+    bit_depth: int = Form(16),
+    video: UploadFile = File(None)
+):
+    """Generate audio and stream it back in the response, without storing it anywhere."""
+    try:
+        get_audio_format(format, bit_depth)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    temp_video_path = video_hash = None
+    if video:
+        temp_video_path, video_hash = await save_video_upload(video)
+
+    inference_request = InferenceRequest(
+        prompt=prompt,
+        negative_prompt=negative_prompt,
+        start_sec=start_sec,
+        duration=duration,
+        num_steps=num_steps,
+        sampler=sampler,
+        schedule=schedule,
+        cache_threshold=cache_threshold,
+        cfg_strength=cfg_strength,
+        cfg_interval=(cfg_interval_start, cfg_interval_end),
+        cfg_schedule=cfg_schedule,
+        seed=seed,
+        video_path=temp_video_path,
+        video_hash=video_hash,
+    )
+    try:
+        job = submit_job(inference_request)
+    except HTTPException:
+        if temp_video_path:
+            remove_file(temp_video_path)
+        raise
+    if temp_video_path:
+        remove_file_when_done(temp_video_path, job.future)
+    return await stream_job_audio(job, format, bit_depth, sample=0, owned=True)
 
 # Add health check endpoint
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
 
+# Queue and cache counters for monitoring
+@app.get("/stats")
+async def stats():
+    return app.state.worker.stats()
+
 @app.get("/")
 async def root():
     return {"message": "MMAudio API is running"}